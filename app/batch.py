@@ -0,0 +1,83 @@
+import asyncio
+import json
+import uuid
+from typing import AsyncIterator, Dict, List, Type
+
+from llama_index.core.workflow import Workflow
+
+from workflows.shared.cypher_cache import normalize_question
+from workflows.shared.cypher_executor import BatchCypherExecutor
+from workflows.shared.llm_scheduler import BATCH, llm_request
+
+DEFAULT_BATCH_CONCURRENCY = 4
+MAX_BATCH_CONCURRENCY = 16
+MAX_BATCH_QUESTIONS = 1000
+
+
+async def run_batch(
+    workflow_class: Type[Workflow],
+    llm,
+    db: dict,
+    embed_model,
+    questions: List[str],
+    concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    timeout: float = 60,
+) -> AsyncIterator[str]:
+    """
+    Run a workflow for every question of a batch and yield one JSON line per
+    question as soon as its run is done, in completion order.
+
+    Questions that only differ in case, whitespace or trailing punctuation run
+    once and share the result, and the runs share the records of identical
+    Cypher statements.
+
+    :param concurrency: Workflow runs in flight at once
+    :param timeout: Timeout of each workflow run in seconds
+    """
+    # Only the executor differs, so statements are shared within this batch only
+    batch_db = {**db, "executor": BatchCypherExecutor(db["executor"])}
+    semaphore = asyncio.Semaphore(concurrency)
+    # The whole batch is one session, so it takes turns with other batches
+    session = uuid.uuid4().hex
+
+    indexes: Dict[str, List[int]] = {}
+    for index, question in enumerate(questions):
+        indexes.setdefault(normalize_question(question), []).append(index)
+
+    async def run_one(question: str):
+        async with semaphore:
+            workflow = workflow_class(
+                llm=llm, db=batch_db, embed_model=embed_model, timeout=timeout
+            )
+            with llm_request(BATCH, session):
+                handler = workflow.run(input=question)
+            try:
+                return await asyncio.shield(handler)
+            except asyncio.CancelledError:
+                # Stop the run through its context, cancelling the handler only logs errors
+                await handler.cancel_run()
+                raise
+
+    tasks = {
+        asyncio.create_task(run_one(questions[group[0]])): group
+        for group in indexes.values()
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                try:
+                    item = {"result": task.result()}
+                except Exception as ex:
+                    item = {"error": f"Failed to run workflow.\n\n{ex}"}
+                for index in tasks[task]:
+                    line = {"index": index, "question": questions[index], **item}
+                    yield json.dumps(line) + "\n"
+    finally:
+        # The client went away, don't leave the remaining runs going
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -1,33 +1,62 @@
+import asyncio
 import json
-from typing import Type
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Type
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from llama_index.core.workflow import Workflow
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from app.batch import (
+    DEFAULT_BATCH_CONCURRENCY,
+    MAX_BATCH_CONCURRENCY,
+    MAX_BATCH_QUESTIONS,
+    run_batch,
+)
 from app.resource_manager import ResourceManager
 from app.settings import WORKFLOW_MAP
 from app.utils import urlx_for
+from workflows.shared.llm_scheduler import INTERACTIVE, llm_request
+from workflows.shared.metrics import render_metrics
+from workflows.shared.sse_event import StepMetricsEvent
 
 load_dotenv()
 
 templates = Jinja2Templates(directory="app/templates")
 templates.env.globals["url_for"] = urlx_for
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# Databases are loaded in the background, so the app serves right away
+resource_manager = ResourceManager(load=False)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_task = asyncio.create_task(resource_manager.aload())
+    schema_refresh_task = asyncio.create_task(
+        resource_manager.refresh_schemas_periodically()
+    )
+    yield
+    load_task.cancel()
+    schema_refresh_task.cancel()
+    # Write self-learned fewshot examples that are still queued
+    if resource_manager.neo4j_fewshot_manager:
+        await resource_manager.neo4j_fewshot_manager.flush()
+    await resource_manager.driver_pool.close()
+
 
-resource_manager = ResourceManager()
+app = FastAPI(lifespan=lifespan)
+app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 
 @app.get("/", response_class=HTMLResponse)
 async def get_index(request: Request):
     workflows = list(WORKFLOW_MAP.keys())
-    llms_list = [name for name, _ in resource_manager.llms]
+    llms_list = resource_manager.llm_names
     databases_list = list(resource_manager.databases.keys())
 
     return templates.TemplateResponse(
@@ -41,6 +70,65 @@ async def get_index(request: Request):
     )
 
 
+@app.get("/ready")
+async def ready():
+    if not resource_manager.ready:
+        raise HTTPException(status_code=503, detail="Loading databases")
+    return {"databases": list(resource_manager.databases.keys())}
+
+
+@app.post("/schema/invalidate")
+async def invalidate_schema(database: str | None = None):
+    if database and database not in resource_manager.databases:
+        raise HTTPException(status_code=404, detail=f"Unknown database '{database}'")
+
+    await resource_manager.refresh_schemas(database)
+
+    return {
+        name: db["schema_cache"].version
+        for name, db in resource_manager.databases.items()
+        if "schema_cache" in db
+    }
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "cypher_generation": resource_manager.cypher_cache.stats(),
+        "query_results": {
+            name: db["executor"].result_cache.stats()
+            for name, db in resource_manager.databases.items()
+            if db.get("executor") and db["executor"].result_cache
+        },
+    }
+
+
+@app.post("/cache/invalidate")
+async def invalidate_query_results(database: str | None = None):
+    if database and database not in resource_manager.databases:
+        raise HTTPException(status_code=404, detail=f"Unknown database '{database}'")
+
+    for name, db in resource_manager.databases.items():
+        if database and name != database:
+            continue
+        if db.get("executor") and db["executor"].result_cache:
+            db["executor"].result_cache.invalidate()
+
+    return await cache_stats()
+
+
+@app.get("/llm/stats")
+async def llm_stats():
+    return resource_manager.llm_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 class WorkflowPayload(BaseModel):
     llm: str
     database: str
@@ -66,6 +154,57 @@ async def workflow(payload: WorkflowPayload):
     )
 
 
+class BatchWorkflowPayload(BaseModel):
+    llm: str
+    database: str
+    workflow: str
+    questions: List[str] = Field(min_length=1, max_length=MAX_BATCH_QUESTIONS)
+    concurrency: int = Field(
+        default=DEFAULT_BATCH_CONCURRENCY, ge=1, le=MAX_BATCH_CONCURRENCY
+    )
+
+
+@app.post("/workflow/batch")
+async def workflow_batch(payload: BatchWorkflowPayload):
+    workflow_class: Type[Workflow] = WORKFLOW_MAP.get(payload.workflow)
+    if not workflow_class:
+        raise HTTPException(
+            status_code=404, detail=f"Workflow '{payload.workflow}' is not recognized."
+        )
+    if not resource_manager.ready:
+        raise HTTPException(status_code=503, detail="Loading databases")
+    if payload.database not in resource_manager.databases:
+        raise HTTPException(
+            status_code=404, detail=f"Unknown database '{payload.database}'"
+        )
+    selected_database = resource_manager.get_database_by_name(payload.database)
+    # Errors inside the stream would come after the 200, so check up front
+    if not selected_database.get("executor"):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Database '{payload.database}' can't run workflows",
+        )
+    # Clients are created on first use and some check the model over the network
+    selected_llm = await asyncio.to_thread(
+        resource_manager.get_model_by_name, payload.llm
+    )
+    if selected_llm is None:
+        raise HTTPException(status_code=404, detail=f"Unknown LLM '{payload.llm}'")
+
+    # One JSON line per question instead of an event stream per question
+    return StreamingResponse(
+        run_batch(
+            workflow_class,
+            llm=selected_llm,
+            db=selected_database,
+            embed_model=resource_manager.embed_model,
+            questions=payload.questions,
+            concurrency=payload.concurrency,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
 # Main workflow runner function
 async def run_workflow(llm: str, database: str, workflow: str, context: dict):
     try:
@@ -73,7 +212,10 @@ async def run_workflow(llm: str, database: str, workflow: str, context: dict):
         if not workflow_class:
             raise ValueError(f"Workflow '{workflow}' is not recognized.")
         print(f"WORKFLOW CLASS SELECTED: {workflow_class}")
-        selected_llm = resource_manager.get_model_by_name(llm)
+        if not resource_manager.ready:
+            raise ValueError("The databases are still loading, try again shortly.")
+        # Clients are created on first use and some check the model over the network
+        selected_llm = await asyncio.to_thread(resource_manager.get_model_by_name, llm)
         selected_database = resource_manager.get_database_by_name(database)
         print(f"Selected LLM: {selected_llm}")
         print(f"Selected Database: {selected_database}")
@@ -86,18 +228,20 @@ async def run_workflow(llm: str, database: str, workflow: str, context: dict):
         )
         print("WORKFLOW INSTANCE CREATED")
 
-        handler = workflow_instance.run(**context)
+        # Each request is its own session, served before batch runs
+        with llm_request(INTERACTIVE, uuid.uuid4().hex):
+            handler = workflow_instance.run(**context)
 
         async for event in handler.stream_events():
             if type(event).__name__ != "StopEvent":
-                event_data = json.dumps(
-                    {
-                        "event_type": type(event).__name__,
-                        "label": event.label,
-                        "message": event.message,
-                    }
-                )
-                yield f"data: {event_data}\n\n"
+                event_data = {
+                    "event_type": type(event).__name__,
+                    "label": event.label,
+                    "message": event.message,
+                }
+                if isinstance(event, StepMetricsEvent):
+                    event_data["metrics"] = event.metrics
+                yield f"data: {json.dumps(event_data)}\n\n"
 
         result = await handler
 
@@ -1,152 +1,430 @@
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict
 
-from google.api_core import retry
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.graph_stores.neo4j import Neo4jPropertyGraphStore, Schema
-from llama_index.llms.anthropic import Anthropic
-from llama_index.llms.gemini import Gemini
-from llama_index.llms.mistralai import MistralAI
-from llama_index.llms.openai import OpenAI
-from llama_index.llms.openai_like import OpenAILike
+from llama_index.core.llms import LLM
+from llama_index.graph_stores.neo4j import (
+    CypherQueryCorrector,
+    Neo4jPropertyGraphStore,
+    Schema,
+)
+
+from workflows.shared.cached_embedding import (
+    DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES,
+    CachedEmbedding,
+)
+from workflows.shared.cypher_cache import (
+    DEFAULT_CACHE_MAX_ENTRIES,
+    DEFAULT_CACHE_TTL,
+    CypherGenerationCache,
+)
+from workflows.shared.cypher_executor import (
+    DEFAULT_MAX_CONCURRENT_QUERIES,
+    DEFAULT_QUERY_TIMEOUT,
+    CypherExecutor,
+)
+from workflows.shared.cypher_validator import CypherValidator
+from workflows.shared.driver_pool import (
+    DEFAULT_CONNECTION_ACQUISITION_TIMEOUT,
+    DEFAULT_LIVENESS_CHECK_TIMEOUT,
+    DEFAULT_MAX_CONNECTION_POOL_SIZE,
+    DriverPool,
+)
+from workflows.shared.llm_router import RoutedLLM
+from workflows.shared.llm_scheduler import (
+    DEFAULT_LLM_MAX_CONCURRENCY,
+    LLMScheduler,
+    parse_provider_limits,
+)
+from workflows.shared.local_fewshot_manager import LocalFewshotManager
+from workflows.shared.neo4j_fewshot_manager import Neo4jFewshotManager
+from workflows.shared.plan_scheduler import (
+    DEFAULT_MAX_CONCURRENT_SUBQUERIES,
+    PlanScheduler,
+)
+from workflows.shared.query_result_cache import (
+    DEFAULT_RESULT_CACHE_MAX_BYTES,
+    QueryResultCache,
+)
+from workflows.shared.schema_cache import SchemaCache
+from workflows.shared.schema_snapshot import SchemaSnapshotStore, structure_fingerprint
+from workflows.shared.speculative_generation import SpeculativeCypherGenerator
+
+DEFAULT_SCHEMA_REFRESH_INTERVAL = 3600
+
+
+# Provider SDKs take seconds to import, so they are imported with the first client
+def openai_llm(**kwargs) -> LLM:
+    from llama_index.llms.openai import OpenAI
+
+    return OpenAI(**kwargs)
+
+
+def gemini_llm(**kwargs) -> LLM:
+    from google.api_core import exceptions, retry
+    from llama_index.llms.gemini import Gemini
+
+    # Rate limit errors are left to the LLM scheduler, which holds back all
+    # calls to the provider instead of each request sleeping on its own
+    return Gemini(
+        request_options=dict(
+            retry=retry.Retry(
+                predicate=retry.if_exception_type(
+                    exceptions.InternalServerError, exceptions.ServiceUnavailable
+                ),
+                initial=0.1,
+                multiplier=2,
+                timeout=20,
+            )
+        ),
+        **kwargs,
+    )
+
+
+def anthropic_llm(**kwargs) -> LLM:
+    from llama_index.llms.anthropic import Anthropic
+
+    return Anthropic(**kwargs)
+
+
+def mistral_llm(**kwargs) -> LLM:
+    from llama_index.llms.mistralai import MistralAI
+
+    return MistralAI(**kwargs)
+
+
+def openai_like_llm(**kwargs) -> LLM:
+    from llama_index.llms.openai_like import OpenAILike
+
+    return OpenAILike(**kwargs)
 
 
 class ResourceManager:
-    llms = []
     databases = {}
     embed_model = None
+    local_fewshot_manager = None
+    neo4j_fewshot_manager = None
+    cypher_cache = None
+    driver_pool = None
+    schema_snapshots = None
+    speculative_generator = None
+    plan_scheduler = None
+    llm_scheduler = None
+    # Set once the fewshot managers, databases and embed model are loaded
+    ready = False
 
-    def __init__(self):
+    def __init__(self, load: bool = True):
+        """
+        :param load: Load the databases right away, otherwise call load() or
+            aload(), e.g. in the background while the app starts serving
+        """
+        self.llm_factories: Dict[str, Callable[[], LLM]] = {}
+        self._llm_instances: Dict[str, LLM] = {}
+        # Structure fingerprints of the schemas restored from snapshots, by database
+        self._snapshot_fingerprints: Dict[str, str] = {}
+        self.init_driver_pool()
+        self.init_schema_snapshots()
+        self.init_llm_scheduler()
         self.init_llms()
-        self.init_databases()
+        self.init_auto_llm()
+        self.init_cypher_cache()
+        self.init_speculative_generator()
+        self.init_plan_scheduler()
+        if load:
+            self.load()
+
+    def load(self) -> None:
+        self.init_fewshot_managers()
         self.init_embed_model()
+        self.init_fewshot_index()
+        self.init_databases()
+        self.ready = True
+        for name in list(self._snapshot_fingerprints):
+            self.revalidate_schema(name)
 
-    def init_llms(self):
-        print("> Initializing all llms. This may take some time...")
+    async def aload(self) -> None:
+        # Everything here uses the sync driver or reads files, keep it off the event loop
+        await asyncio.to_thread(self.init_fewshot_managers)
+        await asyncio.to_thread(self.init_embed_model)
+        print("> Initializing all databases.")
+        await asyncio.gather(
+            self.ainit_fewshot_index(),
+            *[
+                asyncio.to_thread(self.init_database, name)
+                for name in self.demo_database_names()
+            ],
+        )
+        self.init_default_database()
+        print(f"Loaded {len(self.databases)} databases.")
+        self.ready = True
+        await asyncio.gather(
+            *[
+                asyncio.to_thread(self.revalidate_schema, name)
+                for name in list(self._snapshot_fingerprints)
+            ]
+        )
+
+    @property
+    def llm_names(self) -> list[str]:
+        return list(self.llm_factories)
+
+    @property
+    def llms(self) -> list[tuple[str, LLM]]:
+        # Creates every client, only meant for benchmarks
+        return [(name, self.get_model_by_name(name)) for name in self.llm_factories]
 
+    def init_llm_scheduler(self):
+        # Calls of all LLMs of a provider share its concurrency limit and budgets
+        self.llm_scheduler = LLMScheduler(
+            max_concurrency=int(
+                os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_LLM_MAX_CONCURRENCY)
+            ),
+            requests_per_minute=parse_provider_limits(
+                os.getenv("LLM_REQUESTS_PER_MINUTE")
+            ),
+            tokens_per_minute=parse_provider_limits(os.getenv("LLM_TOKENS_PER_MINUTE")),
+        )
+
+    def init_llms(self):
+        # Only the factories are registered, clients are created on first use
         if os.getenv("OPENAI_API_KEY"):
-            self.llms.extend(
-                [
-                    ("gpt-4o", OpenAI(model="gpt-4o", temperature=0)),
-                ]
+            self.llm_factories["gpt-4o"] = partial(
+                openai_llm, model="gpt-4o", temperature=0
             )
 
         if os.getenv("GOOGLE_API_KEY"):
-            google_retry = dict(
-                retry=retry.Retry(initial=0.1, multiplier=2, timeout=61)
+            self.llm_factories["gemini-1.5-pro"] = partial(
+                gemini_llm, model="models/gemini-1.5-pro", temperature=0
             )
-            self.llms.extend(
-                [
-                    (
-                        "gemini-1.5-pro",
-                        Gemini(
-                            model="models/gemini-1.5-pro",
-                            temperature=0,
-                            request_options=google_retry,
-                        ),
-                    ),
-                    (
-                        "gemini-1.5-flash",
-                        Gemini(
-                            model="models/gemini-1.5-flash",
-                            temperature=0,
-                            request_options=google_retry,
-                        ),
-                    ),
-                ]
+            self.llm_factories["gemini-1.5-flash"] = partial(
+                gemini_llm, model="models/gemini-1.5-flash", temperature=0
             )
 
         if os.getenv("ANTHROPIC_API_KEY"):
-            self.llms.extend(
-                [
-                    (
-                        "sonnet-3.5",
-                        Anthropic(
-                            model="claude-3-5-sonnet-latest",
-                            max_tokens=8076,
-                        ),
-                    ),
-                    (
-                        "haiku-3.5",
-                        Anthropic(
-                            model="claude-3-5-haiku-latest",
-                            max_tokens=8076,
-                        ),
-                    ),
-                ]
+            self.llm_factories["sonnet-3.5"] = partial(
+                anthropic_llm, model="claude-3-5-sonnet-latest", max_tokens=8076
+            )
+            self.llm_factories["haiku-3.5"] = partial(
+                anthropic_llm, model="claude-3-5-haiku-latest", max_tokens=8076
             )
 
         if os.getenv("MISTRAL_API_KEY"):
-            self.llms.extend(
-                [
-                    (
-                        "mistral-medium",
-                        MistralAI(
-                            model="mistral-medium",
-                            api_key=os.getenv("MISTRAL_API_KEY"),
-                        ),
-                    ),
-                    (
-                        "mistral-large",
-                        MistralAI(
-                            model="mistral-large-latest",
-                            api_key=os.getenv("MISTRAL_API_KEY"),
-                        ),
-                    ),
-                    (
-                        "ministral-8b",
-                        MistralAI(
-                            model="ministral-8b-latest",
-                            api_key=os.getenv("MISTRAL_API_KEY"),
-                        ),
-                    ),
-                ]
-            )
+            for name, model in [
+                ("mistral-medium", "mistral-medium"),
+                ("mistral-large", "mistral-large-latest"),
+                ("ministral-8b", "ministral-8b-latest"),
+            ]:
+                self.llm_factories[name] = partial(
+                    mistral_llm, model=model, api_key=os.getenv("MISTRAL_API_KEY")
+                )
 
         if os.getenv("DEEPSEEK_API_KEY"):
-            self.llms.extend(
-                [
-                    (
-                        "deepseek-v3",
-                        OpenAILike(
-                            model="deepseek-chat",
-                            api_base="https://api.deepseek.com/beta",
-                            api_key=os.getenv("DEEPSEEK_API_KEY"),
-                        ),
-                    )
-                ]
+            self.llm_factories["deepseek-v3"] = partial(
+                openai_like_llm,
+                model="deepseek-chat",
+                api_base="https://api.deepseek.com/beta",
+                api_key=os.getenv("DEEPSEEK_API_KEY"),
             )
 
-        print(f"Loaded {len(self.llms)} llms.")
+        print(f"Registered {len(self.llm_factories)} llms.")
 
-    def init_databases(self):
-        print("> Initializing all databases. This may take some time...")
+    def init_auto_llm(self):
+        # Routes between the configured LLMs, all of them by default
+        def names(variable: str) -> list[str]:
+            return [
+                name
+                for name in os.getenv(variable, "").split(",")
+                if name in self.llm_factories
+            ]
+
+        accurate = names("AUTO_LLM_ACCURATE") or list(self.llm_factories)
+        fast = names("AUTO_LLM_FAST") or accurate
+        if len({*accurate, *fast}) < 2:
+            return
+        self.llm_factories["auto"] = partial(
+            RoutedLLM, accurate=accurate, fast=fast, get_llm=self.get_model_by_name
+        )
+
+    def init_driver_pool(self):
+        # All graph stores on NEO4J_URI and the fewshot database share drivers
+        self.driver_pool = DriverPool(
+            max_connection_pool_size=int(
+                os.getenv(
+                    "NEO4J_MAX_CONNECTION_POOL_SIZE", DEFAULT_MAX_CONNECTION_POOL_SIZE
+                )
+            ),
+            connection_acquisition_timeout=float(
+                os.getenv(
+                    "NEO4J_CONNECTION_ACQUISITION_TIMEOUT",
+                    DEFAULT_CONNECTION_ACQUISITION_TIMEOUT,
+                )
+            ),
+            liveness_check_timeout=float(
+                os.getenv("NEO4J_LIVENESS_CHECK_TIMEOUT", DEFAULT_LIVENESS_CHECK_TIMEOUT)
+            ),
+        )
+
+    def init_schema_snapshots(self):
+        if os.getenv("SCHEMA_SNAPSHOT_DIR"):
+            self.schema_snapshots = SchemaSnapshotStore(os.getenv("SCHEMA_SNAPSHOT_DIR"))
+
+    def init_fewshot_managers(self):
+        # Shared by all workflow instances, so the parquet file is read and
+        # the fewshot driver is opened only once
+        self.local_fewshot_manager = LocalFewshotManager()
+        self.neo4j_fewshot_manager = Neo4jFewshotManager(self.driver_pool)
+
+    def init_fewshot_index(self):
+        # Embeds the local examples now instead of on the first request
+        try:
+            self.local_fewshot_manager.build_index(self.embed_model)
+        except Exception as ex:
+            print(f"Local fewshot examples not embedded, retrying on first use: {ex}")
+
+    async def ainit_fewshot_index(self):
+        try:
+            await self.local_fewshot_manager.abuild_index(self.embed_model)
+        except Exception as ex:
+            print(f"Local fewshot examples not embedded, retrying on first use: {ex}")
+
+    def init_cypher_cache(self):
+        similarity_threshold = os.getenv("CYPHER_CACHE_SIMILARITY_THRESHOLD")
+        self.cypher_cache = CypherGenerationCache(
+            path=os.getenv("CYPHER_CACHE_PATH"),
+            ttl=float(os.getenv("CYPHER_CACHE_TTL", DEFAULT_CACHE_TTL)),
+            max_entries=int(
+                os.getenv("CYPHER_CACHE_MAX_ENTRIES", DEFAULT_CACHE_MAX_ENTRIES)
+            ),
+            similarity_threshold=(
+                float(similarity_threshold) if similarity_threshold else None
+            ),
+        )
+
+    def demo_database_names(self) -> list[str]:
         demo_databases = os.getenv("NEO4J_DEMO_DATABASES")
+        return demo_databases.split(",") if demo_databases else []
 
-        if demo_databases != None:
-            demo_databases = demo_databases.split(",")
-            for db in demo_databases:
-                print(f"-> Initializing demo database: {db}")
-                try:
-                    graph_store = Neo4jPropertyGraphStore(
-                        url=os.getenv("NEO4J_URI"),
-                        username=os.getenv("NEO4J_USERNAME"),
-                        password=os.getenv("NEO4J_PASSWORD"),
-                        database=os.getenv("NEO4J_DATABASE"),
-                        enhanced_schema=True,
-                        create_indexes=False,
-                        timeout=30,
-                    )
-                    print(f"-> Getting corrector schema for {db} database.")
-                    corrector_schema = self.get_corrector_schema(graph_store)
+    def init_speculative_generator(self):
+        # Off unless LLMs to generate alongside the selected one are configured
+        llm_names = [
+            name
+            for name in os.getenv("SPECULATIVE_CYPHER_LLMS", "").split(",")
+            if name in self.llm_factories
+        ]
+        self.speculative_generator = SpeculativeCypherGenerator(
+            llm_names, get_llm=self.get_model_by_name
+        )
+
+    def init_plan_scheduler(self):
+        # Shared by all databases, the limit is for the whole process
+        self.plan_scheduler = PlanScheduler(
+            max_concurrency=int(
+                os.getenv(
+                    "PLAN_MAX_CONCURRENT_SUBQUERIES", DEFAULT_MAX_CONCURRENT_SUBQUERIES
+                )
+            )
+        )
+
+    def init_databases(self):
+        print("> Initializing all databases.")
+        # Introspection is mostly waiting on the database, so do it concurrently
+        names = self.demo_database_names()
+        if names:
+            with ThreadPoolExecutor(max_workers=len(names)) as pool:
+                list(pool.map(self.init_database, names))
+        self.init_default_database()
+        print(f"Loaded {len(self.databases)} databases.")
+
+    def init_database(self, db: str) -> None:
+        print(f"-> Initializing demo database: {db}")
+        try:
+            snapshot = None
+            if self.schema_snapshots:
+                snapshot = self.schema_snapshots.load(*self.database_identity())
+            graph_store = self.driver_pool.graph_store(
+                uri=os.getenv("NEO4J_URI"),
+                username=os.getenv("NEO4J_USERNAME"),
+                password=os.getenv("NEO4J_PASSWORD"),
+                database=os.getenv("NEO4J_DATABASE"),
+                enhanced_schema=True,
+                refresh_schema=snapshot is None,
+                timeout=30,
+            )
+            if snapshot:
+                # Revalidated against the database once the app is ready
+                print(f"-> Restoring schema of {db} database from snapshot.")
+                graph_store.structured_schema = snapshot["schema"]
+                corrector_schema = [Schema(*el) for el in snapshot["corrector_schema"]]
+                self._snapshot_fingerprints[db] = snapshot["fingerprint"]
+            else:
+                print(f"-> Getting corrector schema for {db} database.")
+                corrector_schema = self.get_corrector_schema(graph_store)
+
+            executor = self.get_cypher_executor(graph_store, db)
+            schema_cache = SchemaCache(graph_store, snapshot=snapshot)
 
-                    self.databases[db] = {
-                        "graph_store": graph_store,
-                        "corrector_schema": corrector_schema,
-                        "name": db,
-                    }
-                except Exception as ex:
-                    print(ex)
+            self.databases[db] = {
+                "graph_store": graph_store,
+                "corrector_schema": corrector_schema,
+                "cypher_query_corrector": CypherQueryCorrector(corrector_schema),
+                "local_fewshot_manager": self.local_fewshot_manager,
+                "neo4j_fewshot_manager": self.neo4j_fewshot_manager,
+                "cypher_cache": self.cypher_cache,
+                "speculative_generator": self.speculative_generator,
+                "plan_scheduler": self.plan_scheduler,
+                "executor": executor,
+                "schema_cache": schema_cache,
+                "cypher_validator": CypherValidator(
+                    schema_cache,
+                    executor,
+                    read_only=os.getenv("NEO4J_READ_ONLY", "true").lower() == "true",
+                ),
+                "name": db,
+            }
+            if snapshot is None:
+                self.save_schema_snapshot(db)
+        except Exception as ex:
+            print(ex)
+
+    def database_identity(self) -> tuple:
+        # Demo databases all connect with the NEO4J_* settings
+        return (
+            os.getenv("NEO4J_URI"),
+            os.getenv("NEO4J_USERNAME"),
+            os.getenv("NEO4J_DATABASE"),
+        )
+
+    def save_schema_snapshot(self, name: str) -> None:
+        if not self.schema_snapshots:
+            return
+        db = self.databases[name]
+        try:
+            self.schema_snapshots.save(
+                *self.database_identity(),
+                fingerprint=structure_fingerprint(db["graph_store"]),
+                schema_cache=db["schema_cache"],
+                corrector_schema=db["corrector_schema"],
+            )
+        except Exception as ex:
+            print(f"Failed to save schema snapshot of {name} database: {ex}")
 
+    def revalidate_schema(self, name: str) -> None:
+        """
+        Re-introspect a database restored from a snapshot if its labels,
+        relationship types or property keys changed since the snapshot.
+        """
+        fingerprint = self._snapshot_fingerprints.pop(name, None)
+        try:
+            if structure_fingerprint(self.databases[name]["graph_store"]) == fingerprint:
+                return
+            print(f"-> Schema snapshot of {name} database is stale, refreshing.")
+            self.refresh_database_schema(name)
+        except Exception as ex:
+            print(ex)
+
+    def init_default_database(self):
         if os.getenv("NEO4J_DATABASE"):
             self.databases["default"] = {
                 "uri": os.getenv("NEO4J_URI"),
@@ -155,20 +433,103 @@ class ResourceManager:
                 "password": os.getenv("NEO4J_PASSWORD"),
             }
 
-        print(f"Loaded {len(self.databases)} databases.")
-
     def init_embed_model(self):
-        self.embed_model = OpenAIEmbedding(model="text-embedding-3-small")
+        from llama_index.embeddings.openai import OpenAIEmbedding
+
+        # Retrieval and storing of fewshots embed the same question, so cache them
+        self.embed_model = CachedEmbedding(
+            OpenAIEmbedding(model="text-embedding-3-small"),
+            max_entries=int(
+                os.getenv(
+                    "EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES
+                )
+            ),
+            path=os.getenv("EMBEDDING_CACHE_PATH"),
+        )
 
     def get_model_by_name(self, name):
-        for model_name, model in self.llms:
-            if model_name == name:
-                return model
-        return None
+        if name not in self.llm_factories:
+            return None
+        if name not in self._llm_instances:
+            llm = self.llm_factories[name]()
+            # The auto LLM calls LLMs that are scheduled already
+            if not isinstance(llm, RoutedLLM):
+                llm = self.llm_scheduler.wrap(llm)
+            self._llm_instances[name] = llm
+        return self._llm_instances[name]
+
+    def llm_stats(self) -> dict:
+        stats = {"providers": self.llm_scheduler.stats()}
+        # The auto LLM only has statistics once it was used
+        if "auto" in self._llm_instances:
+            stats["auto"] = self._llm_instances["auto"].stats_dict()
+        return stats
 
     def get_database_by_name(self, name: str):
         return self.databases[name]
 
+    def refresh_database_schema(self, name: str) -> None:
+        """
+        Re-introspect the database and rebuild its cached schema strings and corrector schema.
+        """
+        db = self.databases[name]
+        db["graph_store"].refresh_schema()
+        db["corrector_schema"] = self.get_corrector_schema(db["graph_store"])
+        db["cypher_query_corrector"] = CypherQueryCorrector(db["corrector_schema"])
+        db["schema_cache"].rebuild()
+        if db["executor"].result_cache:
+            db["executor"].result_cache.invalidate()
+        self.save_schema_snapshot(name)
+
+    async def refresh_schemas(self, name: str | None = None) -> None:
+        names = [name] if name else list(self.databases.keys())
+        for db_name in names:
+            if "schema_cache" not in self.databases[db_name]:
+                continue
+            print(f"-> Refreshing schema for {db_name} database.")
+            try:
+                # Introspection uses the sync driver, keep it off the event loop
+                await asyncio.to_thread(self.refresh_database_schema, db_name)
+            except Exception as ex:
+                print(ex)
+
+    async def refresh_schemas_periodically(self) -> None:
+        interval = float(
+            os.getenv("SCHEMA_REFRESH_INTERVAL", DEFAULT_SCHEMA_REFRESH_INTERVAL)
+        )
+        if interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh_schemas()
+
+    def get_cypher_executor(
+        self, graph_store: Neo4jPropertyGraphStore, name: str
+    ) -> CypherExecutor:
+        # Result caching is opt-in per database
+        result_cache = None
+        if name in os.getenv("QUERY_RESULT_CACHE_DATABASES", "").split(","):
+            result_cache = QueryResultCache(
+                max_bytes=int(
+                    os.getenv(
+                        "QUERY_RESULT_CACHE_MAX_BYTES", DEFAULT_RESULT_CACHE_MAX_BYTES
+                    )
+                )
+            )
+
+        return CypherExecutor(
+            graph_store,
+            timeout=float(
+                os.getenv("NEO4J_QUERY_TIMEOUT", DEFAULT_QUERY_TIMEOUT)
+            ),
+            max_concurrency=int(
+                os.getenv(
+                    "NEO4J_MAX_CONCURRENT_QUERIES", DEFAULT_MAX_CONCURRENT_QUERIES
+                )
+            ),
+            result_cache=result_cache,
+        )
+
     def get_corrector_schema(
         self, graph_store: Neo4jPropertyGraphStore
     ) -> list[Schema]:
@@ -0,0 +1,105 @@
+"""
+Measures the per-request cost of building a workflow instance.
+
+Compares building the heavy collaborators on every request (the previous
+behaviour) with injecting the ones ResourceManager builds once at startup.
+Needs no LLM or Neo4j access.
+
+    python benchmark/benchmark_construction.py [iterations]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+# Insert the parent directory of "app" into sys.path
+# so that Python recognizes "workflows" as an importable package.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llama_index.graph_stores.neo4j import CypherQueryCorrector, Schema
+
+from app.settings import WORKFLOW_MAP
+from workflows.shared.local_fewshot_manager import LocalFewshotManager
+from workflows.shared.neo4j_fewshot_manager import Neo4jFewshotManager
+
+CORRECTOR_SCHEMA = [
+    Schema("Person", "ACTED_IN", "Movie"),
+    Schema("Person", "DIRECTED", "Movie"),
+    Schema("User", "RATED", "Movie"),
+    Schema("Movie", "IN_GENRE", "Genre"),
+]
+
+
+def build_db(local_fewshot_manager, neo4j_fewshot_manager, cypher_query_corrector):
+    # Workflow constructors only store these, so no live graph store is needed
+    return {
+        "graph_store": None,
+        "executor": None,
+        "schema_cache": None,
+        "cypher_cache": None,
+        "cypher_validator": None,
+        "speculative_generator": None,
+        "plan_scheduler": None,
+        "corrector_schema": CORRECTOR_SCHEMA,
+        "cypher_query_corrector": cypher_query_corrector,
+        "local_fewshot_manager": local_fewshot_manager,
+        "neo4j_fewshot_manager": neo4j_fewshot_manager,
+        "name": "recommendations",
+    }
+
+
+def time_ms(func, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(
+        f"{label:<60} mean {statistics.mean(timings):8.3f} ms   p95 {p95:8.3f} ms"
+    )
+
+
+def main(iterations: int = 200):
+    start = time.perf_counter()
+    local_fewshot_manager = LocalFewshotManager()
+    neo4j_fewshot_manager = Neo4jFewshotManager()
+    cypher_query_corrector = CypherQueryCorrector(CORRECTOR_SCHEMA)
+    startup = (time.perf_counter() - start) * 1000
+    print(f"One-off startup cost of shared collaborators: {startup:.3f} ms\n")
+
+    shared_db = build_db(
+        local_fewshot_manager, neo4j_fewshot_manager, cypher_query_corrector
+    )
+
+    for name, workflow_class in WORKFLOW_MAP.items():
+
+        def per_request():
+            db = build_db(
+                LocalFewshotManager(),
+                Neo4jFewshotManager(),
+                CypherQueryCorrector(CORRECTOR_SCHEMA),
+            )
+            workflow_class(llm=None, db=db, embed_model=None, timeout=60)
+
+        def injected():
+            workflow_class(llm=None, db=shared_db, embed_model=None, timeout=60)
+
+        try:
+            per_request()
+        except Exception as ex:
+            print(f"{name}: skipped, cannot be constructed ({ex})")
+            continue
+
+        report(f"{name} (per-request collaborators)", time_ms(per_request, iterations))
+        report(f"{name} (injected collaborators)", time_ms(injected, iterations))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,115 @@
+"""
+Compares few-shot lookup time of the full scan and the vector index by corpus size.
+
+Inserts synthetic Fewshot nodes with random embeddings into the fewshot database
+configured with FEWSHOT_NEO4J_URI / FEWSHOT_NEO4J_USERNAME / FEWSHOT_NEO4J_PASSWORD,
+and removes them again afterwards. Needs write access to that database.
+
+    python benchmark/benchmark_fewshot_lookup.py [size ...]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Insert the parent directory of "app" into sys.path
+# so that Python recognizes "workflows" as an importable package.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from workflows.shared.neo4j_fewshot_manager import (
+    FEWSHOT_INDEX_OVERSAMPLE,
+    FEWSHOT_LIMIT,
+    FEWSHOT_VECTOR_INDEX,
+    RETRIEVE_FEWSHOTS_INDEX_QUERY,
+    RETRIEVE_FEWSHOTS_QUERY,
+    Neo4jFewshotManager,
+)
+
+BENCHMARK_DATABASE = "__benchmark__"
+DIMENSIONS = 1536
+INSERT_BATCH_SIZE = 1000
+REPEATS = 20
+
+
+def random_embeddings(count: int) -> np.ndarray:
+    embeddings = np.random.default_rng().normal(size=(count, DIMENSIONS))
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def insert_examples(graph_store, start: int, end: int) -> None:
+    for batch_start in range(start, end, INSERT_BATCH_SIZE):
+        batch_end = min(batch_start + INSERT_BATCH_SIZE, end)
+        rows = [
+            {"id": f"{BENCHMARK_DATABASE}{i}", "embedding": embedding.tolist()}
+            for i, embedding in zip(
+                range(batch_start, batch_end),
+                random_embeddings(batch_end - batch_start),
+            )
+        ]
+        graph_store.structured_query(
+            """UNWIND $rows AS row
+CREATE (f:Fewshot {id: row.id, database: $database, question: row.id, cypher: ''})
+WITH f, row
+CALL db.create.setNodeVectorProperty(f, 'embedding', row.embedding)""",
+            param_map={"rows": rows, "database": BENCHMARK_DATABASE},
+        )
+
+
+def delete_examples(graph_store) -> None:
+    while graph_store.structured_query(
+        """MATCH (f:Fewshot {database: $database})
+WITH f LIMIT 5000
+DETACH DELETE f
+RETURN count(*) AS deleted""",
+        param_map={"database": BENCHMARK_DATABASE},
+    )[0]["deleted"]:
+        pass
+
+
+def time_query(graph_store, query: str) -> float:
+    timings = []
+    for embedding in random_embeddings(REPEATS):
+        param_map = {
+            "embedding": embedding.tolist(),
+            "database": BENCHMARK_DATABASE,
+            "index": FEWSHOT_VECTOR_INDEX,
+            "limit": FEWSHOT_LIMIT,
+            "candidates": FEWSHOT_LIMIT * FEWSHOT_INDEX_OVERSAMPLE,
+        }
+        start = time.perf_counter()
+        graph_store.structured_query(query, param_map=param_map)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main(sizes):
+    load_dotenv()
+    manager = Neo4jFewshotManager()
+    if not manager.graph_store:
+        sys.exit("FEWSHOT_NEO4J_USERNAME is not set, nothing to benchmark.")
+
+    graph_store = manager.graph_store
+    if not manager.ensure_vector_index(DIMENSIONS):
+        sys.exit("Could not create the fewshot vector index.")
+
+    print(f"{'examples':>10} {'scan p50 (ms)':>15} {'index p50 (ms)':>15}")
+    inserted = 0
+    try:
+        for size in sorted(sizes):
+            insert_examples(graph_store, inserted, size)
+            inserted = size
+            graph_store.structured_query("CALL db.awaitIndexes(300)")
+
+            scan = time_query(graph_store, RETRIEVE_FEWSHOTS_QUERY)
+            index = time_query(graph_store, RETRIEVE_FEWSHOTS_INDEX_QUERY)
+            print(f"{size:>10} {scan:>15.2f} {index:>15.2f}")
+    finally:
+        delete_examples(graph_store)
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [1000, 5000, 20000, 50000])
@@ -0,0 +1,144 @@
+"""
+Measures the per-request cost of preparing the prompts of the workflow steps.
+
+Compares building the chat templates and structured output wrappers on every
+step call (the previous behaviour) with the templates built at import and the
+wrappers shared per LLM and output class. Covers one run of the iterative
+planner with a single subquery and one run of the retry check flow, without
+the LLM calls themselves. Needs no LLM or Neo4j access.
+
+    python benchmark/benchmark_prompts.py [iterations]
+"""
+
+import os
+import sys
+
+# Insert the parent directory of "app" into sys.path
+# so that Python recognizes "workflows" as an importable package.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llama_index.core import ChatPromptTemplate
+from llama_index.core.llms import MockLLM
+
+from benchmark.benchmark_construction import report, time_ms
+from workflows.shared.prompt_cache import cacheable_messages
+from workflows.shared.structured_llm import structured_llm
+from workflows.steps.iterative_planner import final_answer, information_check
+from workflows.steps.iterative_planner import initial_plan
+from workflows.steps.naive_text2cypher import evaluate_answer, generate_cypher
+from workflows.steps.naive_text2cypher import summarize_answer
+
+SCHEMA = "Node properties:\n" + "\n".join(
+    f"Label{i} {{name: STRING, year: INTEGER, score: FLOAT}}" for i in range(40)
+)
+FEWSHOT_EXAMPLES = "\n".join(
+    f"Question: Example question {i}?\nCypher: MATCH (n:Label{i}) RETURN n.name"
+    for i in range(5)
+)
+QUESTION = "Which movies did Tom Hanks act in after 2000?"
+CYPHER = "MATCH (p:Person {name: 'Tom Hanks'})-[:ACTED_IN]->(m:Movie) RETURN m.title"
+CONTEXT = "title\nCast Away\nThe Terminal"
+
+
+def rebuilt(llm):
+    # Prompt preparation as every step call did it before
+    plan_prompt = ChatPromptTemplate.from_messages(
+        [("system", initial_plan.SUBQUERIES_SYSTEM_TEMPLATE), ("user", "{question}")]
+    )
+    llm.as_structured_llm(initial_plan.SubqueriesOutput)
+    plan_prompt.format(question=QUESTION)
+
+    generate_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", generate_cypher.GENERATE_SYSTEM_TEMPLATE),
+            (
+                "user",
+                generate_cypher.GENERATE_USER_PREFIX_TEMPLATE
+                + generate_cypher.GENERATE_USER_TEMPLATE,
+            ),
+        ]
+    )
+    generate_prompt.format_messages(
+        question=QUESTION, schema=SCHEMA, fewshot_examples=FEWSHOT_EXAMPLES
+    )
+
+    check_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", information_check.INFORMATION_CHECK_SYSTEM_TEMPLATE),
+            ("user", information_check.INFORMATION_CHECK_USER_TEMPLATE),
+        ]
+    )
+    llm.as_structured_llm(information_check.IFOutput)
+    check_prompt.format(
+        subqueries=CONTEXT, question=QUESTION, dynamic_notebook="", plan=[]
+    )
+
+    evaluate_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", evaluate_answer.EVALUATE_ANSWER_SYSTEM_TEMPLATE),
+            ("user", evaluate_answer.EVALUATE_ANSWER_USER_TEMPLATE),
+        ]
+    )
+    evaluate_prompt.format_messages(question=QUESTION, cypher=CYPHER, context=CONTEXT)
+
+    for system, user in (
+        (final_answer.FINAL_ANSWER_SYSTEM_TEMPLATE, final_answer.FINAL_ANSWER_USER_TEMPLATE),
+        (
+            summarize_answer.FINAL_ANSWER_SYSTEM_TEMPLATE,
+            summarize_answer.FINAL_ANSWER_USER_TEMPLATE,
+        ),
+    ):
+        ChatPromptTemplate.from_messages(
+            [("system", system), ("user", user)]
+        ).format_messages(cypher_query=CYPHER, context=CONTEXT, question=QUESTION)
+
+
+def precompiled(llm):
+    structured_llm(llm, initial_plan.SubqueriesOutput)
+    cacheable_messages(llm, initial_plan.SUBQUERIES_SYSTEM_TEMPLATE, "", QUESTION)
+
+    cacheable_messages(
+        llm,
+        generate_cypher.GENERATE_SYSTEM_TEMPLATE,
+        generate_cypher.GENERATE_USER_PREFIX_TEMPLATE.format(schema=SCHEMA),
+        generate_cypher.GENERATE_USER_TEMPLATE.format(
+            question=QUESTION, fewshot_examples=FEWSHOT_EXAMPLES
+        ),
+    )
+
+    structured_llm(llm, information_check.IFOutput)
+    cacheable_messages(
+        llm,
+        information_check.INFORMATION_CHECK_SYSTEM_TEMPLATE,
+        "",
+        information_check.INFORMATION_CHECK_USER_TEMPLATE.format(
+            subqueries=CONTEXT, question=QUESTION, dynamic_notebook="", plan=[]
+        ),
+    )
+
+    evaluate_answer.EVALUATE_ANSWER_PROMPT.format_messages(
+        question=QUESTION, cypher=CYPHER, context=CONTEXT
+    )
+
+    for prompt in (
+        final_answer.get_final_answer_prompt(),
+        summarize_answer.get_naive_final_answer_prompt(),
+    ):
+        prompt.format_messages(cypher_query=CYPHER, context=CONTEXT, question=QUESTION)
+
+
+def main(iterations: int = 2000):
+    llm = MockLLM()
+    # Warm up imports and the tokenizer before timing
+    rebuilt(llm)
+    precompiled(llm)
+
+    report("Prompts rebuilt per step call", time_ms(lambda: rebuilt(llm), iterations))
+    report(
+        "Prompts built once, wrappers shared",
+        time_ms(lambda: precompiled(llm), iterations),
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
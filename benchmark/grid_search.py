@@ -0,0 +1,314 @@
+"""
+Runs every (flow, llm) combination over test_data.csv concurrently.
+
+Questions run in parallel per provider, bounded by a concurrency limit and a
+token-bucket rate limit on LLM calls. Ground truth is computed once per database
+and cached, and every finished question is appended to a checkpoint file, so an
+interrupted grid run resumes where it stopped. Failed questions are rerun on resume. Answers in the checkpoint file can be scored
+with Ragas as in benchmark_gridsearch.ipynb.
+
+    python benchmark/grid_search.py --database recommendations \
+        --llms gpt-4o sonnet-3.5 --rate-limit OpenAI=500 Anthropic=50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Type
+
+import pandas as pd
+from dotenv import load_dotenv
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    LLMMetadata,
+)
+from llama_index.core.llms import LLM, CustomLLM
+from pydantic import BaseModel, PrivateAttr
+
+# Insert the parent directory of "app" into sys.path
+# so that Python recognizes "workflows" as an importable package.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.settings import WORKFLOW_MAP
+from workflows.shared.llm_scheduler import TokenBucket, provider_of
+
+BENCHMARK_DIR = Path(__file__).parent
+DEFAULT_CHECKPOINT = BENCHMARK_DIR / "grid_results.jsonl"
+DEFAULT_GROUND_TRUTH = BENCHMARK_DIR / "ground_truth.json"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_MINUTE = 60
+WORKFLOW_TIMEOUT = 90
+
+
+class RateLimitedLLM(CustomLLM):
+    """
+    Takes a token from the provider's bucket before every LLM call the workflows make.
+    """
+
+    model: str = ""
+
+    _llm: LLM = PrivateAttr()
+    _bucket: TokenBucket = PrivateAttr()
+
+    def __init__(self, llm: LLM, bucket: TokenBucket, **kwargs: Any):
+        super().__init__(model=llm.model, **kwargs)
+        self._llm = llm
+        self._bucket = bucket
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError("RateLimitedLLM only supports async chat calls")
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError("RateLimitedLLM only supports async chat calls")
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        await self._bucket.acquire()
+        return await self._llm.achat(messages, **kwargs)
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        await self._bucket.acquire()
+        return await self._llm.astream_chat(messages, **kwargs)
+
+    async def astructured_predict(
+        self,
+        output_cls: Type[BaseModel],
+        prompt,
+        llm_kwargs: Optional[Dict[str, Any]] = None,
+        **prompt_args: Any,
+    ) -> BaseModel:
+        await self._bucket.acquire()
+        return await self._llm.astructured_predict(
+            output_cls, prompt, llm_kwargs=llm_kwargs, **prompt_args
+        )
+
+
+async def load_ground_truth(
+    executor,
+    test_df: pd.DataFrame,
+    database: str,
+    path: Path = DEFAULT_GROUND_TRUTH,
+) -> Dict[str, str]:
+    """
+    Run each ground-truth Cypher statement once and cache the results per database.
+
+    Only successful results are cached, failed statements are retried on the next run.
+    """
+    cached = json.loads(path.read_text()) if path.exists() else {}
+    ground_truth = cached.setdefault(database, {})
+    missing = [
+        (row["Question"], row["Cypher"])
+        for _, row in test_df.iterrows()
+        if row["Question"] not in ground_truth
+    ]
+
+    async def run(question: str, cypher: str) -> Optional[str]:
+        try:
+            return str(await executor.run(cypher))
+        except Exception as ex:
+            print(f"Ground truth failed for {question!r}: {ex}")
+            return None
+
+    results = await asyncio.gather(*[run(*item) for item in missing])
+    found = {
+        question: result
+        for (question, _), result in zip(missing, results)
+        if result is not None
+    }
+    if found:
+        ground_truth.update(found)
+        path.write_text(json.dumps(cached, indent=1))
+    return ground_truth
+
+
+def load_checkpoint(path: Path) -> List[Dict[str, Any]]:
+    if not path.exists():
+        return []
+    # A line cut off by an interrupted run is dropped and that question rerun
+    results = []
+    for line in path.read_text().splitlines():
+        try:
+            results.append(json.loads(line))
+        except json.JSONDecodeError:
+            pass
+    return results
+
+
+async def run_grid(
+    flows: List[str],
+    llms: List[tuple],
+    database: str,
+    db: Dict[str, Any],
+    embed_model,
+    questions: List[str],
+    ground_truth: Dict[str, str],
+    checkpoint: Path = DEFAULT_CHECKPOINT,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rate_limits: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run all (flow, llm) combinations at once and append each result to the checkpoint.
+
+    :param llms: (name, llm) pairs as in ResourceManager.llms
+    :param database: Name of the database in db, results are checkpointed per database
+    :param rate_limits: Requests per minute by provider
+    """
+    rate_limits = rate_limits or {}
+    # Failed questions, like timeouts and rate limit errors, are run again
+    results = [
+        r
+        for r in load_checkpoint(checkpoint)
+        if r.get("database") == database and not r["error"]
+    ]
+    done = {(r["flow"], r["llm"], r["question"]) for r in results}
+
+    buckets: Dict[str, TokenBucket] = {}
+    semaphores: Dict[str, asyncio.Semaphore] = {}
+    limited_llms = []
+    for llm_name, llm in llms:
+        provider = provider_of(llm)
+        if provider not in buckets:
+            rpm = rate_limits.get(provider, DEFAULT_REQUESTS_PER_MINUTE)
+            buckets[provider] = TokenBucket(rpm / 60)
+            semaphores[provider] = asyncio.Semaphore(concurrency)
+        limited_llms.append(
+            (llm_name, provider, RateLimitedLLM(llm, buckets[provider]))
+        )
+
+    with checkpoint.open("a") as checkpoint_file:
+
+        async def run_one(flow_name: str, llm_name: str, provider: str, llm, question: str):
+            async with semaphores[provider]:
+                start = time.perf_counter()
+                error = None
+                try:
+                    workflow_instance = WORKFLOW_MAP[flow_name](
+                        llm=llm, db=db, embed_model=embed_model, timeout=WORKFLOW_TIMEOUT
+                    )
+                    data = await workflow_instance.run(input=question)
+                except Exception as ex:
+                    data = {"answer": "timeout/error", "question": question}
+                    error = str(ex)
+                result = {
+                    "database": database,
+                    "flow": flow_name,
+                    "llm": llm_name,
+                    "question": question,
+                    "answer": data.get("answer"),
+                    "cypher": data.get("cypher"),
+                    "ground_truth": ground_truth.get(question, "missing"),
+                    "latency": time.perf_counter() - start,
+                    "error": error,
+                }
+            checkpoint_file.write(json.dumps(result, default=str) + "\n")
+            checkpoint_file.flush()
+            results.append(result)
+
+        tasks = [
+            run_one(flow_name, llm_name, provider, llm, question)
+            for flow_name in flows
+            for llm_name, provider, llm in limited_llms
+            for question in questions
+            if (flow_name, llm_name, question) not in done
+        ]
+        print(f"{len(done)} results restored from {checkpoint}, {len(tasks)} to run")
+        await asyncio.gather(*tasks)
+
+    return results
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    grouped = defaultdict(list)
+    for result in results:
+        grouped[(result["flow"], result["llm"])].append(result)
+
+    print(
+        f"\n{'flow':<45} {'llm':<20} {'runs':>5} {'errors':>7} "
+        f"{'avg latency (s)':>16} {'p95 (s)':>8}"
+    )
+    for (flow, llm), rows in sorted(grouped.items()):
+        latencies = sorted(row["latency"] for row in rows)
+        p95 = latencies[round(0.95 * (len(latencies) - 1))]
+        print(
+            f"{flow:<45} {llm:<20} {len(rows):>5} "
+            f"{sum(1 for row in rows if row['error']):>7} "
+            f"{statistics.mean(latencies):>16.2f} {p95:>8.2f}"
+        )
+
+
+def parse_rate_limits(values: List[str]) -> Dict[str, float]:
+    rate_limits = {}
+    for value in values:
+        provider, _, rpm = value.partition("=")
+        rate_limits[provider] = float(rpm)
+    return rate_limits
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", default="recommendations")
+    parser.add_argument("--flows", nargs="+", choices=list(WORKFLOW_MAP))
+    parser.add_argument("--llms", nargs="+", help="LLM names, defaults to all")
+    parser.add_argument(
+        "--rate-limit",
+        nargs="+",
+        default=[],
+        metavar="PROVIDER=RPM",
+        help=f"Requests per minute by LLM client class, default {DEFAULT_REQUESTS_PER_MINUTE}",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Questions in flight per provider",
+    )
+    parser.add_argument("--checkpoint", default=str(DEFAULT_CHECKPOINT))
+    parser.add_argument("--limit", type=int, help="Only use the first N questions")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from app.resource_manager import ResourceManager
+
+    resource_manager = ResourceManager()
+    db = resource_manager.get_database_by_name(args.database)
+    llms = [
+        (name, llm)
+        for name, llm in resource_manager.llms
+        if not args.llms or name in args.llms
+    ]
+
+    test_df = pd.read_csv(BENCHMARK_DIR / "test_data.csv", delimiter=";")
+    if args.limit:
+        test_df = test_df.head(args.limit)
+    ground_truth = await load_ground_truth(db["executor"], test_df, args.database)
+
+    results = await run_grid(
+        flows=args.flows or list(WORKFLOW_MAP),
+        llms=llms,
+        database=args.database,
+        db=db,
+        embed_model=resource_manager.embed_model,
+        questions=test_df["Question"].tolist(),
+        ground_truth=ground_truth,
+        checkpoint=Path(args.checkpoint),
+        concurrency=args.concurrency,
+        rate_limits=parse_rate_limits(args.rate_limit),
+    )
+    print_results(results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
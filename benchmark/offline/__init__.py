@@ -0,0 +1,12 @@
+"""
+Offline benchmark of the workflows' orchestration overhead.
+
+Replays recorded LLM responses and graph store results, so it needs no LLM API
+and no Neo4j. Record once against live services, then replay as often as needed:
+
+    python -m benchmark.offline record --llm gpt-4o --database recommendations
+    python -m benchmark.offline replay --concurrency 4 --repeat 3
+
+Prompts or queries that are missing from the recording are answered with a
+placeholder, and counted as misses in the report.
+"""
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from app.settings import WORKFLOW_MAP
+from benchmark.offline.profiling import StepTimer
+from benchmark.offline.recorded_llm import RecordedLLM
+from benchmark.offline.recording import Recording
+from benchmark.offline.runner import build_db, load_questions, print_report, run_flow
+from benchmark.offline.stub_graph_store import StubGraphStore
+
+DEFAULT_RECORDING = Path(__file__).parent.parent / "recording.json"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmark.offline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record = subparsers.add_parser(
+        "record", help="Run the flows against live services and record the responses"
+    )
+    record.add_argument("--llm", required=True, help="LLM name as listed in the app")
+    record.add_argument("--database", default="recommendations")
+
+    replay = subparsers.add_parser(
+        "replay", help="Run the flows against the recording and report timings"
+    )
+    replay.add_argument("--concurrency", type=int, default=1)
+    replay.add_argument("--repeat", type=int, default=1)
+    replay.add_argument(
+        "--latency-scale",
+        type=float,
+        default=0.0,
+        help="Replay recorded LLM and query latencies scaled by this factor",
+    )
+    replay.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Report peak allocated memory per flow (slows down the run)",
+    )
+    replay.add_argument("--output", help="Write the results as JSON to this file")
+
+    for subparser in (record, replay):
+        subparser.add_argument("--recording", default=str(DEFAULT_RECORDING))
+        subparser.add_argument(
+            "--flows", nargs="+", choices=list(WORKFLOW_MAP), default=list(WORKFLOW_MAP)
+        )
+        subparser.add_argument("--limit", type=int, help="Only use the first N questions")
+    return parser.parse_args()
+
+
+async def record(args) -> None:
+    from dotenv import load_dotenv
+
+    from app.resource_manager import ResourceManager
+
+    load_dotenv()
+    resource_manager = ResourceManager()
+    live_llm = resource_manager.get_model_by_name(args.llm)
+    if live_llm is None:
+        sys.exit(f"Unknown LLM '{args.llm}'")
+    if args.database not in resource_manager.databases:
+        sys.exit(f"Unknown database '{args.database}'")
+
+    recording = Recording(args.recording)
+    llm = RecordedLLM(recording, llm=live_llm)
+    graph_store = StubGraphStore(
+        recording,
+        graph_store=resource_manager.get_database_by_name(args.database)["graph_store"],
+    )
+    db = build_db(graph_store, args.database)
+    questions = load_questions(limit=args.limit)
+
+    timer = StepTimer().install()
+    for flow in args.flows:
+        print(f"Recording {flow} over {len(questions)} questions")
+        await run_flow(flow, llm, db, questions, timer)
+        # Save after every flow so an interrupted recording is not lost
+        recording.save()
+    print(
+        f"Recorded {len(recording.llm)} LLM responses and "
+        f"{len(recording.queries)} query results in {args.recording}"
+    )
+
+
+async def replay(args) -> None:
+    recording = Recording(args.recording)
+    llm = RecordedLLM(recording, latency_scale=args.latency_scale)
+    graph_store = StubGraphStore(recording, latency_scale=args.latency_scale)
+    db = build_db(graph_store, "recommendations")
+    questions = load_questions(limit=args.limit)
+
+    timer = StepTimer().install()
+    results = []
+    for flow in args.flows:
+        results.append(
+            await run_flow(
+                flow,
+                llm,
+                db,
+                questions,
+                timer,
+                concurrency=args.concurrency,
+                repeat=args.repeat,
+                trace_memory=args.trace_memory,
+            )
+        )
+
+    print_report(results)
+    print(f"Recording misses: {llm.misses} LLM calls, {graph_store.misses} queries")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(record(args) if args.command == "record" else replay(args))
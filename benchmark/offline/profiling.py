@@ -0,0 +1,115 @@
+import asyncio
+import inspect
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.span.simple import SimpleSpan
+from llama_index.core.instrumentation.span_handlers import BaseSpanHandler
+from pydantic import PrivateAttr
+
+DEFAULT_MONITOR_INTERVAL = 0.005
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class StepTimer(BaseSpanHandler[SimpleSpan]):
+    """
+    Collects the wall-clock duration of every workflow step span, grouped by
+    the qualified name of the step (e.g. "NaiveText2CypherFlow.generate_cypher").
+    """
+
+    _starts: Dict[str, float] = PrivateAttr(default_factory=dict)
+    _durations: Dict[str, List[float]] = PrivateAttr(
+        default_factory=lambda: defaultdict(list)
+    )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StepTimer"
+
+    def install(self) -> "StepTimer":
+        get_dispatcher().add_span_handler(self)
+        return self
+
+    def reset(self) -> Dict[str, List[float]]:
+        durations, self._durations = self._durations, defaultdict(list)
+        return dict(durations)
+
+    def new_span(
+        self,
+        id_: str,
+        bound_args: inspect.BoundArguments,
+        instance: Optional[Any] = None,
+        parent_span_id: Optional[str] = None,
+        tags: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> Optional[SimpleSpan]:
+        self._starts[id_] = time.perf_counter()
+        return SimpleSpan(id_=id_, parent_id=parent_span_id, tags=tags or {})
+
+    def prepare_to_exit_span(
+        self,
+        id_: str,
+        bound_args: inspect.BoundArguments,
+        instance: Optional[Any] = None,
+        result: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> Optional[SimpleSpan]:
+        start = self._starts.pop(id_, None)
+        if start is not None:
+            # Span ids are "<qualname>-<uuid4>"
+            self._durations[id_[:-37]].append(time.perf_counter() - start)
+        return self.open_spans.get(id_)
+
+    def prepare_to_drop_span(
+        self,
+        id_: str,
+        bound_args: inspect.BoundArguments,
+        instance: Optional[Any] = None,
+        err: Optional[BaseException] = None,
+        **kwargs: Any,
+    ) -> Optional[SimpleSpan]:
+        self._starts.pop(id_, None)
+        return self.open_spans.get(id_)
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = DEFAULT_MONITOR_INTERVAL):
+        """
+        Measures how long the event loop is blocked by oversleeping a short timer.
+
+        :param interval: Seconds between wake-ups, lag above it counts as blocking
+        """
+        self.interval = interval
+        self.blocked = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.blocked = 0.0
+        self.max_lag = 0.0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            if lag > self.interval:
+                self.blocked += lag
+            self.max_lag = max(self.max_lag, lag)
@@ -0,0 +1,179 @@
+import asyncio
+import re
+import time
+import typing
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Type
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.llms import LLM, CustomLLM
+from llama_index.core.llms.callbacks import llm_chat_callback
+from pydantic import BaseModel, PrivateAttr
+
+from benchmark.offline.recording import Recording
+
+# Returned for prompts that are missing from the recording
+FALLBACK_RESPONSE = "Ok"
+
+
+def synthesize(annotation: Any) -> Any:
+    """
+    Build the smallest valid value of a type, used for structured outputs
+    that are missing from the recording.
+    """
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if origin is typing.Union:
+        return None if type(None) in args else synthesize(args[0])
+    if origin is typing.Literal:
+        return args[0]
+    if origin is list:
+        # One element so that plans and filters still exercise their steps
+        return [synthesize(args[0])] if args else []
+    if origin is dict:
+        return {}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation(
+            **{
+                name: synthesize(field.annotation)
+                for name, field in annotation.model_fields.items()
+            }
+        )
+    if annotation is bool:
+        return False
+    if annotation in (int, float):
+        return annotation(0)
+    return ""
+
+
+class RecordedLLM(CustomLLM):
+    """
+    Replays LLM responses from a Recording, or records them from a live LLM.
+
+    Only the calls the workflows make are supported: chat, streaming chat and
+    structured prediction.
+    """
+
+    model: str = "recorded"
+    misses: int = 0
+
+    _recording: Recording = PrivateAttr()
+    _llm: Optional[LLM] = PrivateAttr()
+    _latency_scale: float = PrivateAttr()
+
+    def __init__(
+        self,
+        recording: Recording,
+        llm: Optional[LLM] = None,
+        latency_scale: float = 0.0,
+        **kwargs: Any,
+    ):
+        """
+        :param recording: The Recording to replay from or record into
+        :param llm: A live LLM to record from, None replays
+        :param latency_scale: Factor applied to the recorded latency when replaying
+        """
+        super().__init__(model=getattr(llm, "model", "recorded"), **kwargs)
+        self._recording = recording
+        self._llm = llm
+        self._latency_scale = latency_scale
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.model, is_chat_model=True)
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError("RecordedLLM only replays chat calls")
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError("RecordedLLM only replays chat calls")
+
+    @llm_chat_callback()
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        async def produce() -> str:
+            response = await self._llm.achat(messages, **kwargs)
+            return response.message.content
+
+        text = await self._call("chat", messages, produce)
+        return ChatResponse(
+            message=ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content=FALLBACK_RESPONSE if text is None else text,
+            )
+        )
+
+    @llm_chat_callback()
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        async def produce() -> str:
+            gen = await self._llm.astream_chat(messages, **kwargs)
+            return "".join([response.delta or "" async for response in gen])
+
+        text = await self._call("stream_chat", messages, produce)
+        text = FALLBACK_RESPONSE if text is None else text
+
+        async def gen() -> ChatResponseAsyncGen:
+            content = ""
+            # Replay word by word to keep the per-token event overhead
+            for delta in re.findall(r"\S+\s*|\s+", text):
+                content += delta
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=content),
+                    delta=delta,
+                )
+
+        return gen()
+
+    async def astructured_predict(
+        self,
+        output_cls: Type[BaseModel],
+        prompt,
+        llm_kwargs: Optional[Dict[str, Any]] = None,
+        **prompt_args: Any,
+    ) -> BaseModel:
+        messages = prompt.format_messages(**prompt_args)
+
+        async def produce() -> str:
+            output = await self._llm.astructured_predict(
+                output_cls, prompt, llm_kwargs=llm_kwargs, **prompt_args
+            )
+            return output.model_dump_json()
+
+        text = await self._call(f"structured:{output_cls.__name__}", messages, produce)
+        if text is None:
+            return synthesize(output_cls)
+        return output_cls.model_validate_json(text)
+
+    async def _call(
+        self,
+        kind: str,
+        messages: Sequence[ChatMessage],
+        produce: Callable[[], Awaitable[str]],
+    ) -> Optional[str]:
+        key = Recording.llm_key(
+            kind, [(message.role.value, message.content) for message in messages]
+        )
+        if self._llm is not None:
+            start = time.perf_counter()
+            text = await produce()
+            self._recording.llm[key] = {
+                "text": text,
+                "latency": time.perf_counter() - start,
+            }
+            return text
+
+        entry = self._recording.llm.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if self._latency_scale:
+            await asyncio.sleep(entry["latency"] * self._latency_scale)
+        return entry["text"]
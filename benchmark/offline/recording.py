@@ -0,0 +1,55 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from workflows.shared.query_result_cache import normalize_cypher
+
+
+class Recording:
+    def __init__(self, path: Optional[str] = None):
+        """
+        LLM responses and graph store results captured from a live run,
+        keyed by the exact prompt and the normalized query.
+
+        :param path: JSON file to load from and save to
+        """
+        self.path = Path(path) if path else None
+        self.llm: Dict[str, Dict[str, Any]] = {}
+        self.queries: Dict[str, Dict[str, Any]] = {}
+        self.schema: Optional[Dict[str, Any]] = None
+        self.enhanced_schema = False
+
+        if self.path and self.path.exists():
+            data = json.loads(self.path.read_text())
+            self.llm = data.get("llm", {})
+            self.queries = data.get("queries", {})
+            self.schema = data.get("schema")
+            self.enhanced_schema = data.get("enhanced_schema", False)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(
+            json.dumps(
+                {
+                    "llm": self.llm,
+                    "queries": self.queries,
+                    "schema": self.schema,
+                    "enhanced_schema": self.enhanced_schema,
+                },
+                indent=1,
+                default=str,
+            )
+        )
+
+    @staticmethod
+    def llm_key(kind: str, messages: Sequence[Tuple[str, str]]) -> str:
+        return hashlib.sha256(
+            json.dumps([kind, list(messages)], ensure_ascii=False).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def query_key(query: str, param_map: Optional[Dict[str, Any]]) -> str:
+        return json.dumps(
+            [normalize_cypher(query), param_map or {}], sort_keys=True, default=str
+        )
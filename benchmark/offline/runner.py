@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import resource
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from llama_index.graph_stores.neo4j import CypherQueryCorrector, Schema
+
+from app.settings import WORKFLOW_MAP
+from benchmark.offline.profiling import LoopMonitor, StepTimer, percentile
+from workflows.shared.cypher_cache import CypherGenerationCache
+from workflows.shared.cypher_executor import CypherExecutor
+from workflows.shared.cypher_validator import CypherValidator
+from workflows.shared.local_fewshot_manager import LocalFewshotManager
+from workflows.shared.neo4j_fewshot_manager import Neo4jFewshotManager
+from workflows.shared.plan_scheduler import PlanScheduler
+from workflows.shared.schema_cache import SchemaCache
+from workflows.shared.speculative_generation import SpeculativeCypherGenerator
+
+TEST_DATA = Path(__file__).parent.parent / "test_data.csv"
+WORKFLOW_TIMEOUT = 60
+
+
+def load_questions(path: Path = TEST_DATA, limit: Optional[int] = None) -> List[str]:
+    questions = pd.read_csv(path, delimiter=";")["Question"].tolist()
+    return questions[:limit] if limit else questions
+
+
+def build_db(graph_store, name: str) -> Dict[str, Any]:
+    """
+    Build the database dict the workflows expect, like ResourceManager does.
+
+    Embeddings and the Cypher generation cache are left out so that prompts and
+    LLM calls are identical between recording and replay.
+    """
+    # Keep the benchmark from reading or writing self-learned fewshot examples
+    os.environ.pop("FEWSHOT_NEO4J_USERNAME", None)
+
+    corrector_schema = [
+        Schema(el["start"], el["type"], el["end"])
+        for el in graph_store.get_schema().get("relationships")
+    ]
+    executor = CypherExecutor(graph_store)
+    schema_cache = SchemaCache(graph_store)
+    return {
+        "graph_store": graph_store,
+        "corrector_schema": corrector_schema,
+        "cypher_query_corrector": CypherQueryCorrector(corrector_schema),
+        "local_fewshot_manager": LocalFewshotManager(),
+        "neo4j_fewshot_manager": Neo4jFewshotManager(),
+        "cypher_cache": CypherGenerationCache(),
+        "speculative_generator": SpeculativeCypherGenerator(),
+        "plan_scheduler": PlanScheduler(),
+        "executor": executor,
+        "schema_cache": schema_cache,
+        "cypher_validator": CypherValidator(schema_cache, executor),
+        "name": name,
+    }
+
+
+async def run_question(workflow_class, llm, db, question: str) -> int:
+    workflow_instance = workflow_class(
+        llm=llm, db=db, embed_model=None, timeout=WORKFLOW_TIMEOUT
+    )
+    handler = workflow_instance.run(input=question)
+
+    # Serialize events the same way the SSE endpoint does
+    events = 0
+    async for event in handler.stream_events():
+        if type(event).__name__ != "StopEvent":
+            json.dumps(
+                {
+                    "event_type": type(event).__name__,
+                    "label": event.label,
+                    "message": event.message,
+                }
+            )
+            events += 1
+    json.dumps({"result": await handler})
+    return events
+
+
+async def run_flow(
+    name: str,
+    llm,
+    db: Dict[str, Any],
+    questions: List[str],
+    timer: StepTimer,
+    concurrency: int = 1,
+    repeat: int = 1,
+    trace_memory: bool = False,
+) -> Dict[str, Any]:
+    workflow_class = WORKFLOW_MAP[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+    events = 0
+
+    async def run_one(question: str) -> None:
+        nonlocal events
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                events += await run_question(workflow_class, llm, db, question)
+            except Exception as ex:
+                errors.append(f"{question}: {ex}")
+            latencies.append(time.perf_counter() - start)
+
+    monitor = LoopMonitor()
+    timer.reset()
+    if trace_memory:
+        tracemalloc.start()
+    monitor.start()
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        await asyncio.gather(*[run_one(question) for question in questions])
+
+    wall_time = time.perf_counter() - start
+    await monitor.stop()
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    prefix = f"{workflow_class.__name__}."
+    steps = {
+        span_name[len(prefix) :]: durations
+        for span_name, durations in timer.reset().items()
+        if span_name.startswith(prefix)
+    }
+    return {
+        "flow": name,
+        "runs": len(latencies),
+        "errors": errors,
+        "events": events,
+        "wall_time": wall_time,
+        "latency": summarize(latencies),
+        "steps": {step: summarize(durations) for step, durations in steps.items()},
+        "loop_blocked": monitor.blocked,
+        "loop_max_lag": monitor.max_lag,
+        "peak_memory": peak_memory,
+    }
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(durations),
+        "mean": statistics.mean(durations) if durations else 0.0,
+        "p50": percentile(durations, 50),
+        "p95": percentile(durations, 95),
+        "p99": percentile(durations, 99),
+    }
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    for result in results:
+        print(
+            f"\n{result['flow']}: {result['runs']} runs, {len(result['errors'])} errors, "
+            f"{result['events']} events, {result['wall_time']:.2f} s wall time"
+        )
+        print(
+            f"  event loop blocked {result['loop_blocked'] * 1000:.1f} ms, "
+            f"max lag {result['loop_max_lag'] * 1000:.1f} ms"
+        )
+        if result["peak_memory"] is not None:
+            print(f"  peak traced memory {result['peak_memory'] / 2**20:.1f} MiB")
+        print(f"  {'':<34} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        rows = [("end-to-end", result["latency"]), *result["steps"].items()]
+        for label, stats in rows:
+            print(
+                f"  {label:<34} {stats['count']:>6} {stats['p50'] * 1000:>9.2f} "
+                f"{stats['p95'] * 1000:>9.2f} {stats['p99'] * 1000:>9.2f}"
+            )
+        for error in result["errors"][:3]:
+            print(f"  error: {error}")
+
+    # ru_maxrss is reported in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\nPeak RSS of the benchmark process: {peak_rss:.1f} MiB")
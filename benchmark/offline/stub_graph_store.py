@@ -0,0 +1,215 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from llama_index.graph_stores.neo4j import Neo4jPropertyGraphStore
+from neo4j.exceptions import Neo4jError
+
+from benchmark.offline.recording import Recording
+
+# Used when the recording holds no schema, the movie graph of test_data.csv
+DEFAULT_SCHEMA = {
+    "node_props": {
+        "Movie": [
+            {"property": "title", "type": "STRING"},
+            {"property": "released", "type": "INTEGER"},
+            {"property": "year", "type": "INTEGER"},
+            {"property": "imdbRating", "type": "FLOAT"},
+        ],
+        "Person": [{"property": "name", "type": "STRING"}],
+        "Genre": [{"property": "name", "type": "STRING"}],
+        "User": [{"property": "name", "type": "STRING"}],
+    },
+    "rel_props": {"RATED": [{"property": "rating", "type": "FLOAT"}]},
+    "relationships": [
+        {"start": "Person", "type": "ACTED_IN", "end": "Movie"},
+        {"start": "Person", "type": "DIRECTED", "end": "Movie"},
+        {"start": "User", "type": "RATED", "end": "Movie"},
+        {"start": "Movie", "type": "IN_GENRE", "end": "Genre"},
+    ],
+    "metadata": {"constraint": [], "index": []},
+}
+
+
+class StubRecord(dict):
+    def data(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+class StubAsyncDriver:
+    def __init__(self, graph_store: "StubGraphStore"):
+        self.graph_store = graph_store
+
+    async def execute_query(self, query, database_=None, parameters_=None, **kwargs):
+        text = getattr(query, "text", query)
+        key = Recording.query_key(text, parameters_)
+        live_store = self.graph_store.graph_store
+        if live_store is not None:
+            start = time.perf_counter()
+            try:
+                data, summary, keys = await live_store._async_driver.execute_query(
+                    query, database_=database_, parameters_=parameters_, **kwargs
+                )
+            except Neo4jError as ex:
+                self.graph_store.record(key, start, error=ex)
+                raise
+            self.graph_store.record(key, start, rows=[record.data() for record in data])
+            return data, summary, keys
+
+        rows = await self.graph_store.replay(key)
+        return [StubRecord(row) for row in rows], None, None
+
+    def session(self, database=None, fetch_size=None, **kwargs) -> "StubSession":
+        return StubSession(self.graph_store, database, fetch_size, kwargs)
+
+
+class StubResult:
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+
+    async def __aiter__(self):
+        for row in self.rows:
+            yield StubRecord(row)
+
+    async def consume(self) -> None:
+        pass
+
+
+class StubSession:
+    def __init__(self, graph_store: "StubGraphStore", database, fetch_size, kwargs):
+        self.graph_store = graph_store
+        self.database = database
+        self.fetch_size = fetch_size
+        self.kwargs = kwargs
+        self._session = None
+
+    async def __aenter__(self) -> "StubSession":
+        live_store = self.graph_store.graph_store
+        if live_store is not None:
+            self._session = live_store._async_driver.session(
+                database=self.database, fetch_size=self.fetch_size, **self.kwargs
+            )
+            await self._session.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._session is not None:
+            await self._session.__aexit__(*exc_info)
+
+    async def run(self, query, parameters=None) -> StubResult:
+        text = getattr(query, "text", query)
+        key = Recording.query_key(text, parameters)
+        if self._session is None:
+            return StubResult(await self.graph_store.replay(key))
+
+        start = time.perf_counter()
+        try:
+            result = await self._session.run(query, parameters)
+            # Only the records a limited caller can read are recorded
+            rows = []
+            async for record in result:
+                rows.append(record.data())
+                if self.fetch_size and len(rows) >= self.fetch_size:
+                    break
+            await result.consume()
+        except Neo4jError as ex:
+            self.graph_store.record(key, start, error=ex)
+            raise
+        self.graph_store.record(key, start, rows=rows)
+        return StubResult(rows)
+
+
+class StubGraphStore:
+    def __init__(
+        self,
+        recording: Recording,
+        graph_store: Optional[Neo4jPropertyGraphStore] = None,
+        latency_scale: float = 0.0,
+    ):
+        """
+        Stands in for Neo4jPropertyGraphStore, replaying query results and the
+        schema from a Recording or recording them from a live graph store.
+
+        :param recording: The Recording to replay from or record into
+        :param graph_store: A live graph store to record from, None replays
+        :param latency_scale: Factor applied to the recorded latency when replaying
+        """
+        self.recording = recording
+        self.graph_store = graph_store
+        self.latency_scale = latency_scale
+        self.misses = 0
+        self._async_driver = StubAsyncDriver(self)
+        self._database = getattr(graph_store, "_database", "neo4j")
+        self.sanitize_query_output = True
+
+        if graph_store is not None:
+            recording.schema = graph_store.get_schema()
+            recording.enhanced_schema = graph_store.enhanced_schema
+        self.enhanced_schema = recording.enhanced_schema
+
+    def get_schema(self, refresh: bool = False) -> Dict[str, Any]:
+        return self.recording.schema or DEFAULT_SCHEMA
+
+    def get_schema_str(
+        self,
+        refresh: bool = False,
+        exclude_types: List[str] = [],
+        include_types: List[str] = [],
+    ) -> str:
+        # Rendering only depends on the schema, so reuse the store's own formatting
+        return Neo4jPropertyGraphStore.get_schema_str(
+            self, exclude_types=exclude_types, include_types=include_types
+        )
+
+    def refresh_schema(self) -> None:
+        pass
+
+    def structured_query(
+        self, query: str, param_map: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        key = Recording.query_key(query, param_map)
+        if self.graph_store is not None:
+            start = time.perf_counter()
+            try:
+                rows = self.graph_store.structured_query(query, param_map=param_map)
+            except Neo4jError as ex:
+                self.record(key, start, error=ex)
+                raise
+            self.record(key, start, rows=rows)
+            return rows
+
+        entry = self.recording.queries.get(key)
+        if entry is None:
+            self.misses += 1
+            return []
+        if self.latency_scale:
+            time.sleep(entry["latency"] * self.latency_scale)
+        self._raise_recorded_error(entry)
+        return entry["rows"]
+
+    def record(
+        self,
+        key: str,
+        start: float,
+        rows: Optional[List[Dict[str, Any]]] = None,
+        error: Optional[Neo4jError] = None,
+    ) -> None:
+        entry = {"rows": rows or [], "latency": time.perf_counter() - start}
+        if error is not None:
+            entry["error"] = {"code": error.code, "message": error.message}
+        self.recording.queries[key] = entry
+
+    async def replay(self, key: str) -> List[Dict[str, Any]]:
+        entry = self.recording.queries.get(key)
+        if entry is None:
+            self.misses += 1
+            return []
+        if self.latency_scale:
+            await asyncio.sleep(entry["latency"] * self.latency_scale)
+        self._raise_recorded_error(entry)
+        return entry["rows"]
+
+    def _raise_recorded_error(self, entry: Dict[str, Any]) -> None:
+        # Syntax errors drive the correction steps, so they are replayed too
+        if "error" in entry:
+            raise Neo4jError._hydrate_neo4j(**entry["error"])
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+from llama_index.core.workflow import StartEvent, StopEvent, Workflow, step
+
+from app.batch import run_batch
+
+
+class Executor:
+    result_cache = None
+
+    def __init__(self):
+        self.queries = []
+
+    async def run(self, query, param_map=None, timeout=None, limit=None):
+        self.queries.append(query)
+        await asyncio.sleep(0.01)
+        return [{"query": query}]
+
+
+class AnswerFlow(Workflow):
+    started = []
+    cancelled = []
+
+    def __init__(self, llm, db, embed_model, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = db["executor"]
+
+    @step
+    async def answer(self, ev: StartEvent) -> StopEvent:
+        AnswerFlow.started.append(ev.input)
+        if ev.input.startswith("slow"):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                AnswerFlow.cancelled.append(ev.input)
+                raise
+        # Every question asks for the same movies
+        records = await self.executor.run("MATCH (m:Movie) RETURN m.title")
+        return StopEvent(result={"question": ev.input, "answer": records})
+
+
+def collect(questions, executor, **kwargs):
+    async def run():
+        return [
+            json.loads(line)
+            async for line in run_batch(
+                AnswerFlow, None, {"executor": executor}, None, questions, **kwargs
+            )
+        ]
+
+    return asyncio.run(run())
+
+
+def test_repeated_questions_and_statements_run_once():
+    AnswerFlow.started = []
+    executor = Executor()
+    questions = ["Who directed Casino?", "who directed  casino", "Which movies?"]
+
+    lines = collect(questions, executor, concurrency=2)
+
+    assert sorted(line["index"] for line in lines) == [0, 1, 2]
+    assert sorted(AnswerFlow.started) == ["Which movies?", "Who directed Casino?"]
+    assert executor.queries == ["MATCH (m:Movie) RETURN m.title"]
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[1]["question"] == "who directed  casino"
+    assert by_index[1]["result"] == by_index[0]["result"]
+
+
+def test_closing_the_stream_cancels_the_remaining_runs():
+    AnswerFlow.started = []
+    AnswerFlow.cancelled = []
+
+    async def run():
+        lines = run_batch(
+            AnswerFlow,
+            None,
+            {"executor": Executor()},
+            None,
+            ["Which movies?", "slow one", "slow two"],
+            concurrency=3,
+        )
+        first = json.loads(await lines.__anext__())
+        await lines.aclose()
+        # Let the cancelled runs unwind
+        await asyncio.sleep(0.05)
+        return first
+
+    first = asyncio.run(run())
+    assert first["question"] == "Which movies?"
+    assert sorted(AnswerFlow.cancelled) == ["slow one", "slow two"]
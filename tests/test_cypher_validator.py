@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from neo4j.exceptions import Neo4jError
+
+from workflows.shared.cypher_validator import CypherValidator
+
+SCHEMA = {
+    "node_props": {
+        "Movie": [{"property": "title", "type": "STRING"}],
+        "Person": [{"property": "name", "type": "STRING"}],
+    },
+    "rel_props": {},
+    "relationships": [{"start": "Person", "type": "ACTED_IN", "end": "Movie"}],
+}
+READ_ONLY = "Write clause {} is not allowed, the database is read-only"
+
+
+class SchemaCache:
+    def __init__(self):
+        self.schema = SCHEMA
+        self.version = "1"
+
+
+class Executor:
+    def __init__(self, *errors):
+        # Raised by the next EXPLAINs in order, None succeeds
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def run(self, query, *args, **kwargs):
+        self.calls += 1
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        return []
+
+
+def neo4j_error(code: str) -> Neo4jError:
+    # The driver builds its errors from the server's code the same way
+    return Neo4jError._hydrate_neo4j(code=code, message=f"{code} failed")
+
+
+def check(validator, cypher):
+    return asyncio.run(validator.check(cypher))
+
+
+def test_statement_errors_are_reported_and_cached():
+    executor = Executor(neo4j_error("Neo.ClientError.Statement.SyntaxError"))
+    validator = CypherValidator(SchemaCache(), executor)
+    cypher = "MATCH (m:Movie) RETURN foo(m)"
+
+    errors, _ = check(validator, cypher)
+    assert errors == ["Neo.ClientError.Statement.SyntaxError failed"]
+    assert check(validator, cypher)[0] == errors
+    assert executor.calls == 1
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "Neo.TransientError.General.DatabaseUnavailable",
+        "Neo.ClientError.Security.Unauthorized",
+        "Neo.ClientError.Procedure.ProcedureCallFailed",
+    ],
+)
+def test_other_database_errors_propagate_uncached(code):
+    executor = Executor(neo4j_error(code))
+    validator = CypherValidator(SchemaCache(), executor)
+    cypher = "MATCH (m:Movie) RETURN m.title"
+
+    with pytest.raises(Neo4jError):
+        check(validator, cypher)
+    assert check(validator, cypher) == ([], [])
+    assert executor.calls == 2
+
+
+def test_explain_timeout_keeps_local_result_uncached():
+    executor = Executor(TimeoutError("Cypher query timed out after 1 seconds"))
+    validator = CypherValidator(SchemaCache(), executor)
+    cypher = "MATCH (m:Movie) RETURN m.title"
+
+    assert check(validator, cypher) == ([], [])
+    assert check(validator, cypher) == ([], [])
+    assert executor.calls == 2
+
+
+def test_schema_change_invalidates_results():
+    schema_cache = SchemaCache()
+    executor = Executor()
+    validator = CypherValidator(schema_cache, executor)
+    cypher = "MATCH (m:Movie) RETURN m.title"
+
+    check(validator, cypher)
+    schema_cache.version = "2"
+    check(validator, cypher)
+    assert executor.calls == 2
+
+
+@pytest.mark.parametrize(
+    "cypher, errors",
+    [
+        ("CREATE (m:Movie {title: 'Heat'})", [READ_ONLY.format("CREATE")]),
+        ("MATCH (m:Movie) DETACH DELETE m", [READ_ONLY.format("DELETE")]),
+        ("MATCH (m:Movie) RETURN 1 AS create, m.title AS set", []),
+        ("MATCH (m:Movie) RETURN {set: m.title, merge: 'CREATE (x)'}", []),
+    ],
+)
+def test_write_clauses(cypher, errors):
+    validator = CypherValidator(SchemaCache(), Executor())
+    assert validator.validate_locally(cypher)[0] == errors
+
+
+def test_unknown_properties_are_warnings_and_unknown_labels_errors():
+    executor = Executor()
+    validator = CypherValidator(SchemaCache(), executor)
+
+    errors, warnings = check(validator, "MATCH (m:Movie) RETURN m.year")
+    assert errors == []
+    assert warnings == ["Property `year` does not exist on `Movie`"]
+
+    errors, _ = check(validator, "MATCH (m:Film) RETURN m.title")
+    assert errors == ["Label `Film` does not exist in the graph schema"]
+    # EXPLAIN only runs once the local checks pass
+    assert executor.calls == 1
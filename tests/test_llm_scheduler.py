@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from workflows.shared.llm_scheduler import (
+    BATCH,
+    INTERACTIVE,
+    ProviderScheduler,
+    TokenBucket,
+    llm_request,
+)
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    async def run():
+        start = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # Two tokens right away, two more at 20 per second
+    elapsed = asyncio.run(run())
+    assert 0.08 <= elapsed < 0.5
+
+
+def test_token_bucket_caps_requests_at_capacity():
+    bucket = TokenBucket(rate=1000, capacity=5)
+
+    async def run():
+        start = time.monotonic()
+        await bucket.acquire(50)
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 0.1
+
+
+async def queue_calls(scheduler, calls, order):
+    """
+    Hold the only slot while the calls queue up, then release it and return
+    the order in which the calls got the slot.
+    """
+
+    async def call(priority, session, name):
+        with llm_request(priority, session):
+            async with scheduler.slot():
+                order.append(name)
+                await asyncio.sleep(0)
+
+    await scheduler.acquire()
+    tasks = [asyncio.create_task(call(*args)) for args in calls]
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+
+
+def test_interactive_calls_go_before_batch_calls():
+    scheduler = ProviderScheduler("OpenAI", max_concurrency=1)
+    order = []
+    asyncio.run(
+        queue_calls(
+            scheduler,
+            [
+                (BATCH, "batch", "batch 1"),
+                (BATCH, "batch", "batch 2"),
+                (INTERACTIVE, "user", "interactive"),
+            ],
+            order,
+        )
+    )
+    assert order == ["interactive", "batch 1", "batch 2"]
+    assert scheduler.active == 0
+
+
+def test_sessions_of_a_priority_take_turns():
+    scheduler = ProviderScheduler("OpenAI", max_concurrency=1)
+    order = []
+    asyncio.run(
+        queue_calls(
+            scheduler,
+            [
+                (BATCH, "a", "a1"),
+                (BATCH, "a", "a2"),
+                (BATCH, "a", "a3"),
+                (BATCH, "b", "b1"),
+            ],
+            order,
+        )
+    )
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_cancelled_waiter_passes_the_slot_on():
+    scheduler = ProviderScheduler("OpenAI", max_concurrency=1)
+
+    async def run():
+        await scheduler.acquire()
+        cancelled = asyncio.create_task(scheduler.acquire())
+        waiting = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        scheduler.release()
+        await asyncio.wait_for(waiting, 1)
+        scheduler.release()
+
+    asyncio.run(run())
+    assert scheduler.active == 0
+    assert scheduler.queued == 0
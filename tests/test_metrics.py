@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+from workflows.shared.metrics import measure_step
+
+
+class FailingOnceLLM(CustomLLM):
+    calls: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="failing-once")
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("rate limited")
+        return CompletionResponse(text="MATCH (m:Movie) RETURN m.title")
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs):
+        raise NotImplementedError
+
+
+class SlowLLM(FailingOnceLLM):
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs):
+        await asyncio.sleep(0.05)
+        return CompletionResponse(text="MATCH (m:Movie) RETURN m.title")
+
+
+class Context:
+    def write_event_to_stream(self, event) -> None:
+        pass
+
+
+def test_failed_llm_call_does_not_hide_later_calls():
+    llm = FailingOnceLLM()
+
+    async def run():
+        async with measure_step(Context(), "Workflow", "generate_cypher") as metrics:
+            with pytest.raises(RuntimeError):
+                await llm.acomplete("Which movies are there?")
+            await llm.acomplete("Which movies are there?")
+        return metrics
+
+    metrics = asyncio.run(run())
+    assert metrics.llm_calls == 2
+    assert metrics.tokens_in > 0
+    assert metrics.tokens_out > 0
+    assert not metrics._llm_calls
+
+
+def test_concurrent_and_cancelled_llm_calls_are_counted_separately():
+    llm = SlowLLM()
+
+    async def run():
+        async with measure_step(Context(), "Workflow", "generate_cypher") as metrics:
+            cancelled = asyncio.create_task(llm.acomplete("Which movies?"))
+            await asyncio.sleep(0.01)
+            cancelled.cancel()
+            await asyncio.gather(
+                cancelled,
+                llm.acomplete("Which movies?"),
+                llm.acomplete("Which actors?"),
+                return_exceptions=True,
+            )
+        return metrics
+
+    metrics = asyncio.run(run())
+    # The cancelled call took time too, but only the others report tokens
+    assert metrics.llm_calls == 3
+    assert metrics.llm_duration >= 0.1
+    assert not metrics._llm_calls
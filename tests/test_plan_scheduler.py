@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from workflows.shared.plan_scheduler import PlanDAG, PlanScheduler
+
+
+def test_from_plan_keeps_only_earlier_dependencies():
+    dag = PlanDAG.from_plan(
+        [
+            ("movies", []),
+            ("actors", [0]),
+            # Itself, a later subquery and an unknown position are ignored
+            ("directors", [2, 3, 7, 0, 0]),
+            ("genres", [1, 2]),
+            ("movies", [1]),
+        ]
+    )
+    assert dag.dependencies == {
+        "movies": [],
+        "actors": ["movies"],
+        "directors": ["movies"],
+        "genres": ["actors", "directors"],
+    }
+
+
+def test_subqueries_start_when_their_dependencies_are_done():
+    dag = PlanDAG.from_plan(
+        [("slow", []), ("fast", []), ("after fast", [1]), ("after both", [0, 2])]
+    )
+    delays = {"slow": 0.1, "fast": 0.01, "after fast": 0.01, "after both": 0.01}
+    started = []
+
+    async def run_subquery(subquery, dependency_results):
+        started.append((subquery, sorted(dependency_results)))
+        await asyncio.sleep(delays[subquery])
+        return subquery
+
+    results = asyncio.run(PlanScheduler().run(dag, run_subquery))
+
+    # "after fast" doesn't wait for the slow subquery of the same level
+    assert results == ["fast", "after fast", "slow", "after both"]
+    assert started == [
+        ("slow", []),
+        ("fast", []),
+        ("after fast", ["fast"]),
+        ("after both", ["after fast", "slow"]),
+    ]
+
+
+def test_concurrency_is_shared_across_plans():
+    scheduler = PlanScheduler(max_concurrency=2)
+    running = 0
+    peak = 0
+
+    async def run_subquery(subquery, dependency_results):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return subquery
+
+    async def run():
+        plans = [
+            PlanDAG.from_plan([(f"{plan}-{i}", []) for i in range(3)])
+            for plan in range(2)
+        ]
+        return await asyncio.gather(
+            *[scheduler.run(dag, run_subquery) for dag in plans]
+        )
+
+    results = asyncio.run(run())
+    assert [len(plan_results) for plan_results in results] == [3, 3]
+    assert peak == 2
+
+
+def test_failed_subquery_cancels_the_others():
+    dag = PlanDAG.from_plan([("fails", []), ("slow", []), ("after", [0])])
+    cancelled = []
+
+    async def run_subquery(subquery, dependency_results):
+        if subquery == "fails":
+            raise RuntimeError("database unavailable")
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(subquery)
+            raise
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(PlanScheduler().run(dag, run_subquery))
+    assert cancelled == ["slow"]
@@ -1,3 +1,5 @@
+from typing import Optional, Tuple
+
 from llama_index.core import VectorStoreIndex
 from llama_index.core.schema import TextNode
 from llama_index.core.workflow import (
@@ -8,12 +10,18 @@ from llama_index.core.workflow import (
     Workflow,
     step,
 )
-from llama_index.graph_stores.neo4j import CypherQueryCorrector
 
-from workflows.shared.local_fewshot_manager import LocalFewshotManager
+from workflows.shared.cypher_cache import CypherCacheEntry
+from workflows.shared.cypher_executor import DEFAULT_RECORD_LIMIT
+from workflows.shared.metrics import instrument_step, measure_step, record_retry
+from workflows.shared.plan_scheduler import PlanDAG
+from workflows.shared.record_format import format_records
 from workflows.shared.sse_event import SseEvent
 from workflows.steps.iterative_planner import (
+    PlannedSubquery,
     correct_cypher_step,
+    format_plan,
+    format_subqueries_for_prompt,
     generate_cypher_step,
     get_final_answer_prompt,
     guardrails_step,
@@ -24,39 +32,27 @@ from workflows.steps.iterative_planner import (
 
 MAX_INFORMATION_CHECKS = 3
 MAX_CORRECT_STEPS = 1
+# Tokens of dependency results added to a subquery for Cypher generation
+DEPENDENCY_TOKEN_BUDGET = 1000
 
 
 class InitialPlan(Event):
     question: str
 
 
-class GenerateCypher(Event):
-    subquery: str
-    retries: int
-
-
-class ValidateCypher(Event):
-    subquery: str
-    generated_cypher: str
-    retries: int
-
-
-class CorrectCypher(Event):
-    cypher: str
-    subquery: str
-    errors: list[str]
-    retries: int
-
-
-class ExecuteCypher(Event):
-    validated_cypher: str
-    subquery: str
+class ExecutePlan(Event):
+    plan: list[PlannedSubquery]
 
 
 class InformationCheck(Event):
     cypher: str
     subquery: str
     database_output: list
+    truncated: bool = False
+
+
+class PlanResults(Event):
+    results: list[InformationCheck]
 
 
 class FinalAnswer(Event):
@@ -68,12 +64,19 @@ class IterativePlanningFlow(Workflow):
         super().__init__(*args, **kwargs)
 
         self.llm = llm
+        self.embed_model = embed_model
         self.graph_store = db["graph_store"]
-        self.cypher_query_corrector = CypherQueryCorrector(db["corrector_schema"])
-        self.few_shot_retriever = LocalFewshotManager()
+        self.executor = db["executor"]
+        self.schema_cache = db["schema_cache"]
+        self.cypher_cache = db["cypher_cache"]
+        self.cypher_query_corrector = db["cypher_query_corrector"]
+        self.cypher_validator = db["cypher_validator"]
+        self.few_shot_retriever = db["local_fewshot_manager"]
+        self.plan_scheduler = db["plan_scheduler"]
         self.db_name = db["name"]
 
     @step
+    @instrument_step
     async def start(self, ctx: Context, ev: StartEvent) -> InitialPlan | FinalAnswer:
         original_question = ev.input
         # Init global vars
@@ -94,161 +97,187 @@ class IterativePlanningFlow(Workflow):
         return InitialPlan(question=original_question)
 
     @step
-    async def initial_plan(self, ctx: Context, ev: InitialPlan) -> GenerateCypher:
+    @instrument_step
+    async def initial_plan(self, ctx: Context, ev: InitialPlan) -> ExecutePlan:
         original_question = ev.question
         # store in global context
         initial_plan_output = await initial_plan_step(self.llm, original_question)
         subqueries = initial_plan_output["arguments"].get("plan")
 
         ctx.write_event_to_stream(
-            SseEvent(message=f"Plan:{subqueries}", label="Planning")
+            SseEvent(message=f"Plan:{format_plan(subqueries)}", label="Planning")
         )
         await ctx.set(
             "information_checks", 0
         )  # Current number of information check steps
         await ctx.set("dynamic_notebook", "")  # Current knowledge
 
-        # we use this in ctx.collect() to know how many events to wait for
-        await ctx.set("count_of_subqueries", len(subqueries[0]))
-        await ctx.set("plan", subqueries)
-
-        # Send events in the current step of the plan
-        for subquery in subqueries[0]:
-            ctx.send_event(GenerateCypher(subquery=subquery, retries=MAX_CORRECT_STEPS))
-
-    @step(num_workers=4)
-    async def generate_cypher_step(
-        self,
-        ctx: Context,
-        ev: GenerateCypher,
-    ) -> ValidateCypher:
-        fewshot_examples = self.few_shot_retriever.get_fewshot_examples(
-            ev.subquery, self.db_name
-        )
+        return ExecutePlan(plan=subqueries)
 
-        generated_cypher = await generate_cypher_step(
-            self.llm,
-            self.graph_store,
-            ev.subquery,
-            fewshot_examples,
+    @step
+    @instrument_step
+    async def execute_plan(self, ctx: Context, ev: ExecutePlan) -> PlanResults:
+        # Subqueries start as soon as the ones they depend on are done, bounded
+        # by the shared scheduler
+        dag = PlanDAG.from_plan(
+            [(subquery.query, subquery.depends_on) for subquery in ev.plan]
         )
 
-        return ValidateCypher(
-            subquery=ev.subquery, generated_cypher=generated_cypher, retries=ev.retries
-        )
+        async def run_and_record(subquery: str, dependencies: list) -> InformationCheck:
+            result = await self.run_subquery(ctx, subquery, dependencies)
 
-    @step(num_workers=4)
-    async def validate_cypher_step(
-        self, ctx: Context, ev: ValidateCypher
-    ) -> ExecuteCypher | CorrectCypher:
-        results = await validate_cypher_step(
-            llm=self.llm,
-            graph_store=self.graph_store,
-            question=ev.subquery,
-            cypher=ev.generated_cypher,
-            cypher_query_corrector=self.cypher_query_corrector,
-        )
-        # if results["next_action"] == "end":  # DB value mapping
-        #    return FinalAnswer(context=str(results["mapping_errors"]))
-        if results["next_action"] == "execute_cypher":
-            return ExecuteCypher(
-                subquery=ev.subquery, validated_cypher=ev.generated_cypher
-            )
-        if results["next_action"] == "correct_cypher" and ev.retries > 0:
-            return CorrectCypher(
-                subquery=ev.subquery,
-                cypher=ev.generated_cypher,
-                errors=results["cypher_errors"],
-                retries=ev.retries - 1,
+            # Stream each result and record it in the history as soon as it's done
+            history = await ctx.get("subqueries_cypher_history")
+            history[subquery] = {
+                "cypher": result.cypher,
+                "database_output": result.database_output,
+            }
+            await ctx.set("subqueries_cypher_history", history)
+            ctx.write_event_to_stream(
+                SseEvent(
+                    message=format_records(
+                        result.database_output, truncated=result.truncated
+                    ),
+                    label=f"Subquery result: {subquery}",
+                )
             )
-        else:  # What to do if no retries left
-            # We just run execute cypher and expect an error
-            # Improve
-            return ExecuteCypher(
-                subquery=ev.subquery, validated_cypher=ev.generated_cypher
+            return result
+
+        results = await self.plan_scheduler.run(dag, run_and_record)
+        return PlanResults(results=results)
+
+    async def run_subquery(
+        self, ctx: Context, subquery: str, dependencies: list
+    ) -> InformationCheck:
+        question = subquery
+        if dependencies:
+            # Generation only sees the subquery, so give it the values it builds on
+            question += (
+                "\n\nResults of the subqueries it depends on:\n"
+                + format_subqueries_for_prompt(
+                    dependencies, token_budget=DEPENDENCY_TOKEN_BUDGET
+                )
             )
 
-    @step(num_workers=4)
-    async def correct_cypher_step(
-        self, ctx: Context, ev: CorrectCypher
-    ) -> ValidateCypher:
-        ctx.write_event_to_stream(
-            SseEvent(
-                message=f"Corecting Cypher query: {ev.cypher} due to error: {ev.errors}",
-                label=f"Cypher correction: {ev.subquery}",
+        workflow = type(self).__name__
+        async with measure_step(ctx, workflow, "generate_cypher_step"):
+            cypher, cache_entry = await self.generate_cypher(subquery, question)
+
+        retries = MAX_CORRECT_STEPS
+        while True:
+            async with measure_step(ctx, workflow, "validate_cypher_step"):
+                results = await validate_cypher_step(
+                    llm=self.llm,
+                    graph_store=self.graph_store,
+                    cypher_validator=self.cypher_validator,
+                    question=subquery,
+                    cypher=cypher,
+                    cypher_query_corrector=self.cypher_query_corrector,
+                )
+                # With no retries left we just run execute cypher and expect an error
+                if results["next_action"] != "correct_cypher" or retries == 0:
+                    break
+                record_retry()
+                await self.cypher_cache.invalidate(cache_entry)
+            retries -= 1
+
+            async with measure_step(ctx, workflow, "correct_cypher_step"):
+                ctx.write_event_to_stream(
+                    SseEvent(
+                        message=f"Corecting Cypher query: {cypher} due to error: {results['cypher_errors']}",
+                        label=f"Cypher correction: {subquery}",
+                    )
+                )
+                cypher = await correct_cypher_step(
+                    self.llm,
+                    self.schema_cache,
+                    question,
+                    cypher,
+                    results["cypher_errors"],
+                )
+
+        async with measure_step(ctx, workflow, "execute_cypher_step"):
+            result = await self.execute_cypher(ctx, subquery, cypher)
+
+        # Only statements that ran are served to later questions
+        failed = any(isinstance(output, Exception) for output in result.database_output)
+        if failed:
+            await self.cypher_cache.invalidate(cache_entry)
+        else:
+            await self.cypher_cache.put(cache_entry, cypher)
+        return result
+
+    async def generate_cypher(
+        self, subquery: str, question: str
+    ) -> Tuple[str, Optional[CypherCacheEntry]]:
+        # Fewshot retrieval is only needed on a cache miss
+        async def generate():
+            fewshot_examples = await self.few_shot_retriever.aretrieve_fewshots(
+                subquery, self.db_name, self.embed_model
             )
-        )
 
-        results = await correct_cypher_step(
-            self.llm,
-            self.graph_store,
-            ev.subquery,
-            ev.cypher,
-            ev.errors,
-        )
+            return await generate_cypher_step(
+                self.llm,
+                self.schema_cache,
+                question,
+                fewshot_examples,
+            )
 
-        return ValidateCypher(
-            subquery=ev.subquery, generated_cypher=results, retries=ev.retries
+        return await self.cypher_cache.get_or_generate(
+            database=self.db_name,
+            schema_version=self.schema_cache.version,
+            llm_name=self.llm.model,
+            question=question,
+            generate=generate,
+            embed_model=self.embed_model,
         )
 
-    @step
-    async def execute_cypher_step(
-        self, ctx: Context, ev: ExecuteCypher
+    async def execute_cypher(
+        self, ctx: Context, subquery: str, cypher: str
     ) -> InformationCheck:
         ctx.write_event_to_stream(
             SseEvent(
-                message=f"Executing Cypher query: {ev.validated_cypher}",
-                label=f"Cypher Execution: {ev.subquery}",
+                message=f"Executing Cypher query: {cypher}",
+                label=f"Cypher Execution: {subquery}",
             )
         )
 
+        truncated = False
         try:
-            database_output = self.graph_store.structured_query(ev.validated_cypher)[
-                :100
-            ]  # Hard limit of 100 results
+            # Only the first records are fetched, the rest is discarded by the server
+            records = await self.executor.run(cypher, limit=DEFAULT_RECORD_LIMIT)
+            database_output, truncated = list(records), records.truncated
         except Exception as e:  # Dividing by zero, etc... or timeout
             database_output = [e]
 
+        if truncated:
+            ctx.write_event_to_stream(
+                SseEvent(
+                    message=f"Truncated to the first {len(database_output)} records.",
+                    label=f"Cypher Execution: {subquery}",
+                )
+            )
+
         return InformationCheck(
-            subquery=ev.subquery,
-            cypher=ev.validated_cypher,
+            subquery=subquery,
+            cypher=cypher,
             database_output=database_output,
+            truncated=truncated,
         )
 
     @step
+    @instrument_step
     async def information_check_step(
-        self, ctx: Context, ev: InformationCheck
-    ) -> GenerateCypher | FinalAnswer:
-        # retrieve from context
-        number_of_subqueries = await ctx.get("count_of_subqueries")
-
-        # wait until we receive all events
-        result = ctx.collect_events(ev, [InformationCheck] * number_of_subqueries)
-        if result is None:
-            return None
-
-        # Add executed cypher statements to global state
-        subqueries_cypher_history = await ctx.get("subqueries_cypher_history")
-        new_subqueries_cypher = {
-            item.subquery: {
-                "cypher": item.cypher,
-                "database_output": item.database_output,
-            }
-            for item in result
-        }
-
-        await ctx.set(
-            "subqueries_cypher_history",
-            {**subqueries_cypher_history, **new_subqueries_cypher},
-        )
-
+        self, ctx: Context, ev: PlanResults
+    ) -> ExecutePlan | FinalAnswer:
         original_question = await ctx.get("original_question")
         dynamic_notebook = await ctx.get("dynamic_notebook")
-        plan = await ctx.get("plan")
 
-        # Do the information check
+        # The whole plan has run, dependent subqueries already got the results
+        # they build on, so there is no remaining plan to revise. The notebook
+        # is updated here once per plan, not as each subquery finishes.
         data = await information_check_step(
-            self.llm, result, original_question, dynamic_notebook, plan
+            self.llm, ev.results, original_question, dynamic_notebook, []
         )
 
         # Get count of information checks done
@@ -258,24 +287,18 @@ class IterativePlanningFlow(Workflow):
         if data.get("modified_plan") and information_checks < MAX_INFORMATION_CHECKS:
             ctx.write_event_to_stream(
                 SseEvent(
-                    message=f"Modified plan: {data.get('modified_plan')}",
+                    message=f"Modified plan: {format_plan(data['modified_plan'])}",
                     label="Modified plan",
                 )
             )
-            await ctx.set(
-                "count_of_subqueries", len(data["modified_plan"][0])
-            )  # this is used for ctx.collect()
             await ctx.set("dynamic_notebook", data["dynamic_notebook"])
-            await ctx.set("plan", data.get("modified_plan")[1:])
             await ctx.set("information_checks", information_checks + 1)
-            for subquery in data["modified_plan"][0]:
-                ctx.send_event(
-                    GenerateCypher(subquery=subquery, retries=MAX_CORRECT_STEPS)
-                )
+            return ExecutePlan(plan=data["modified_plan"])
         else:
             return FinalAnswer(context=data["dynamic_notebook"])
 
     @step
+    @instrument_step
     async def final_answer(self, ctx: Context, ev: FinalAnswer) -> StopEvent:
         original_question = await ctx.get("original_question")
         final_answer_prompt = get_final_answer_prompt()
@@ -9,7 +9,9 @@ from llama_index.core.workflow import (
     step,
 )
 
-from workflows.shared.local_fewshot_manager import LocalFewshotManager
+from workflows.shared.cypher_executor import DEFAULT_RECORD_LIMIT
+from workflows.shared.metrics import instrument_step
+from workflows.shared.record_format import format_records
 from workflows.shared.sse_event import SseEvent
 from workflows.steps.naive_text2cypher import (
     generate_cypher_step,
@@ -33,24 +35,42 @@ class NaiveText2CypherFlow(Workflow):
         super().__init__(*args, **kwargs)
 
         self.llm = llm
+        self.embed_model = embed_model
         self.graph_store = db["graph_store"]
-        self.fewshot_retriever = LocalFewshotManager()
+        self.executor = db["executor"]
+        self.schema_cache = db["schema_cache"]
+        self.cypher_cache = db["cypher_cache"]
+        self.fewshot_retriever = db["local_fewshot_manager"]
         self.db_name = db["name"]
 
     @step
+    @instrument_step
     async def generate_cypher(self, ctx: Context, ev: StartEvent) -> ExecuteCypherEvent:
         question = ev.input
 
-        fewshot_examples = self.fewshot_retriever.get_fewshot_examples(
-            question, self.db_name
-        )
+        # Fewshot retrieval is only needed on a cache miss
+        async def generate():
+            fewshot_examples = await self.fewshot_retriever.aretrieve_fewshots(
+                question, self.db_name, self.embed_model
+            )
+
+            return await generate_cypher_step(
+                self.llm,
+                self.schema_cache,
+                question,
+                fewshot_examples,
+            )
 
-        cypher_query = await generate_cypher_step(
-            self.llm,
-            self.graph_store,
-            question,
-            fewshot_examples,
+        cypher_query, cache_entry = await self.cypher_cache.get_or_generate(
+            database=self.db_name,
+            schema_version=self.schema_cache.version,
+            llm_name=self.llm.model,
+            question=question,
+            generate=generate,
+            embed_model=self.embed_model,
         )
+        # Stored once the statement ran
+        await ctx.set("cache_entry", cache_entry)
 
         ctx.write_event_to_stream(
             SseEvent(
@@ -63,14 +83,19 @@ class NaiveText2CypherFlow(Workflow):
         return ExecuteCypherEvent(question=question, cypher=cypher_query)
 
     @step
+    @instrument_step
     async def execute_query(
         self, ctx: Context, ev: ExecuteCypherEvent
     ) -> SummarizeEvent:
         try:
-            # Hard limit to 100 records
-            database_output = str(self.graph_store.structured_query(ev.cypher)[:100])
+            # Only the first records are fetched, the rest is discarded by the server
+            records = await self.executor.run(ev.cypher, limit=DEFAULT_RECORD_LIMIT)
+            database_output = format_records(records, truncated=records.truncated)
         except Exception as e:
             database_output = str(e)
+            await self.cypher_cache.invalidate(await ctx.get("cache_entry"))
+        else:
+            await self.cypher_cache.put(await ctx.get("cache_entry"), ev.cypher)
         ctx.write_event_to_stream(
             SseEvent(
                 message=f"Database output: {database_output}", label="Database output"
@@ -81,6 +106,7 @@ class NaiveText2CypherFlow(Workflow):
         )
 
     @step
+    @instrument_step
     async def summarize_answer(self, ctx: Context, ev: SummarizeEvent) -> StopEvent:
         naive_final_answer_prompt = get_naive_final_answer_prompt()
         gen = await self.llm.astream_chat(
@@ -9,7 +9,9 @@ from llama_index.core.workflow import (
     step,
 )
 
-from workflows.shared.local_fewshot_manager import LocalFewshotManager
+from workflows.shared.cypher_executor import DEFAULT_RECORD_LIMIT
+from workflows.shared.metrics import instrument_step, record_retry
+from workflows.shared.record_format import format_records
 from workflows.shared.sse_event import SseEvent
 from workflows.steps.naive_text2cypher import (
     correct_cypher_step,
@@ -42,32 +44,65 @@ class NaiveText2CypherRetryFlow(Workflow):
         super().__init__(*args, **kwargs)
 
         self.llm = llm
+        self.embed_model = embed_model
         self.graph_store = db["graph_store"]
-        self.fewshot_retriever = LocalFewshotManager()
+        self.executor = db["executor"]
+        self.schema_cache = db["schema_cache"]
+        self.cypher_cache = db["cypher_cache"]
+        self.cypher_validator = db["cypher_validator"]
+        self.speculative_generator = db["speculative_generator"]
+        self.fewshot_retriever = db["local_fewshot_manager"]
         self.db_name = db["name"]
 
     @step
+    @instrument_step
     async def generate_cypher(self, ctx: Context, ev: StartEvent) -> ExecuteCypherEvent:
         # Init global vars
         await ctx.set("retries", 0)
 
         question = ev.input
 
-        fewshot_examples = self.fewshot_retriever.get_fewshot_examples(
-            question, self.db_name
-        )
+        generated_by = self.llm
 
-        cypher_query = await generate_cypher_step(
-            self.llm,
-            self.graph_store,
-            question,
-            fewshot_examples,
+        # Fewshot retrieval is only needed on a cache miss
+        async def generate():
+            nonlocal generated_by
+            fewshot_examples = await self.fewshot_retriever.aretrieve_fewshots(
+                question, self.db_name, self.embed_model
+            )
+
+            # With speculation enabled, the first valid statement of several LLMs wins
+            cypher, generated_by = await self.speculative_generator.generate_with_llm(
+                self.llm,
+                lambda llm: generate_cypher_step(
+                    llm,
+                    self.schema_cache,
+                    question,
+                    fewshot_examples,
+                ),
+                self.cypher_validator,
+            )
+            return cypher
+
+        cypher_query, cache_entry = await self.cypher_cache.get_or_generate(
+            database=self.db_name,
+            schema_version=self.schema_cache.version,
+            llm_name=self.llm.model,
+            question=question,
+            generate=generate,
+            embed_model=self.embed_model,
         )
+        # Entries are keyed by the workflow's LLM, other LLMs' statements stay out
+        if generated_by.model != self.llm.model:
+            cache_entry = None
+        # Stored once the statement, or its correction, ran
+        await ctx.set("cache_entry", cache_entry)
 
         # Return for the next step
         return ExecuteCypherEvent(question=question, cypher=cypher_query)
 
     @step
+    @instrument_step
     async def execute_query(
         self, ctx: Context, ev: ExecuteCypherEvent
     ) -> SummarizeEvent | CorrectCypherEvent:
@@ -79,16 +114,21 @@ class NaiveText2CypherRetryFlow(Workflow):
         )
 
         try:
-            # Hard limit to 100 records
-            database_output = str(self.graph_store.structured_query(ev.cypher)[:100])
+            # Only the first records are fetched, the rest is discarded by the server
+            records = await self.executor.run(ev.cypher, limit=DEFAULT_RECORD_LIMIT)
+            database_output = format_records(records, truncated=records.truncated)
         except Exception as e:
             database_output = str(e)
+            await self.cypher_cache.invalidate(await ctx.get("cache_entry"))
             # Retry
             if retries < self.max_retries:
                 await ctx.set("retries", retries + 1)
+                record_retry()
                 return CorrectCypherEvent(
                     question=ev.question, cypher=ev.cypher, error=database_output
                 )
+        else:
+            await self.cypher_cache.put(await ctx.get("cache_entry"), ev.cypher)
 
         ctx.write_event_to_stream(
             SseEvent(
@@ -101,20 +141,29 @@ class NaiveText2CypherRetryFlow(Workflow):
         )
 
     @step
+    @instrument_step
     async def correct_cypher_step(
         self, ctx: Context, ev: CorrectCypherEvent
     ) -> ExecuteCypherEvent:
-        results = await correct_cypher_step(
-            llm=self.llm,
-            graph_store=self.graph_store,
-            subquery=ev.question,
-            cypher=ev.cypher,
-            errors=ev.error,
+        results, corrected_by = await self.speculative_generator.generate_with_llm(
+            self.llm,
+            lambda llm: correct_cypher_step(
+                llm=llm,
+                schema_cache=self.schema_cache,
+                subquery=ev.question,
+                cypher=ev.cypher,
+                errors=ev.error,
+            ),
+            self.cypher_validator,
         )
 
+        if corrected_by.model != self.llm.model:
+            # Not the workflow LLM's statement, so it isn't cached under its name
+            await ctx.set("cache_entry", None)
         return ExecuteCypherEvent(question=ev.question, cypher=results)
 
     @step
+    @instrument_step
     async def summarize_answer(self, ctx: Context, ev: SummarizeEvent) -> StopEvent:
         naive_final_answer_prompt = get_naive_final_answer_prompt()
 
@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr
+
+DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES = 10000
+DEFAULT_BATCH_WAIT = 0.01
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model with an LRU cache keyed by text hash.
+
+    Concurrent async text embedding requests that miss the cache are coalesced
+    into a single batch call of the wrapped model. The async methods read and
+    write the optional SQLite file in a worker thread, one commit per batch.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _max_entries: int = PrivateAttr()
+    _batch_wait: float = PrivateAttr()
+    _cache: "OrderedDict[str, Embedding]" = PrivateAttr()
+    _conn: Optional[sqlite3.Connection] = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _queue: List[Tuple[str, str]] = PrivateAttr()
+    _pending: Dict[str, asyncio.Future] = PrivateAttr()
+    _flush_handle: Optional[asyncio.TimerHandle] = PrivateAttr()
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        max_entries: int = DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES,
+        path: Optional[str] = None,
+        batch_wait: float = DEFAULT_BATCH_WAIT,
+        **kwargs: Any,
+    ):
+        """
+        :param embed_model: The embedding model to wrap
+        :param max_entries: Number of embeddings kept in memory
+        :param path: Optional SQLite file that persists embeddings across restarts
+        :param batch_wait: Seconds to wait for more requests before sending a batch
+        """
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._max_entries = max_entries
+        self._batch_wait = batch_wait
+        self._cache = OrderedDict()
+        self._queue = []
+        self._pending = {}
+        self._flush_handle = None
+        self._conn = None
+        self._lock = threading.Lock()
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB)"
+            )
+            self._conn.commit()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        key = self._key("query", query)
+        embedding = self._lookup(key)
+        if embedding is None:
+            embedding = self._embed_model.get_query_embedding(query)
+            self._store(key, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        key = self._key("query", query)
+        embedding = self._recall(key)
+        if embedding is None and self._conn is not None:
+            embedding = await self._run(self._load, key)
+            if embedding is not None:
+                self._remember(key, embedding)
+        if embedding is None:
+            embedding = await self._embed_model.aget_query_embedding(query)
+            self._remember(key, embedding)
+            if self._conn is not None:
+                await self._run(self._persist, [(key, embedding)])
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys = [self._key("text", text) for text in texts]
+        embeddings = [self._lookup(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self._embed_model.get_text_embedding_batch(
+                [texts[i] for i in missing]
+            )
+            for i, embedding in zip(missing, computed):
+                self._store(keys[i], embedding)
+                embeddings[i] = embedding
+        return embeddings
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        key = self._key("text", text)
+        embedding = self._recall(key)
+        if embedding is not None:
+            return embedding
+
+        # Join an in-flight request for the same text or start a new one
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            if self._conn is None:
+                self._enqueue(key, text)
+            else:
+                # Runs apart from the caller, so a cancelled caller can't leave
+                # the joined requests waiting
+                asyncio.ensure_future(self._load_or_enqueue(key, text))
+        # A cancelled caller must not cancel the batch for everyone else
+        return await asyncio.shield(future)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await asyncio.gather(*[self._aget_text_embedding(t) for t in texts])
+
+    async def _load_or_enqueue(self, key: str, text: str) -> None:
+        try:
+            embedding = await self._run(self._load, key)
+        except Exception as ex:
+            self._pending.pop(key).set_exception(ex)
+            return
+        if embedding is None:
+            self._enqueue(key, text)
+        else:
+            self._remember(key, embedding)
+            self._pending.pop(key).set_result(embedding)
+
+    def _enqueue(self, key: str, text: str) -> None:
+        loop = asyncio.get_running_loop()
+        self._queue.append((key, text))
+        if len(self._queue) >= self.embed_batch_size:
+            self._schedule_flush(loop, 0)
+        elif self._flush_handle is None:
+            self._schedule_flush(loop, self._batch_wait)
+
+    def _schedule_flush(self, loop: asyncio.AbstractEventLoop, delay: float) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(
+            delay, lambda: asyncio.ensure_future(self._flush())
+        )
+
+    async def _flush(self) -> None:
+        self._flush_handle = None
+        batch, self._queue = self._queue, []
+        if not batch:
+            return
+
+        try:
+            embeddings = await self._embed_model.aget_text_embedding_batch(
+                [text for _, text in batch]
+            )
+        except Exception as ex:
+            for key, _ in batch:
+                self._pending.pop(key).set_exception(ex)
+            return
+
+        rows = list(zip([key for key, _ in batch], embeddings))
+        for key, embedding in rows:
+            self._remember(key, embedding)
+            self._pending.pop(key).set_result(embedding)
+        # A short response must not leave the remaining callers waiting
+        for key, _ in batch[len(rows) :]:
+            self._pending.pop(key).set_exception(
+                ValueError(
+                    f"Embedding model returned {len(embeddings)} embeddings "
+                    f"for {len(batch)} texts"
+                )
+            )
+
+        if self._conn is not None and rows:
+            try:
+                await self._run(self._persist, rows)
+            except Exception as ex:
+                print(f"Failed to persist {len(rows)} embeddings: {ex}")
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x1f{kind}\x1f{text}".encode()).hexdigest()
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        # SQLite reads and commits block, so they run in a worker thread
+        def locked():
+            with self._lock:
+                return fn(*args)
+
+        return await asyncio.to_thread(locked)
+
+    def _lookup(self, key: str) -> Optional[Embedding]:
+        embedding = self._recall(key)
+        if embedding is None and self._conn is not None:
+            with self._lock:
+                embedding = self._load(key)
+            if embedding is not None:
+                self._remember(key, embedding)
+        return embedding
+
+    def _store(self, key: str, embedding: Embedding) -> None:
+        self._remember(key, embedding)
+        if self._conn is not None:
+            with self._lock:
+                self._persist([(key, embedding)])
+
+    def _recall(self, key: str) -> Optional[Embedding]:
+        embedding = self._cache.get(key)
+        if embedding is not None:
+            self._cache.move_to_end(key)
+        return embedding
+
+    def _load(self, key: str) -> Optional[Embedding]:
+        row = self._conn.execute(
+            "SELECT embedding FROM embeddings WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def _persist(self, rows: List[Tuple[str, Embedding]]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+            [
+                (key, np.asarray(embedding, dtype=np.float32).tobytes())
+                for key, embedding in rows
+            ],
+        )
+        self._conn.commit()
+
+    def _remember(self, key: str, embedding: Embedding) -> None:
+        self._cache[key] = embedding
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._max_entries:
+            self._cache.popitem(last=False)
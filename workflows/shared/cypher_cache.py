@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+DEFAULT_CACHE_MAX_ENTRIES = 10000
+
+
+def normalize_question(question: str) -> str:
+    # Case, whitespace and trailing punctuation don't change the generated Cypher
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+class CypherCacheEntry:
+    def __init__(
+        self,
+        scope: Tuple[str, str, str],
+        key: str,
+        normalized: str,
+        embedding: Optional[np.ndarray] = None,
+        source_key: Optional[str] = None,
+        cypher: Optional[str] = None,
+    ):
+        """
+        The cache slot of one question, passed back to `put` or `invalidate`.
+
+        :param source_key: Key of the entry the statement was served from, None
+            for a generated statement
+        :param cypher: The statement that was served from the cache
+        """
+        self.scope = scope
+        self.key = key
+        self.normalized = normalized
+        self.embedding = embedding
+        self.source_key = source_key
+        self.cypher = cypher
+
+
+class CypherGenerationCache:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = DEFAULT_CACHE_TTL,
+        max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+        similarity_threshold: Optional[float] = None,
+    ):
+        """
+        Cache generated Cypher statements in a local SQLite file.
+
+        Entries are keyed on (database, schema version, llm, normalized question).
+        When a similarity threshold is set, a miss falls back to the most similar
+        cached question by embedding.
+
+        :param path: SQLite file to persist the cache in, None disables the cache
+        :param ttl: Seconds after which an entry is no longer served
+        :param max_entries: Least recently used entries beyond this are evicted
+        :param similarity_threshold: Minimum cosine similarity for a semantic hit
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        # (database, schema_version, llm) -> (keys, normalized embedding matrix)
+        self._indexes: Dict[Tuple[str, str, str], Tuple[list, np.ndarray]] = {}
+        self._conn = None
+        # The connection is shared by the worker threads the queries run in
+        self._lock = threading.Lock()
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS cypher_cache (
+    key TEXT PRIMARY KEY,
+    database TEXT,
+    schema_version TEXT,
+    llm TEXT,
+    question TEXT,
+    cypher TEXT,
+    embedding BLOB,
+    created REAL,
+    last_used REAL
+)"""
+            )
+            self._conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self._conn is not None
+
+    async def get_or_generate(
+        self,
+        database: str,
+        schema_version: str,
+        llm_name: str,
+        question: str,
+        generate: Callable[[], Awaitable[str]],
+        embed_model=None,
+    ) -> Tuple[str, Optional[CypherCacheEntry]]:
+        """
+        Return the cached Cypher statement for the question or generate one.
+
+        Generated statements aren't stored until they ran, the workflow passes
+        the returned entry to `put` once the statement ran without errors and
+        to `invalidate` when a cached statement failed. The entry is None when
+        the cache is disabled.
+        """
+        if not self.enabled:
+            return await generate(), None
+
+        scope = (database, schema_version, llm_name)
+        normalized = normalize_question(question)
+        key = self._key(scope, normalized)
+
+        cypher = await self._run(self._lookup, key)
+        if cypher is not None:
+            self.hits += 1
+            return cypher, CypherCacheEntry(
+                scope, key, normalized, source_key=key, cypher=cypher
+            )
+
+        embedding = None
+        if self.similarity_threshold is not None and embed_model is not None:
+            embedding = np.asarray(
+                await embed_model.aget_text_embedding(normalized), dtype=np.float32
+            )
+            embedding /= np.linalg.norm(embedding) or 1.0
+            match = await self._run(self._semantic_lookup, scope, embedding)
+            if match is not None:
+                self.semantic_hits += 1
+                source_key, cypher = match
+                return cypher, CypherCacheEntry(
+                    scope, key, normalized, embedding, source_key, cypher
+                )
+
+        self.misses += 1
+        return await generate(), CypherCacheEntry(scope, key, normalized, embedding)
+
+    async def put(self, entry: Optional[CypherCacheEntry], cypher: str) -> None:
+        """
+        Store the statement that answered the entry's question without errors.
+        """
+        if entry is None or (entry.source_key == entry.key and entry.cypher == cypher):
+            return
+        # Semantic hits are stored under their own question from now on
+        entry.source_key, entry.cypher = entry.key, cypher
+        await self._run(
+            self._store,
+            entry.scope,
+            entry.key,
+            entry.normalized,
+            cypher,
+            entry.embedding,
+        )
+
+    async def invalidate(self, entry: Optional[CypherCacheEntry]) -> None:
+        """
+        Drop the cached statement the entry was served from after it failed.
+        """
+        if entry is None or entry.source_key is None:
+            return
+        source_key, entry.source_key, entry.cypher = entry.source_key, None, None
+        await self._run(self._delete, "key = ?", (source_key,))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        # SQLite commits block, so they run in a worker thread
+        def locked():
+            with self._lock:
+                return fn(*args)
+
+        return await asyncio.to_thread(locked)
+
+    def _key(self, scope: Tuple[str, str, str], normalized: str) -> str:
+        return hashlib.sha256("\x1f".join([*scope, normalized]).encode()).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT cypher, created FROM cypher_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        cypher, created = row
+        if time.time() - created > self.ttl:
+            self._delete("key = ?", (key,))
+            return None
+        self._touch(key)
+        return cypher
+
+    def _semantic_lookup(
+        self, scope: Tuple[str, str, str], embedding: np.ndarray
+    ) -> Optional[Tuple[str, str]]:
+        keys, matrix = self._get_index(scope)
+        if not keys:
+            return None
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        cypher = self._lookup(keys[best])
+        return (keys[best], cypher) if cypher is not None else None
+
+    def _get_index(self, scope: Tuple[str, str, str]) -> Tuple[list, np.ndarray]:
+        if scope not in self._indexes:
+            rows = self._conn.execute(
+                """SELECT key, embedding FROM cypher_cache
+WHERE database = ? AND schema_version = ? AND llm = ? AND embedding IS NOT NULL""",
+                scope,
+            ).fetchall()
+            keys = [key for key, _ in rows]
+            matrix = (
+                np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+                if rows
+                else np.empty((0, 0), dtype=np.float32)
+            )
+            self._indexes[scope] = (keys, matrix)
+        return self._indexes[scope]
+
+    def _store(
+        self,
+        scope: Tuple[str, str, str],
+        key: str,
+        normalized: str,
+        cypher: str,
+        embedding: Optional[np.ndarray],
+    ) -> None:
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cypher_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                *scope,
+                normalized,
+                cypher,
+                embedding.tobytes() if embedding is not None else None,
+                now,
+                now,
+            ),
+        )
+        self._conn.commit()
+        # Rebuilt lazily with the new entry on the next semantic lookup
+        self._indexes.pop(scope, None)
+        self._evict()
+
+    def _touch(self, key: str) -> None:
+        self._conn.execute(
+            "UPDATE cypher_cache SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self._conn.commit()
+
+    def _evict(self) -> None:
+        self._delete("created < ?", (time.time() - self.ttl,))
+        self._delete(
+            """key IN (SELECT key FROM cypher_cache ORDER BY last_used DESC
+LIMIT -1 OFFSET ?)""",
+            (self.max_entries,),
+        )
+
+    def _delete(self, condition: str, params: tuple) -> None:
+        deleted = self._conn.execute(
+            f"DELETE FROM cypher_cache WHERE {condition}", params
+        ).rowcount
+        self._conn.commit()
+        if deleted:
+            self._indexes.clear()
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterable, Optional
+
+import neo4j
+from llama_index.core.graph_stores.utils import value_sanitize
+
+from workflows.shared.metrics import record_cypher
+from workflows.shared.query_result_cache import (
+    QueryResultCache,
+    is_cacheable,
+    normalize_cypher,
+)
+
+DEFAULT_QUERY_TIMEOUT = 30
+DEFAULT_MAX_CONCURRENT_QUERIES = 8
+# Records passed on to the LLM by the workflows
+DEFAULT_RECORD_LIMIT = 100
+
+
+class CypherExecutor:
+    def __init__(
+        self,
+        graph_store,
+        timeout: Optional[float] = DEFAULT_QUERY_TIMEOUT,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENT_QUERIES,
+        result_cache: Optional[QueryResultCache] = None,
+    ):
+        """
+        Run Cypher statements without blocking the event loop.
+
+        Uses the async Neo4j driver of the graph store when it has one and falls back
+        to a bounded thread pool around `structured_query` otherwise.
+
+        :param graph_store: The Neo4jPropertyGraphStore to run queries against
+        :param timeout: Default per-query timeout in seconds (None disables it)
+        :param max_concurrency: Maximum number of queries in flight at once
+        :param result_cache: Optional cache consulted before running a query
+        """
+        self.graph_store = graph_store
+        self.timeout = timeout
+        self.result_cache = result_cache
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._thread_pool = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="cypher"
+        )
+
+    async def run(
+        self,
+        query: str,
+        param_map: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> "CypherResult":
+        """
+        Execute a Cypher statement and return the records as a list of dicts.
+
+        With a limit, at most that many records are fetched from the server and
+        the rest is discarded, `truncated` on the result tells whether there were more.
+        Cancelling the awaiting task cancels the query. Raises TimeoutError when
+        the query takes longer than the timeout.
+        """
+        start = time.perf_counter()
+        result_cache = (
+            self.result_cache
+            if self.result_cache is not None and is_cacheable(query)
+            else None
+        )
+        if result_cache:
+            records = result_cache.get(query, param_map, limit)
+            if records is not None:
+                record_cypher(time.perf_counter() - start, len(records))
+                return records
+
+        timeout = timeout if timeout is not None else self.timeout
+        async with self._semaphore:
+            try:
+                records = await asyncio.wait_for(
+                    self._execute(query, param_map or {}, timeout, limit), timeout
+                )
+            except asyncio.TimeoutError:
+                raise TimeoutError(
+                    f"Cypher query timed out after {timeout} seconds"
+                ) from None
+
+        # Failed queries raise above and are never cached
+        if result_cache:
+            result_cache.put(query, param_map, records, limit)
+        record_cypher(time.perf_counter() - start, len(records))
+        return records
+
+    async def _execute(
+        self,
+        query: str,
+        param_map: Dict[str, Any],
+        timeout: Optional[float],
+        limit: Optional[int],
+    ) -> "CypherResult":
+        async_driver = getattr(self.graph_store, "_async_driver", None)
+        if async_driver is None:
+            loop = asyncio.get_running_loop()
+            records = await loop.run_in_executor(
+                self._thread_pool,
+                partial(self.graph_store.structured_query, query, param_map),
+            )
+            # structured_query always fetches everything, only the slice is bounded
+            if limit is not None:
+                return CypherResult(records[:limit], truncated=len(records) > limit)
+            return CypherResult(records)
+
+        truncated = False
+        if limit is None:
+            # Same semantics as Neo4jPropertyGraphStore.structured_query, but awaitable
+            data, _, _ = await async_driver.execute_query(
+                neo4j.Query(text=query, timeout=timeout),
+                database_=self.graph_store._database,
+                parameters_=param_map,
+            )
+            records = [record.data() for record in data]
+        else:
+            # Pull one record more than the limit to detect truncation
+            async with async_driver.session(
+                database=self.graph_store._database, fetch_size=limit + 1
+            ) as session:
+                result = await session.run(
+                    neo4j.Query(text=query, timeout=timeout), param_map
+                )
+                records = []
+                async for record in result:
+                    if len(records) == limit:
+                        truncated = True
+                        break
+                    records.append(record.data())
+                # Have the server drop the remaining records instead of streaming them
+                await result.consume()
+
+        if self.graph_store.sanitize_query_output:
+            records = [value_sanitize(el) for el in records]
+        return CypherResult(records, truncated=truncated)
+
+
+class CypherResult(list):
+    """
+    Records of a Cypher statement. `truncated` is set when the statement
+    returned more records than the requested limit.
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]] = (), truncated: bool = False):
+        super().__init__(records)
+        self.truncated = truncated
+
+
+class BatchCypherExecutor:
+    def __init__(self, executor: CypherExecutor):
+        """
+        Runs every distinct Cypher statement of a batch of workflow runs once.
+        Runs of the same statement, concurrent or later, share the records of
+        the first one. Failed statements are run again by the next caller.
+
+        :param executor: The database's executor the statements run on
+        """
+        self.executor = executor
+        self.result_cache = executor.result_cache
+        self._runs: Dict[tuple, asyncio.Task] = {}
+
+    async def run(
+        self,
+        query: str,
+        param_map: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> CypherResult:
+        key = (
+            normalize_cypher(query),
+            json.dumps(param_map or {}, sort_keys=True, default=str),
+            limit,
+        )
+        start = time.perf_counter()
+        shared = key in self._runs
+        if not shared:
+            self._runs[key] = asyncio.ensure_future(
+                self.executor.run(query, param_map, timeout, limit)
+            )
+        task = self._runs[key]
+
+        try:
+            # A cancelled workflow doesn't cancel the run the others wait for
+            records = await asyncio.shield(task)
+        except Exception:
+            if self._runs.get(key) is task:
+                del self._runs[key]
+            raise
+
+        if shared:
+            # The first run records the query, the others only their wait
+            record_cypher(time.perf_counter() - start, len(records))
+        # Each workflow gets its own list, like from the result cache
+        return CypherResult(records, truncated=getattr(records, "truncated", False))
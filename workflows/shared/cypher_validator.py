@@ -0,0 +1,225 @@
+import re
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple
+
+from neo4j.exceptions import ClientError
+
+from workflows.shared.query_result_cache import normalize_cypher
+
+DEFAULT_VALIDATION_CACHE_SIZE = 1024
+
+BRACKETS = {"(": ")", "[": "]", "{": "}"}
+NAME = r"(?:`[^`]+`|\w+)"
+NODE_PATTERN = re.compile(rf"\(\s*(\w*)\s*((?::\s*!?{NAME}\s*(?:[&|]\s*!?{NAME}\s*)*)+)")
+REL_PATTERN = re.compile(rf"\[\s*(\w*)\s*:\s*!?({NAME}(?:\s*\|\s*:?\s*!?{NAME})*)")
+PROPERTY_ACCESS = re.compile(rf"(?<![\w.])(\w+)\.({NAME})")
+# Only in clause position, not as a map key like {set: 1} or a property like n.create.
+# A preceding AS is matched too, so that aliases like `1 AS create` can be skipped.
+WRITE_CLAUSE = re.compile(
+    r"(?:^|(?<=[\s)\]}]))(AS\s+)?(CREATE|MERGE|DELETE|SET|REMOVE|DROP|FOREACH|LOAD\s+CSV)"
+    r"(?=[\s(])(?!\s*:)",
+    re.IGNORECASE,
+)
+
+
+def write_clauses(cypher: str) -> List[str]:
+    """
+    Return the write clauses of a Cypher statement stripped of its literals.
+    """
+    return list(
+        dict.fromkeys(
+            re.sub(r"\s+", " ", match.group(2)).upper()
+            for match in WRITE_CLAUSE.finditer(cypher)
+            if not match.group(1)
+        )
+    )
+
+
+def _names(expression: str) -> List[str]:
+    return [
+        name.strip("`")
+        for name in re.findall(NAME, expression)
+        if name.strip("`")
+    ]
+
+
+def strip_literals(cypher: str) -> Tuple[str, List[str]]:
+    """
+    Remove comments and the contents of string literals from a Cypher statement.
+
+    Returns the stripped statement and any bracket errors found along the way,
+    since brackets inside strings, comments and backticks must not be counted.
+    """
+    stripped = []
+    stack = []
+    errors = []
+    i = 0
+    while i < len(cypher):
+        char = cypher[i]
+        if cypher.startswith("//", i):
+            end = cypher.find("\n", i)
+            i = len(cypher) if end == -1 else end
+            continue
+        if cypher.startswith("/*", i):
+            end = cypher.find("*/", i + 2)
+            i = len(cypher) if end == -1 else end + 2
+            continue
+        if char in "'\"`":
+            end = i + 1
+            while end < len(cypher) and cypher[end] != char:
+                end += 2 if cypher[end] == "\\" else 1
+            if end >= len(cypher):
+                errors.append(f"Unterminated {char} quoted literal")
+            # Backticked names are kept, string literals are emptied
+            stripped.append(cypher[i : end + 1] if char == "`" else char * 2)
+            i = end + 1
+            continue
+        if char in BRACKETS:
+            stack.append(char)
+        elif char in BRACKETS.values():
+            if not stack or BRACKETS[stack.pop()] != char:
+                errors.append(f"Unbalanced brackets: unexpected '{char}'")
+                stack = []
+        stripped.append(char)
+        i += 1
+
+    if stack:
+        errors.append(
+            "Unbalanced brackets: missing "
+            + " ".join(f"'{BRACKETS[char]}'" for char in reversed(stack))
+        )
+    return "".join(stripped), errors
+
+
+class CypherValidator:
+    def __init__(
+        self,
+        schema_cache,
+        executor,
+        read_only: bool = True,
+        cache_size: int = DEFAULT_VALIDATION_CACHE_SIZE,
+    ):
+        """
+        Validate generated Cypher locally against the cached schema before
+        spending a database round-trip on EXPLAIN.
+
+        :param schema_cache: The SchemaCache of the database
+        :param executor: The CypherExecutor used for EXPLAIN
+        :param read_only: Reject statements with write clauses
+        :param cache_size: Number of validation results to memoize
+        """
+        self.schema_cache = schema_cache
+        self.executor = executor
+        self.read_only = read_only
+        self.cache_size = cache_size
+        self._results: OrderedDict[
+            Tuple[str, str], Tuple[List[str], List[str]]
+        ] = OrderedDict()
+
+    async def validate(self, cypher: str) -> List[str]:
+        """
+        Return the errors of a Cypher statement, an empty list if it is valid.
+        """
+        errors, _ = await self.check(cypher)
+        return errors
+
+    async def check(self, cypher: str) -> Tuple[List[str], List[str]]:
+        """
+        Return the errors and warnings of a Cypher statement.
+
+        Warnings, like unknown properties, don't stop Neo4j from running the
+        statement, so they don't make it invalid. When EXPLAIN times out only the
+        local checks count and nothing is cached.
+        """
+        # Results are only valid for the schema they were computed against
+        key = (self.schema_cache.version, normalize_cypher(cypher))
+        if key in self._results:
+            self._results.move_to_end(key)
+            errors, warnings = self._results[key]
+            return list(errors), list(warnings)
+
+        errors, warnings = self.validate_locally(cypher)
+        if not errors:
+            try:
+                await self.executor.run(f"EXPLAIN {cypher}")
+            except TimeoutError:
+                # Says nothing about the statement, leave it to the execution
+                print(f"EXPLAIN timed out, skipping it for: {cypher}")
+                return errors, warnings
+            except ClientError as e:
+                # Only errors about the statement itself are kept, transient and
+                # connection errors propagate and are not cached
+                if not (e.code or "").startswith("Neo.ClientError.Statement."):
+                    raise
+                # Unknown functions fail at EXPLAIN too
+                errors.append(e.message or str(e))
+
+        self._results[key] = (errors, warnings)
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return list(errors), list(warnings)
+
+    def validate_locally(self, cypher: str) -> Tuple[List[str], List[str]]:
+        stripped, errors = strip_literals(cypher)
+
+        if self.read_only:
+            errors.extend(
+                f"Write clause {clause} is not allowed, the database is read-only"
+                for clause in write_clauses(stripped)
+            )
+
+        schema = self.schema_cache.schema
+        node_props = schema.get("node_props", {})
+        rel_props = schema.get("rel_props", {})
+        relationships = schema.get("relationships", [])
+        if not node_props and not relationships:
+            # Nothing to check against
+            return errors, []
+
+        labels = set(node_props) | {
+            label for rel in relationships for label in (rel["start"], rel["end"])
+        }
+        rel_types = set(rel_props) | {rel["type"] for rel in relationships}
+
+        variables: Dict[str, Set[str]] = {}
+        rel_variables: Dict[str, Set[str]] = {}
+        unknown = {}
+        unknown_props = {}
+        for variable, expression in NODE_PATTERN.findall(stripped):
+            names = _names(expression)
+            for name in names:
+                if name not in labels:
+                    unknown[f"Label `{name}` does not exist in the graph schema"] = None
+            if variable:
+                variables.setdefault(variable, set()).update(names)
+        for variable, expression in REL_PATTERN.findall(stripped):
+            names = _names(expression)
+            for name in names:
+                if name not in rel_types:
+                    unknown[
+                        f"Relationship type `{name}` does not exist in the graph schema"
+                    ] = None
+            if variable:
+                rel_variables.setdefault(variable, set()).update(names)
+
+        # Only variables bound to known labels/types with known properties are checked
+        for variable, prop in PROPERTY_ACCESS.findall(stripped):
+            prop = prop.strip("`")
+            if variable in variables:
+                owners, props_by_owner = variables[variable], node_props
+            elif variable in rel_variables:
+                owners, props_by_owner = rel_variables[variable], rel_props
+            else:
+                continue
+            if not owners or not all(owner in props_by_owner for owner in owners):
+                continue
+            known = {
+                el["property"] for owner in owners for el in props_by_owner[owner]
+            }
+            if prop not in known:
+                unknown_props[
+                    f"Property `{prop}` does not exist on "
+                    + ", ".join(f"`{owner}`" for owner in sorted(owners))
+                ] = None
+
+        return errors + list(unknown), list(unknown_props)
@@ -0,0 +1,108 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+import neo4j
+from llama_index.graph_stores.neo4j import Neo4jPropertyGraphStore
+
+DEFAULT_MAX_CONNECTION_POOL_SIZE = 100
+DEFAULT_CONNECTION_ACQUISITION_TIMEOUT = 60
+DEFAULT_LIVENESS_CHECK_TIMEOUT = 30
+
+
+class PooledNeo4jPropertyGraphStore(Neo4jPropertyGraphStore):
+    def __init__(
+        self,
+        driver: neo4j.Driver,
+        async_driver: neo4j.AsyncDriver,
+        database: Optional[str] = "neo4j",
+        refresh_schema: bool = True,
+        sanitize_query_output: bool = True,
+        enhanced_schema: bool = False,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Neo4jPropertyGraphStore on drivers from a DriverPool instead of its own.
+
+        Indexes are never created, the stores are only used for reading.
+
+        :param driver: Sync driver shared by all stores on the same URI
+        :param async_driver: Async driver shared by all stores on the same URI
+        """
+        self.sanitize_query_output = sanitize_query_output
+        self.enhanced_schema = enhanced_schema
+        self._driver = driver
+        self._async_driver = async_driver
+        self._database = database
+        self._timeout = timeout
+        self.structured_schema = {}
+        if refresh_schema:
+            self.refresh_schema()
+        self.verify_version()
+
+    def close(self) -> None:
+        # The drivers belong to the pool and are closed with it
+        pass
+
+
+class DriverPool:
+    def __init__(
+        self,
+        max_connection_pool_size: int = DEFAULT_MAX_CONNECTION_POOL_SIZE,
+        connection_acquisition_timeout: float = DEFAULT_CONNECTION_ACQUISITION_TIMEOUT,
+        liveness_check_timeout: Optional[float] = DEFAULT_LIVENESS_CHECK_TIMEOUT,
+    ):
+        """
+        One sync and one async driver per URI and user, shared by every graph
+        store on that URI, so the demo databases and the fewshot manager reuse
+        the same connections.
+
+        :param max_connection_pool_size: Connections per driver
+        :param connection_acquisition_timeout: Seconds to wait for a free connection
+        :param liveness_check_timeout: Connections idle for longer than this many
+            seconds are checked before use, None disables the check
+        """
+        self.driver_config = {
+            "max_connection_pool_size": max_connection_pool_size,
+            "connection_acquisition_timeout": connection_acquisition_timeout,
+            "liveness_check_timeout": liveness_check_timeout,
+            "notifications_min_severity": "OFF",
+        }
+        self._drivers: Dict[tuple, Tuple[neo4j.Driver, neo4j.AsyncDriver]] = {}
+        # Graph stores are created from worker threads during startup
+        self._lock = threading.Lock()
+
+    def get_drivers(
+        self, uri: str, username: str, password: str
+    ) -> Tuple[neo4j.Driver, neo4j.AsyncDriver]:
+        key = (uri, username, password)
+        with self._lock:
+            if key not in self._drivers:
+                auth = (username, password)
+                self._drivers[key] = (
+                    neo4j.GraphDatabase.driver(uri, auth=auth, **self.driver_config),
+                    neo4j.AsyncGraphDatabase.driver(
+                        uri, auth=auth, **self.driver_config
+                    ),
+                )
+            return self._drivers[key]
+
+    def graph_store(
+        self,
+        uri: str,
+        username: str,
+        password: str,
+        database: Optional[str] = "neo4j",
+        **kwargs,
+    ) -> PooledNeo4jPropertyGraphStore:
+        driver, async_driver = self.get_drivers(uri, username, password)
+        return PooledNeo4jPropertyGraphStore(
+            driver, async_driver, database=database, **kwargs
+        )
+
+    async def close(self) -> None:
+        with self._lock:
+            drivers = list(self._drivers.values())
+            self._drivers = {}
+        for driver, async_driver in drivers:
+            driver.close()
+            await async_driver.close()
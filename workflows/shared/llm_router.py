@@ -0,0 +1,284 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.llms import LLM, CustomLLM
+from pydantic import BaseModel, PrivateAttr
+
+from workflows.shared.metrics import current_step, record_hedge, record_routed
+
+ACCURATE = "accurate"
+FAST = "fast"
+# Steps that only judge or rephrase database output, the fastest LLM will do
+FAST_STEPS = {"start", "evaluate_context", "summarize_answer", "final_answer"}
+
+STATS_WINDOW = 100
+# Calls before an LLM's statistics are trusted, until then it is preferred
+MIN_SAMPLES = 5
+# Hedge delay while the primary LLM has too few samples for a p95
+DEFAULT_HEDGE_DELAY = 10.0
+
+
+class LatencyStats:
+    def __init__(self, window: int = STATS_WINDOW):
+        """
+        Latencies of the most recent calls of an LLM, None for failed calls.
+        """
+        self._calls: Deque[Optional[float]] = deque(maxlen=window)
+
+    def record(self, latency: Optional[float]) -> None:
+        self._calls.append(latency)
+
+    def _latencies(self) -> List[float]:
+        return sorted(latency for latency in self._calls if latency is not None)
+
+    def expected_latency(self) -> float:
+        """
+        Median latency divided by the success rate, i.e. including retries.
+        """
+        # Zero for LLMs without enough calls, so every LLM gets sampled
+        if len(self._calls) < MIN_SAMPLES:
+            return 0.0
+        latencies = self._latencies()
+        if not latencies:
+            return math.inf
+        median = latencies[len(latencies) // 2]
+        return median * len(self._calls) / len(latencies)
+
+    def hedge_delay(self) -> float:
+        latencies = self._latencies()
+        if len(latencies) < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return latencies[math.ceil(len(latencies) * 0.95) - 1]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": len(self._calls),
+            "expected_latency": round(self.expected_latency(), 3),
+            "hedge_delay": round(self.hedge_delay(), 3),
+        }
+
+
+class RoutedLLM(CustomLLM):
+    """
+    Virtual LLM that sends each call to one of several LLMs based on their
+    recent latency and errors.
+
+    Cypher generation, planning and correction go to the accurate LLMs, the
+    steps in FAST_STEPS to the fast ones. When the chosen LLM takes longer
+    than its p95 latency, the call is repeated on the next LLM and whichever
+    answers first is used. Failed calls are repeated on the next LLM. Sync
+    calls go to the preferred LLM of the route without hedging.
+    """
+
+    model: str = "auto"
+
+    _routes: Dict[str, List[str]] = PrivateAttr()
+    _get_llm: Callable[[str], Optional[LLM]] = PrivateAttr()
+    _llms: Dict[str, LLM] = PrivateAttr()
+    _stats: Dict[Tuple[str, str], LatencyStats] = PrivateAttr()
+
+    def __init__(
+        self,
+        accurate: Sequence[str],
+        fast: Sequence[str],
+        get_llm: Callable[[str], Optional[LLM]],
+        **kwargs: Any,
+    ):
+        """
+        :param accurate: LLMs for Cypher generation and every other step, in
+            order of preference while there are no statistics
+        :param fast: LLMs for the steps in FAST_STEPS
+        :param get_llm: Looks up an LLM by name, e.g. ResourceManager.get_model_by_name
+        """
+        super().__init__(**kwargs)
+        self._routes = {ACCURATE: list(accurate), FAST: list(fast)}
+        self._get_llm = get_llm
+        self._llms = {}
+        self._stats = {}
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            model_name=self.model, is_chat_model=True, is_function_calling_model=True
+        )
+
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        return self._default_llm().complete(prompt, formatted=formatted, **kwargs)
+
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        return self._default_llm().stream_complete(
+            prompt, formatted=formatted, **kwargs
+        )
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return self._default_llm().chat(messages, **kwargs)
+
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        return self._default_llm().stream_chat(messages, **kwargs)
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        return await self._hedged(
+            lambda llm: llm.acomplete(prompt, formatted=formatted, **kwargs)
+        )
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await self._hedged(lambda llm: llm.achat(messages, **kwargs))
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        # A stream can't be hedged once it is consumed, only failed starts move on
+        route = self.route()
+        error = None
+        for name in self.candidates(route):
+            try:
+                llm = await self._resolve(name)
+                stream = await llm.astream_chat(messages, **kwargs)
+            except Exception as ex:
+                self.stats(name, route).record(None)
+                error = error or ex
+                continue
+            record_routed(name, route)
+            return stream
+        raise error
+
+    async def astructured_predict(
+        self,
+        output_cls: Type[BaseModel],
+        prompt,
+        llm_kwargs: Optional[Dict[str, Any]] = None,
+        **prompt_args: Any,
+    ) -> BaseModel:
+        return await self._hedged(
+            lambda llm: llm.astructured_predict(
+                output_cls, prompt, llm_kwargs=llm_kwargs, **prompt_args
+            )
+        )
+
+    def route(self) -> str:
+        return FAST if current_step() in FAST_STEPS else ACCURATE
+
+    def stats(self, name: str, route: str) -> LatencyStats:
+        # Per route, the steps of a route have similar prompt and output sizes
+        return self._stats.setdefault((name, route), LatencyStats())
+
+    def candidates(self, route: str) -> List[str]:
+        # Stable, so the configured order decides between equal LLMs
+        return sorted(
+            self._routes[route], key=lambda name: self.stats(name, route).expected_latency()
+        )
+
+    def stats_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            f"{name} ({route})": stats.to_dict()
+            for (name, route), stats in self._stats.items()
+        }
+
+    async def _resolve(self, name: str) -> LLM:
+        if name not in self._llms:
+            # Clients are created on first use and some check the model over the network
+            await asyncio.to_thread(self._resolve_sync, name)
+        return self._llms[name]
+
+    def _resolve_sync(self, name: str) -> LLM:
+        if name not in self._llms:
+            llm = self._get_llm(name)
+            if llm is None:
+                raise ValueError(f"LLM '{name}' is not available")
+            self._llms[name] = llm
+        return self._llms[name]
+
+    def _default_llm(self) -> LLM:
+        route = self.route()
+        name = self.candidates(route)[0]
+        record_routed(name, route)
+        return self._resolve_sync(name)
+
+    async def _timed(
+        self, name: str, route: str, call: Callable[[LLM], Awaitable[Any]]
+    ) -> Any:
+        llm = await self._resolve(name)
+        start = time.perf_counter()
+        try:
+            result = await call(llm)
+        except asyncio.CancelledError:
+            # Lost a hedge, it took at least this long. Not recording it would
+            # leave a slow LLM without samples and always preferred.
+            self.stats(name, route).record(time.perf_counter() - start)
+            raise
+        except Exception:
+            self.stats(name, route).record(None)
+            raise
+        self.stats(name, route).record(time.perf_counter() - start)
+        return result
+
+    async def _hedged(self, call: Callable[[LLM], Awaitable[Any]]) -> Any:
+        route = self.route()
+        names = self.candidates(route)
+        primary = names[0]
+        record_routed(primary, route)
+        tasks = {asyncio.create_task(self._timed(primary, route, call)): primary}
+        pending = set(tasks)
+        backups = names[1:]
+        hedged = False
+        error = None
+        try:
+            while pending:
+                # Only one backup for a slow call, failed calls move on regardless
+                timeout = (
+                    self.stats(primary, route).hedge_delay()
+                    if backups and not hedged
+                    else None
+                )
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            record_hedge(primary, tasks[task])
+                        return task.result()
+                    error = error or task.exception()
+                if backups and (not done or not pending):
+                    hedged = hedged or not done
+                    name = backups.pop(0)
+                    record_routed(name, route)
+                    task = asyncio.create_task(self._timed(name, route, call))
+                    tasks[task] = name
+                    pending.add(task)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,401 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    LLMMetadata,
+)
+from llama_index.core.llms import LLM, CustomLLM
+from llama_index.core.utils import get_tokenizer
+from pydantic import BaseModel, PrivateAttr
+
+from workflows.shared.metrics import record_llm_queue, record_rate_limited
+
+# Lower values are served first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+DEFAULT_LLM_MAX_CONCURRENCY = 16
+# Used when a rate limited response doesn't say when to retry
+DEFAULT_RATE_LIMIT_BACKOFF = 5
+MAX_RATE_LIMIT_RETRIES = 3
+
+_request: ContextVar[Tuple[int, str]] = ContextVar(
+    "llm_request", default=(INTERACTIVE, "")
+)
+
+
+@contextmanager
+def llm_request(priority: int, session: str):
+    """
+    Set the priority and session of the LLM calls of workflows started inside
+    the block. Workflow steps run in tasks that copy the context when the
+    workflow is started, so only the `run` call needs to be inside.
+    """
+    token = _request.set((priority, session))
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+def unwrap_llm(llm: LLM) -> LLM:
+    # Wrappers like ScheduledLLM keep the client in _llm
+    while getattr(llm, "_llm", None) is not None:
+        llm = llm._llm
+    return llm
+
+
+def provider_of(llm: LLM) -> str:
+    # One provider per client class, e.g. OpenAI, Gemini, Anthropic, MistralAI
+    return type(unwrap_llm(llm)).__name__
+
+
+def parse_provider_limits(value: Optional[str]) -> Dict[str, float]:
+    # "OpenAI=500,Anthropic=50" to {"OpenAI": 500.0, "Anthropic": 50.0}
+    limits = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            provider, limit = item.split("=")
+            limits[provider.strip()] = float(limit)
+    return limits
+
+
+def retry_after(ex: Exception) -> Optional[float]:
+    """
+    Seconds to wait before retrying when the exception is a provider's rate
+    limit response, None for any other exception.
+    """
+    status = getattr(ex, "status_code", None) or getattr(ex, "code", None)
+    if status != 429 and type(ex).__name__ not in (
+        "RateLimitError",
+        "ResourceExhausted",
+        "TooManyRequests",
+    ):
+        return None
+    headers = getattr(getattr(ex, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return DEFAULT_RATE_LIMIT_BACKOFF
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: Tokens added per second
+        :param capacity: Maximum burst size, defaults to one second worth of tokens
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        # More than the capacity would never fit, it takes the whole bucket instead
+        tokens = min(tokens, self.capacity)
+        # Holding the lock while sleeping serves waiters in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class ProviderScheduler:
+    def __init__(
+        self,
+        provider: str,
+        max_concurrency: int = DEFAULT_LLM_MAX_CONCURRENCY,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        """
+        Admits the LLM calls to one provider, at most max_concurrency at a time
+        and within the provider's request and prompt token budgets.
+
+        Waiting calls are served by priority and round-robin between the
+        sessions of a priority, so a large batch can't starve other callers.
+
+        :param requests_per_minute: Request budget, None for no limit
+        :param tokens_per_minute: Prompt token budget, None for no limit
+        """
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.requests = (
+            TokenBucket(requests_per_minute / 60) if requests_per_minute else None
+        )
+        self.tokens = (
+            TokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute)
+            if tokens_per_minute
+            else None
+        )
+        self.active = 0
+        # Per priority, the waiting calls of each session in arrival order
+        self._waiters: Dict[int, OrderedDict[str, Deque[asyncio.Future]]] = {}
+        self._paused_until = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(
+            not future.done()
+            for sessions in self._waiters.values()
+            for queue in sessions.values()
+            for future in queue
+        )
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """
+        Wait for a slot and the request's budget. Every acquire is followed by
+        a release once the call is done.
+
+        :param tokens: Prompt tokens of the request
+        """
+        priority, session = _request.get()
+        start = time.perf_counter()
+        await self._acquire_slot(priority, session)
+        try:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.requests:
+                await self.requests.acquire()
+            if self.tokens and tokens:
+                await self.tokens.acquire(tokens)
+        except BaseException:
+            self.release()
+            raise
+        record_llm_queue(
+            self.provider,
+            PRIORITY_NAMES.get(priority, str(priority)),
+            time.perf_counter() - start,
+        )
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        await self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def rate_limited(self, delay: float) -> None:
+        """
+        Hold back all calls to the provider after it rejected one for its rate limit.
+        """
+        record_rate_limited(self.provider)
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    async def _acquire_slot(self, priority: int, session: str) -> None:
+        if self.active < self.max_concurrency and not self.queued:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        sessions = self._waiters.setdefault(priority, OrderedDict())
+        sessions.setdefault(session, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled after the slot was handed over, pass it on
+            if not future.cancelled():
+                self.release()
+            raise
+
+    def _dispatch(self) -> None:
+        while self.active < self.max_concurrency:
+            future = self._next_waiter()
+            if future is None:
+                return
+            # Cancelled waiters stay queued until their turn
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self._waiters):
+            sessions = self._waiters[priority]
+            if not sessions:
+                continue
+            session, queue = next(iter(sessions.items()))
+            future = queue.popleft()
+            if queue:
+                sessions.move_to_end(session)
+            else:
+                del sessions[session]
+            return future
+        return None
+
+
+class ScheduledLLM(CustomLLM):
+    """
+    Runs the calls of an LLM through the scheduler of its provider and retries
+    calls the provider rejected for its rate limit.
+
+    Sync calls bypass the scheduler, the workflows only make async calls.
+    """
+
+    model: str = ""
+
+    _llm: LLM = PrivateAttr()
+    _scheduler: ProviderScheduler = PrivateAttr()
+
+    def __init__(self, llm: LLM, scheduler: ProviderScheduler, **kwargs: Any):
+        super().__init__(model=getattr(llm, "model", ""), **kwargs)
+        self._llm = llm
+        self._scheduler = scheduler
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return self._llm.complete(prompt, formatted=formatted, **kwargs)
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return self._llm.stream_complete(prompt, formatted=formatted, **kwargs)
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        return await self._call(
+            prompt, lambda: self._llm.acomplete(prompt, formatted=formatted, **kwargs)
+        )
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await self._call(
+            _messages_text(messages), lambda: self._llm.achat(messages, **kwargs)
+        )
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        # The slot is only held until the first chunk arrives, the rest of the
+        # stream moves at the pace of its consumer and mustn't hold up others
+        tokens = _estimate_tokens(_messages_text(messages))
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            async with self._scheduler.slot(tokens):
+                try:
+                    stream = await self._llm.astream_chat(messages, **kwargs)
+                    # Providers report errors like rate limits with the first chunk
+                    first = await anext(stream, None)
+                    break
+                except Exception as ex:
+                    if not self._retry(ex, attempt):
+                        raise
+
+        async def gen() -> ChatResponseAsyncGen:
+            if first is None:
+                return
+            yield first
+            async for response in stream:
+                yield response
+
+        return gen()
+
+    async def astructured_predict(
+        self,
+        output_cls: Type[BaseModel],
+        prompt,
+        llm_kwargs: Optional[Dict[str, Any]] = None,
+        **prompt_args: Any,
+    ) -> BaseModel:
+        return await self._call(
+            prompt.format(**prompt_args),
+            lambda: self._llm.astructured_predict(
+                output_cls, prompt, llm_kwargs=llm_kwargs, **prompt_args
+            ),
+        )
+
+    async def _call(self, prompt: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        tokens = _estimate_tokens(prompt)
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            async with self._scheduler.slot(tokens):
+                try:
+                    return await call()
+                except Exception as ex:
+                    if not self._retry(ex, attempt):
+                        raise
+
+    def _retry(self, ex: Exception, attempt: int) -> bool:
+        delay = retry_after(ex)
+        if delay is None or attempt == MAX_RATE_LIMIT_RETRIES:
+            return False
+        self._scheduler.rate_limited(delay * 2**attempt)
+        return True
+
+
+def _messages_text(messages: Sequence[ChatMessage]) -> str:
+    return "\n".join(str(message.content or "") for message in messages)
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(get_tokenizer()(text))
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_LLM_MAX_CONCURRENCY,
+        requests_per_minute: Optional[Dict[str, float]] = None,
+        tokens_per_minute: Optional[Dict[str, float]] = None,
+    ):
+        """
+        One ProviderScheduler per provider, shared by all LLMs of that provider.
+
+        :param max_concurrency: Calls in flight per provider
+        :param requests_per_minute: Request budget by provider, e.g. {"OpenAI": 500}
+        :param tokens_per_minute: Prompt token budget by provider
+        """
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute or {}
+        self.tokens_per_minute = tokens_per_minute or {}
+        self.providers: Dict[str, ProviderScheduler] = {}
+
+    def provider(self, name: str) -> ProviderScheduler:
+        if name not in self.providers:
+            self.providers[name] = ProviderScheduler(
+                name,
+                max_concurrency=self.max_concurrency,
+                requests_per_minute=self.requests_per_minute.get(name),
+                tokens_per_minute=self.tokens_per_minute.get(name),
+            )
+        return self.providers[name]
+
+    def wrap(self, llm: LLM) -> ScheduledLLM:
+        return ScheduledLLM(llm, self.provider(provider_of(llm)))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"active": scheduler.active, "queued": scheduler.queued}
+            for name, scheduler in self.providers.items()
+        }
@@ -1,20 +1,50 @@
+import asyncio
+import hashlib
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
+DEFAULT_TOP_K = 3
+
 
 class LocalFewshotManager:
-    def __init__(self, parquet_file: Optional[str] = "fewshot_examples.parquet"):
+    def __init__(
+        self,
+        parquet_file: Optional[str] = "fewshot_examples.parquet",
+        top_k: int = DEFAULT_TOP_K,
+    ):
         """
         Initialize the LocalFewshotManager class by loading the parquet file.
 
         :param parquet_file: Path to the parquet file (relative to this module)
+        :param top_k: Number of examples to retrieve per question
         """
         # Resolve the parquet file relative to this file's directory
         module_dir = Path(__file__).parent
         self.parquet_file_path = module_dir / parquet_file
+        self.embeddings_file_path = self.parquet_file_path.with_suffix(".embeddings.npz")
         self.data_dict = self._load_parquet_to_dict(self.parquet_file_path)
+        self.top_k = top_k
+
+        # All examples are embedded into one matrix of normalized rows,
+        # each database owns a contiguous slice of it
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        start = 0
+        for database, examples in self.data_dict.items():
+            self._offsets[database] = (start, start + len(examples))
+            start += len(examples)
+        self._texts = [
+            self._example_text(example)
+            for examples in self.data_dict.values()
+            for example in examples
+        ]
+        self._fingerprint = hashlib.sha256("\n".join(self._texts).encode()).hexdigest()
+        self._matrix: Optional[np.ndarray] = None
+        self._embed_model_name: Optional[str] = None
+        self._index_lock = asyncio.Lock()
+        self._load_embeddings()
 
     def _load_parquet_to_dict(self, parquet_file: Path) -> Dict[str, List[str]]:
         """
@@ -40,5 +70,130 @@ class LocalFewshotManager:
 
         return self.data_dict.get(database, [])
 
+    def retrieve_fewshots(self, question: str, database: str, embed_model) -> List[dict]:
+        """
+        Get the few-shot examples most similar to the question.
+
+        Falls back to all examples of the database without an embedding
+        model, or when the database has no more than top_k examples.
+        """
+        return self.retrieve_fewshots_batch([question], database, embed_model)[0]
+
+    def retrieve_fewshots_batch(
+        self, questions: List[str], database: str, embed_model
+    ) -> List[List[dict]]:
+        if embed_model is None or not self._needs_ranking(database):
+            return [self._fallback(database) for _ in questions]
+
+        self.build_index(embed_model)
+        query_embeddings = embed_model.get_text_embedding_batch(questions)
+        return self._top_k(query_embeddings, database)
+
+    async def aretrieve_fewshots(
+        self, question: str, database: str, embed_model
+    ) -> List[dict]:
+        if embed_model is None or not self._needs_ranking(database):
+            return self._fallback(database)
+
+        await self.abuild_index(embed_model)
+        query_embedding = await embed_model.aget_text_embedding(question)
+        return self._top_k([query_embedding], database)[0]
+
+    def build_index(self, embed_model) -> None:
+        """
+        Embed all examples, unless the stored embeddings are of the same model.
+        """
+        if not self._index_matches(embed_model):
+            self._build_index(
+                embed_model, embed_model.get_text_embedding_batch(self._texts)
+            )
+
+    async def abuild_index(self, embed_model) -> None:
+        async with self._index_lock:
+            if not self._index_matches(embed_model):
+                self._build_index(
+                    embed_model,
+                    await embed_model.aget_text_embedding_batch(self._texts),
+                )
+
     def store_fewshot_example(self, question, database, cypher, llm, embed_model, success = True):
         pass
+
+    def _needs_ranking(self, database: str) -> bool:
+        # All examples are returned anyway, embedding the question would gain nothing
+        start, end = self._offsets.get(database, (0, 0))
+        return end - start > self.top_k
+
+    def _fallback(self, database: str) -> List[dict]:
+        return list(self.get_fewshot_examples(None, database))
+
+    def _example_text(self, example: dict) -> str:
+        # Questions in the parquet file are wrapped in quotes
+        return example["question"].strip().strip('"').strip()
+
+    def _index_matches(self, embed_model) -> bool:
+        return (
+            self._matrix is not None
+            and self._embed_model_name == embed_model.model_name
+        )
+
+    def _build_index(self, embed_model, embeddings: List[List[float]]) -> None:
+        # Only kept in memory, requests never write into the package directory
+        self._matrix = self._normalize(embeddings)
+        self._embed_model_name = embed_model.model_name
+
+    def save_embeddings(self) -> None:
+        """
+        Store the embeddings next to the parquet file, so the server doesn't
+        embed the corpus after a restart.
+        """
+        np.savez(
+            self.embeddings_file_path,
+            embeddings=self._matrix,
+            model_name=np.array(self._embed_model_name),
+            fingerprint=np.array(self._fingerprint),
+        )
+
+    def _load_embeddings(self) -> None:
+        if not self.embeddings_file_path.exists():
+            return
+        stored = np.load(self.embeddings_file_path)
+        # Ignore embeddings of an outdated parquet file
+        if str(stored["fingerprint"]) != self._fingerprint:
+            return
+        self._matrix = stored["embeddings"]
+        self._embed_model_name = str(stored["model_name"])
+
+    def _normalize(self, embeddings: List[List[float]]) -> np.ndarray:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def _top_k(
+        self, query_embeddings: List[List[float]], database: str
+    ) -> List[List[dict]]:
+        start, end = self._offsets[database]
+        examples = self.data_dict[database]
+        k = min(self.top_k, end - start)
+
+        # One matrix product scores every question against every example
+        scores = self._normalize(query_embeddings) @ self._matrix[start:end].T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row_scores, row_top in zip(scores, top):
+            ranked = row_top[np.argsort(-row_scores[row_top])]
+            results.append([examples[i] for i in ranked])
+        return results
+
+
+if __name__ == "__main__":
+    # Precompute the embeddings file, e.g. before building the container image
+    from dotenv import load_dotenv
+    from llama_index.embeddings.openai import OpenAIEmbedding
+
+    load_dotenv()
+    manager = LocalFewshotManager()
+    embed_model = OpenAIEmbedding(model="text-embedding-3-small")
+    manager.build_index(embed_model)
+    manager.save_embeddings()
+    print(f"Stored {len(manager._texts)} embeddings in {manager.embeddings_file_path}")
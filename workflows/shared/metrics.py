@@ -0,0 +1,479 @@
+import functools
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.exception import ExceptionEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatEndEvent,
+    LLMChatStartEvent,
+    LLMCompletionEndEvent,
+    LLMCompletionStartEvent,
+)
+from llama_index.core.instrumentation.events.span import SpanDropEvent
+from llama_index.core.utils import get_tokenizer
+
+from workflows.shared.sse_event import StepMetricsEvent
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return "\n".join(lines)
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: count per bucket, +Inf count and sum
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        counts = self._values.setdefault(labels, [0] * len(self.buckets) + [0, 0.0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-2] += 1
+        counts[-1] += value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, counts in self._values.items():
+            for bound, count in zip(self.buckets, counts):
+                le = _labels(self.labelnames + ("le",), labels + (str(bound),))
+                lines.append(f"{self.name}_bucket{le} {count}")
+            le = _labels(self.labelnames + ("le",), labels + ("+Inf",))
+            lines.append(f"{self.name}_bucket{le} {counts[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {counts[-2]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {counts[-1]}")
+        return "\n".join(lines)
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in values
+    )
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+STEP_LABELS = ("workflow", "step")
+STEP_DURATION = Histogram(
+    "workflow_step_duration_seconds", "Duration of workflow steps.", STEP_LABELS
+)
+STEP_ERRORS = Counter(
+    "workflow_step_errors_total", "Workflow steps that raised an exception.", STEP_LABELS
+)
+LLM_DURATION = Histogram(
+    "workflow_llm_duration_seconds", "Duration of LLM calls by step.", STEP_LABELS
+)
+LLM_TOKENS = Counter(
+    "workflow_llm_tokens_total",
+    "LLM tokens by step and direction (in/out).",
+    STEP_LABELS + ("direction",),
+)
+CYPHER_DURATION = Histogram(
+    "workflow_cypher_duration_seconds",
+    "Duration of Cypher statements by step.",
+    STEP_LABELS,
+)
+CYPHER_ROWS = Counter(
+    "workflow_cypher_rows_total", "Rows returned by Cypher statements.", STEP_LABELS
+)
+LLM_PREFIX_TOKENS = Counter(
+    "workflow_llm_prefix_tokens_total",
+    "Prompt tokens in the stable, cacheable prompt prefix by step.",
+    STEP_LABELS,
+)
+LLM_CACHED_TOKENS = Counter(
+    "workflow_llm_cached_tokens_total",
+    "Prompt tokens the provider read from its prompt cache by step.",
+    STEP_LABELS,
+)
+LLM_QUEUE_DURATION = Histogram(
+    "workflow_llm_queue_seconds",
+    "Time LLM calls waited for a provider slot and rate budget.",
+    ("provider", "priority"),
+)
+LLM_RATE_LIMITED = Counter(
+    "workflow_llm_rate_limited_total",
+    "LLM calls the provider rejected for its rate limit.",
+    ("provider",),
+)
+LLM_ROUTED = Counter(
+    "workflow_llm_routed_total",
+    "Calls of the auto LLM by the LLM they were routed to and route.",
+    ("llm", "route"),
+)
+LLM_HEDGES = Counter(
+    "workflow_llm_hedges_total",
+    "Backup calls of the auto LLM by the LLM that answered first.",
+    ("primary", "winner"),
+)
+RETRIES = Counter(
+    "workflow_retries_total", "Cypher correction retries by step.", STEP_LABELS
+)
+REGISTRY = [
+    STEP_DURATION,
+    STEP_ERRORS,
+    LLM_DURATION,
+    LLM_TOKENS,
+    LLM_PREFIX_TOKENS,
+    LLM_CACHED_TOKENS,
+    LLM_QUEUE_DURATION,
+    LLM_RATE_LIMITED,
+    LLM_ROUTED,
+    LLM_HEDGES,
+    CYPHER_DURATION,
+    CYPHER_ROWS,
+    RETRIES,
+]
+
+
+def render_metrics() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class StepMetrics:
+    def __init__(self, workflow: str, step: str):
+        self.labels = (workflow, step)
+        self.duration = 0.0
+        self.llm_calls = 0
+        self.llm_duration = 0.0
+        self.llm_queue_duration = 0.0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.prefix_tokens = 0
+        self.cached_tokens = 0
+        self.cypher_queries = 0
+        self.cypher_duration = 0.0
+        self.cypher_rows = 0
+        self.retries = 0
+        # LLM calls in flight by span id, concurrent calls each have their own
+        self._llm_calls: Dict[str, "_LLMCall"] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "workflow": self.labels[0],
+            "step": self.labels[1],
+            "duration": round(self.duration, 4),
+            "llm_calls": self.llm_calls,
+            "llm_duration": round(self.llm_duration, 4),
+            "llm_queue_duration": round(self.llm_queue_duration, 4),
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "prefix_tokens": self.prefix_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cypher_queries": self.cypher_queries,
+            "cypher_duration": round(self.cypher_duration, 4),
+            "cypher_rows": self.cypher_rows,
+            "retries": self.retries,
+        }
+
+    def summary(self) -> str:
+        parts = []
+        if self.llm_calls:
+            parts.append(
+                f"LLM {self.llm_duration:.2f} s, {self.tokens_in} → {self.tokens_out} tokens"
+                + (f" ({self.cached_tokens} cached)" if self.cached_tokens else "")
+            )
+        if self.cypher_queries:
+            parts.append(f"Cypher {self.cypher_duration:.2f} s, {self.cypher_rows} rows")
+        if self.retries:
+            parts.append(f"{self.retries} retries")
+        details = f" ({'; '.join(parts)})" if parts else ""
+        return f"{self.labels[1]}: {self.duration:.2f} s{details}"
+
+
+class _LLMCall:
+    def __init__(self, prompt: str, outer: Optional[str], token=None):
+        """
+        :param outer: Span of the call this one is nested in, e.g. the chat
+            call of a structured output, None for an outermost call
+        :param token: Resets _llm_span when an outermost call ends
+        """
+        self.start = time.perf_counter()
+        self.prompt = prompt
+        self.outer = outer
+        self.token = token
+        self.tokens_reported = False
+
+
+_current_step: ContextVar[Optional[StepMetrics]] = ContextVar(
+    "current_step_metrics", default=None
+)
+# Span of the outermost LLM call in progress in this context
+_llm_span: ContextVar[Optional[str]] = ContextVar("llm_span", default=None)
+
+
+def record_cypher(duration: float, rows: int) -> None:
+    metrics = _current_step.get()
+    labels = metrics.labels if metrics else ("", "")
+    CYPHER_DURATION.observe(labels, duration)
+    CYPHER_ROWS.inc(labels, rows)
+    if metrics:
+        metrics.cypher_queries += 1
+        metrics.cypher_duration += duration
+        metrics.cypher_rows += rows
+
+
+def record_retry() -> None:
+    metrics = _current_step.get()
+    if metrics:
+        RETRIES.inc(metrics.labels)
+        metrics.retries += 1
+
+
+def record_prefix_tokens(tokens: int) -> None:
+    metrics = _current_step.get()
+    if metrics:
+        LLM_PREFIX_TOKENS.inc(metrics.labels, tokens)
+        metrics.prefix_tokens += tokens
+
+
+def current_step() -> Optional[str]:
+    metrics = _current_step.get()
+    return metrics.labels[1] if metrics else None
+
+
+def record_routed(llm: str, route: str) -> None:
+    LLM_ROUTED.inc((llm, route))
+
+
+def record_hedge(primary: str, winner: str) -> None:
+    LLM_HEDGES.inc((primary, winner))
+
+
+def record_llm_queue(provider: str, priority: str, duration: float) -> None:
+    LLM_QUEUE_DURATION.observe((provider, priority), duration)
+    metrics = _current_step.get()
+    if metrics:
+        metrics.llm_queue_duration += duration
+
+
+def record_rate_limited(provider: str) -> None:
+    LLM_RATE_LIMITED.inc((provider,))
+
+
+def _usage(response):
+    raw = getattr(response, "raw", None)
+    if isinstance(raw, dict):
+        return raw.get("usage") or raw.get("usage_metadata")
+    return getattr(raw, "usage", None) or getattr(raw, "usage_metadata", None)
+
+
+def _read(usage, *names) -> Optional[Any]:
+    for name in names:
+        value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+        if value is not None:
+            return value
+    return None
+
+
+def _reported_tokens(response) -> Optional[Tuple[int, int]]:
+    # OpenAI style clients put the usage into additional_kwargs
+    kwargs = getattr(response, "additional_kwargs", None) or {}
+    if "prompt_tokens" in kwargs:
+        return kwargs["prompt_tokens"], kwargs.get("completion_tokens", 0)
+
+    usage = _usage(response)
+    if not usage:
+        return None
+
+    tokens_in = _read(usage, "prompt_tokens", "input_tokens", "prompt_token_count")
+    tokens_out = _read(
+        usage, "completion_tokens", "output_tokens", "candidates_token_count"
+    )
+    if tokens_in is None and tokens_out is None:
+        return None
+    # Anthropic doesn't count cache reads and writes as input tokens
+    tokens_in = (
+        (tokens_in or 0)
+        + (_read(usage, "cache_read_input_tokens") or 0)
+        + (_read(usage, "cache_creation_input_tokens") or 0)
+    )
+    return tokens_in, tokens_out or 0
+
+
+def _cached_tokens(response) -> int:
+    usage = _usage(response)
+    if not usage:
+        return 0
+    # OpenAI reports cache hits per request, Anthropic and Gemini per usage
+    details = _read(usage, "prompt_tokens_details")
+    if details:
+        return _read(details, "cached_tokens") or 0
+    return _read(usage, "cache_read_input_tokens", "cached_content_token_count") or 0
+
+
+def _response_text(response) -> str:
+    if response is None:
+        return ""
+    if hasattr(response, "message"):
+        return str(response.message.content or "")
+    return response.text or ""
+
+
+class LLMMetricsHandler(BaseEventHandler):
+    """
+    Attributes LLM call time and tokens to the workflow step that made the call.
+    """
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LLMMetricsHandler"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> None:
+        metrics = _current_step.get()
+        if metrics is None:
+            return
+
+        if isinstance(event, (LLMChatStartEvent, LLMCompletionStartEvent)):
+            self._start(metrics, event)
+        elif isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+            self._end(metrics, event.span_id, event.response)
+        elif isinstance(event, (SpanDropEvent, ExceptionEvent)):
+            # Failed and cancelled calls emit no end event, only their span is dropped
+            self._end(metrics, event.span_id, None)
+
+    def _start(self, metrics: StepMetrics, event: BaseEvent) -> None:
+        # Nested LLM calls (structured outputs) are counted once, at the outermost
+        outer = _llm_span.get()
+        if outer not in metrics._llm_calls:
+            outer = None
+        prompt = (
+            event.prompt
+            if isinstance(event, LLMCompletionStartEvent)
+            else "\n".join(str(message.content) for message in event.messages)
+        )
+        token = _llm_span.set(event.span_id) if outer is None else None
+        metrics._llm_calls[event.span_id] = _LLMCall(prompt, outer, token)
+
+    def _end(self, metrics: StepMetrics, span_id: Optional[str], response) -> None:
+        call = metrics._llm_calls.pop(span_id, None)
+        if call is None:
+            return
+        if call.token is not None:
+            try:
+                _llm_span.reset(call.token)
+            except ValueError:
+                # Ended in another task, e.g. a stream consumed elsewhere
+                pass
+
+        if response is not None:
+            tokens = _reported_tokens(response)
+            if tokens:
+                self._add_tokens(metrics, *tokens)
+                outermost = call
+                while outermost.outer in metrics._llm_calls:
+                    outermost = metrics._llm_calls[outermost.outer]
+                outermost.tokens_reported = True
+            cached = _cached_tokens(response)
+            if cached:
+                metrics.cached_tokens += cached
+                LLM_CACHED_TOKENS.inc(metrics.labels, cached)
+
+        if call.outer is not None:
+            return
+        duration = time.perf_counter() - call.start
+        metrics.llm_calls += 1
+        metrics.llm_duration += duration
+        LLM_DURATION.observe(metrics.labels, duration)
+        if response is not None and not call.tokens_reported:
+            # Streaming responses usually carry no usage, estimate instead
+            tokenizer = get_tokenizer()
+            self._add_tokens(
+                metrics,
+                len(tokenizer(call.prompt)),
+                len(tokenizer(_response_text(response))),
+            )
+
+    def _add_tokens(self, metrics: StepMetrics, tokens_in: int, tokens_out: int) -> None:
+        metrics.tokens_in += tokens_in
+        metrics.tokens_out += tokens_out
+        LLM_TOKENS.inc(metrics.labels + ("in",), tokens_in)
+        LLM_TOKENS.inc(metrics.labels + ("out",), tokens_out)
+
+
+get_dispatcher().add_event_handler(LLMMetricsHandler())
+
+
+@asynccontextmanager
+async def measure_step(ctx, workflow: str, step: str):
+    """
+    Time a block of work like instrument_step times a step, including the LLM
+    calls and Cypher statements it makes, for work that runs inside a step,
+    e.g. concurrent subqueries.
+    """
+    metrics = StepMetrics(workflow, step)
+    token = _current_step.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    except Exception:
+        STEP_ERRORS.inc(metrics.labels)
+        raise
+    finally:
+        _current_step.reset(token)
+        metrics.duration = time.perf_counter() - start
+        STEP_DURATION.observe(metrics.labels, metrics.duration)
+        ctx.write_event_to_stream(
+            StepMetricsEvent(
+                label="Step metrics",
+                message=metrics.summary(),
+                metrics=metrics.to_dict(),
+            )
+        )
+
+
+def instrument_step(func):
+    """
+    Time a workflow step, including the LLM calls and Cypher statements it makes,
+    and write the timings to the event stream and the metrics registry.
+
+    Goes between @step and the step method.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(self, ctx, ev, *args, **kwargs):
+        async with measure_step(ctx, type(self).__name__, func.__name__):
+            return await func(self, ctx, ev, *args, **kwargs)
+
+    return wrapper
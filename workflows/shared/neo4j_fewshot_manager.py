@@ -1,64 +1,327 @@
+import asyncio
 import os
+import time
+from collections import OrderedDict
 
-from llama_index.graph_stores.neo4j import Neo4jPropertyGraphStore
+import neo4j
+
+from workflows.shared.cypher_executor import CypherExecutor
+from workflows.shared.driver_pool import DriverPool
+
+FEWSHOT_LIMIT = 7
+FEWSHOT_VECTOR_INDEX = "fewshot_embedding"
+# The vector index can't filter by database, so fetch more candidates than needed
+FEWSHOT_INDEX_OVERSAMPLE = 10
+# Seconds a database's example count is trusted, other replicas add examples too
+FEWSHOT_COUNT_TTL = 300
+
+DEFAULT_WRITE_INTERVAL = 5
+DEFAULT_WRITE_BATCH_SIZE = 100
+# Written examples remembered for deduplication, older ones are checked in the database
+STORED_KEYS_LIMIT = 10000
+
+RETRIEVE_FEWSHOTS_QUERY = """MATCH (f:Fewshot)
+WHERE f.database = $database
+WITH f, vector.similarity.cosine(f.embedding, $embedding) AS score
+ORDER BY score DESC LIMIT $limit
+RETURN f.question AS question, f.cypher AS cypher"""
+
+FEWSHOT_COUNT_QUERY = """MATCH (f:Fewshot)
+WHERE f.database = $database
+RETURN count(f) AS count"""
+
+RETRIEVE_FEWSHOTS_INDEX_QUERY = """CALL db.index.vector.queryNodes($index, $candidates, $embedding)
+YIELD node AS f, score
+WHERE f.database = $database
+WITH f, score
+ORDER BY score DESC LIMIT $limit
+RETURN f.question AS question, f.cypher AS cypher"""
 
 
 class Neo4jFewshotManager:
     graph_store = None
+    executor = None
+    write_interval = DEFAULT_WRITE_INTERVAL
+    write_batch_size = DEFAULT_WRITE_BATCH_SIZE
+    # None until checked, then whether the vector index can be used
+    vector_index = None
 
-    def __init__(self):
+    def __init__(self, driver_pool: DriverPool | None = None):
+        """
+        :param driver_pool: Pool to take the fewshot database driver from, shared
+            with the graph stores when FEWSHOT_NEO4J_URI is the same as theirs
+        """
         if os.getenv("FEWSHOT_NEO4J_USERNAME"):
-            self.graph_store = Neo4jPropertyGraphStore(
+            self.graph_store = (driver_pool or DriverPool()).graph_store(
+                uri=os.getenv("FEWSHOT_NEO4J_URI"),
                 username=os.getenv("FEWSHOT_NEO4J_USERNAME"),
                 password=os.getenv("FEWSHOT_NEO4J_PASSWORD"),
-                url=os.getenv("FEWSHOT_NEO4J_URI"),
                 refresh_schema=False,
-                create_indexes=False,
                 timeout=30,
             )
+            self.executor = CypherExecutor(self.graph_store)
+            self.write_interval = float(
+                os.getenv("FEWSHOT_WRITE_INTERVAL", DEFAULT_WRITE_INTERVAL)
+            )
+            self.write_batch_size = int(
+                os.getenv("FEWSHOT_WRITE_BATCH_SIZE", DEFAULT_WRITE_BATCH_SIZE)
+            )
+
+        # Learned examples waiting to be written, keyed by (label, id)
+        self._pending = {}
+        # LRU of the keys already written
+        self._stored = OrderedDict()
+        self._embed_model = None
+        self._flush_task = None
+        # Examples per database with the time they were counted
+        self._example_counts = {}
+
+    def ensure_vector_index(self, dimensions: int) -> bool:
+        """
+        Create the fewshot vector index if it doesn't exist yet.
+
+        Returns False when the index can't be created, e.g. without admin access,
+        in which case lookups fall back to a full scan of the database's examples.
+        """
+        try:
+            # Makes the fallback scan proportional to the examples of one database
+            self.graph_store.structured_query(
+                "CREATE INDEX fewshot_database IF NOT EXISTS FOR (f:Fewshot) ON (f.database)"
+            )
+            self.graph_store.structured_query(
+                f"""CREATE VECTOR INDEX {FEWSHOT_VECTOR_INDEX} IF NOT EXISTS
+FOR (f:Fewshot) ON f.embedding
+OPTIONS {{indexConfig: {{`vector.dimensions`: {int(dimensions)}, `vector.similarity_function`: 'cosine'}}}}"""
+            )
+            self.vector_index = True
+        except neo4j.exceptions.Neo4jError as ex:
+            print(f"Fewshot vector index unavailable, using full scan: {ex}")
+            self.vector_index = False
+        return self.vector_index
 
     def retrieve_fewshots(self, question, database, embed_model):
         if not self.graph_store:
             return
 
         embedding = embed_model.get_text_embedding(question)
-        examples = self.graph_store.structured_query(
-            """MATCH (f:Fewshot)
-WHERE f.database = $database
-WITH f, vector.similarity.cosine(f.embedding, $embedding) AS score
-ORDER BY score DESC LIMIT 7
-RETURN f.question AS question, f.cypher AS cypher""",
-            param_map={"embedding": embedding, "database": database},
+        if self.vector_index is None:
+            self.ensure_vector_index(len(embedding))
+
+        param_map = self._retrieve_params(embedding, database)
+        if self.vector_index:
+            try:
+                examples = self.graph_store.structured_query(
+                    RETRIEVE_FEWSHOTS_INDEX_QUERY, param_map=param_map
+                )
+                count = None
+                if len(examples) < FEWSHOT_LIMIT:
+                    count = self._cached_count(database)
+                    if count is None:
+                        count = self._remember_count(
+                            database,
+                            self.graph_store.structured_query(
+                                FEWSHOT_COUNT_QUERY, param_map={"database": database}
+                            ),
+                        )
+                if self._found_all(examples, count):
+                    return examples
+            except neo4j.exceptions.Neo4jError:  # e.g. index still populating
+                pass
+
+        return self.graph_store.structured_query(
+            RETRIEVE_FEWSHOTS_QUERY, param_map=param_map
         )
-        return examples
+
+    async def aretrieve_fewshots(self, question, database, embed_model):
+        if not self.graph_store:
+            return
+
+        # Concurrent requests are batched and cached by the shared embed model
+        embedding = await embed_model.aget_text_embedding(question)
+        if self.vector_index is None:
+            await asyncio.to_thread(self.ensure_vector_index, len(embedding))
+
+        param_map = self._retrieve_params(embedding, database)
+        if self.vector_index:
+            try:
+                examples = await self.executor.run(
+                    RETRIEVE_FEWSHOTS_INDEX_QUERY, param_map=param_map
+                )
+                count = None
+                if len(examples) < FEWSHOT_LIMIT:
+                    count = self._cached_count(database)
+                    if count is None:
+                        count = self._remember_count(
+                            database,
+                            await self.executor.run(
+                                FEWSHOT_COUNT_QUERY, param_map={"database": database}
+                            ),
+                        )
+                if self._found_all(examples, count):
+                    return examples
+            except neo4j.exceptions.Neo4jError:  # e.g. index still populating
+                pass
+
+        return await self.executor.run(RETRIEVE_FEWSHOTS_QUERY, param_map=param_map)
+
+    def _found_all(self, examples, count) -> bool:
+        # Fewer matches than the database has examples means the candidates
+        # missed some of them, the count is only needed below the limit
+        return len(examples) >= FEWSHOT_LIMIT or len(examples) >= count
+
+    def _cached_count(self, database):
+        count, counted = self._example_counts.get(database, (None, 0))
+        if time.monotonic() - counted > FEWSHOT_COUNT_TTL:
+            return None
+        return count
+
+    def _remember_count(self, database, records) -> int:
+        count = records[0]["count"]
+        self._example_counts[database] = (count, time.monotonic())
+        return count
+
+    def _retrieve_params(self, embedding, database) -> dict:
+        return {
+            "embedding": embedding,
+            "database": database,
+            "index": FEWSHOT_VECTOR_INDEX,
+            "limit": FEWSHOT_LIMIT,
+            "candidates": FEWSHOT_LIMIT * FEWSHOT_INDEX_OVERSAMPLE,
+        }
 
     def store_fewshot_example(self, question, database, cypher, llm, embed_model, success = True):
+        """
+        Queue a learned example, it is written in the background with the next batch.
+
+        Without a running event loop the pending examples are written right away.
+        """
         if not self.graph_store:
             return
         label = "Fewshot" if success else "Missing"
-        # Check if already exists
-        already_exists = self.graph_store.structured_query(
-            f"MATCH (f:`{label}` {{id: $question + $llm + $database}}) RETURN True",
-            param_map={"question": question, "llm": llm, "database":database},
-        )
-        if already_exists:
+        id = question + llm + database
+        # Dedupe in memory, examples are only ever stored once
+        if (label, id) in self._stored:
+            self._stored.move_to_end((label, id))
+            return
+        if (label, id) in self._pending:
             return
 
-        # Calculate embedding
-        embedding = embed_model.get_text_embedding(question)
+        self._pending[(label, id)] = {
+            "id": id,
+            "question": question,
+            "cypher": cypher,
+            "database": database,
+            "llm": llm,
+        }
+        self._embed_model = embed_model
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            batch = self._take_pending()
+            try:
+                self._write_pending(batch)
+            except Exception:
+                self._requeue(batch)
+                raise
+            self._mark_stored(batch)
+            return
+        if len(self._pending) >= self.write_batch_size:
+            self._flush_task = loop.create_task(self._flush_later(0))
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later(self.write_interval))
+
+    async def flush(self):
+        """
+        Write all queued examples, e.g. on shutdown.
 
-        # Store response
-        self.graph_store.structured_query(
-            f"""MERGE (f:`{label}` {{id: $question + $llm + $database}})
-SET f.cypher = $cypher, f.llm = $llm, f.created = datetime(), f.question = $question, f.database = $database
-WITH f
-CALL db.create.setNodeVectorProperty(f,'embedding', $embedding)""",
-            param_map={
-                "question": question,
-                "cypher": cypher,
-                "embedding": embedding,
-                "database": database,
-                "llm": llm,
-            },
+        Examples that fail to be written are queued again.
+        """
+        task = self._flush_task
+        if task is not None and task is not asyncio.current_task() and not task.done():
+            # A write in progress queues its batch again when cancelled
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        batch = self._take_pending()
+        if not batch:
+            return
+        try:
+            remaining = await asyncio.to_thread(self._skip_existing, batch)
+            if remaining:
+                embeddings = await self._embed_model.aget_text_embedding_batch(
+                    [row["question"] for _, row in remaining]
+                )
+                for (_, row), embedding in zip(remaining, embeddings):
+                    row["embedding"] = embedding
+                await asyncio.to_thread(self._write_batch, remaining)
+        except asyncio.CancelledError:
+            self._requeue(batch)
+            raise
+        except Exception as ex:
+            print(f"Failed to store fewshot examples, retrying later: {ex}")
+            self._requeue(batch)
+            return
+        self._mark_stored(batch)
+
+    async def _flush_later(self, delay: float):
+        # Failed batches are queued again and retried after the write interval
+        while self._pending:
+            await asyncio.sleep(delay)
+            await self.flush()
+            delay = self.write_interval
+
+    def _take_pending(self):
+        batch = list(self._pending.items())
+        self._pending = {}
+        return batch
+
+    def _requeue(self, batch):
+        # Examples queued in the meantime are newer, they win
+        self._pending = {**dict(batch), **self._pending}
+
+    def _mark_stored(self, batch):
+        for key, row in batch:
+            if key[0] == "Fewshot":
+                # Counted again on the next lookup
+                self._example_counts.pop(row["database"], None)
+            self._stored[key] = None
+            self._stored.move_to_end(key)
+        while len(self._stored) > STORED_KEYS_LIMIT:
+            self._stored.popitem(last=False)
+
+    def _write_pending(self, batch):
+        batch = self._skip_existing(batch)
+        if not batch:
+            return
+        embeddings = self._embed_model.get_text_embedding_batch(
+            [row["question"] for _, row in batch]
         )
-        return
+        for (_, row), embedding in zip(batch, embeddings):
+            row["embedding"] = embedding
+        self._write_batch(batch)
+
+    def _skip_existing(self, batch):
+        # Avoid embedding examples another replica has already stored
+        existing = set()
+        for label in {label for (label, _), _ in batch}:
+            ids = self.graph_store.structured_query(
+                f"UNWIND $ids AS id MATCH (f:`{label}` {{id: id}}) RETURN collect(f.id) AS ids",
+                param_map={"ids": [id for (row_label, id), _ in batch if row_label == label]},
+            )[0]["ids"]
+            existing.update((label, id) for id in ids)
+        return [(key, row) for key, row in batch if key not in existing]
+
+    def _write_batch(self, batch):
+        for label in {label for (label, _), _ in batch}:
+            self.graph_store.structured_query(
+                f"""UNWIND $rows AS row
+MERGE (f:`{label}` {{id: row.id}})
+ON CREATE SET f.cypher = row.cypher, f.llm = row.llm, f.created = datetime(), f.question = row.question, f.database = row.database
+WITH f, row
+WHERE f.embedding IS NULL
+CALL db.create.setNodeVectorProperty(f, 'embedding', row.embedding)""",
+                param_map={
+                    "rows": [row for (row_label, _), row in batch if row_label == label]
+                },
+            )
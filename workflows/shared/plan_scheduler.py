@@ -0,0 +1,114 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_MAX_CONCURRENT_SUBQUERIES = 8
+
+
+class PlanDAG:
+    def __init__(self, dependencies: Dict[str, List[str]]):
+        """
+        The subqueries of a query plan and the subqueries each one waits for.
+
+        :param dependencies: Subqueries of each subquery, in plan order
+        """
+        self.dependencies = dependencies
+        self.results: Dict[str, Any] = {}
+        self._started = set()
+
+    @classmethod
+    def from_plan(cls, plan: Sequence[Tuple[str, Sequence[int]]]) -> "PlanDAG":
+        """
+        Build the DAG of a plan as returned by the planner, a list of subqueries
+        each with the positions of the earlier subqueries whose results it needs.
+        """
+        subqueries = [subquery for subquery, _ in plan]
+        dependencies: Dict[str, List[str]] = {}
+        for position, (subquery, depends_on) in enumerate(plan):
+            # The same subquery twice would only run twice
+            if subquery in dependencies:
+                continue
+            # Only earlier subqueries count, so a confused plan can't form a cycle
+            dependencies[subquery] = list(
+                dict.fromkeys(
+                    subqueries[dep]
+                    for dep in depends_on
+                    if 0 <= dep < position and subqueries[dep] != subquery
+                )
+            )
+        return cls(dependencies)
+
+    def ready(self) -> List[str]:
+        """
+        Return the subqueries whose dependencies are done and mark them started.
+        """
+        ready = [
+            subquery
+            for subquery, deps in self.dependencies.items()
+            if subquery not in self._started
+            and all(dep in self.results for dep in deps)
+        ]
+        self._started.update(ready)
+        return ready
+
+    def complete(self, subquery: str, result: Any) -> None:
+        self.results[subquery] = result
+
+    def dependency_results(self, subquery: str) -> List[Any]:
+        return [self.results[dep] for dep in self.dependencies[subquery]]
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) == len(self.dependencies)
+
+
+class PlanScheduler:
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENT_SUBQUERIES):
+        """
+        Run the subqueries of query plans as soon as their dependencies are done.
+
+        One scheduler is shared by all workflow runs, so the concurrency limit
+        holds across requests rather than per workflow step.
+
+        :param max_concurrency: Subqueries in flight across all plans
+        """
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(
+        self,
+        dag: PlanDAG,
+        run_subquery: Callable[[str, List[Any]], Awaitable[Any]],
+    ) -> List[Any]:
+        """
+        Run every subquery of the DAG and return the results in completion order.
+
+        :param run_subquery: Called with a subquery and the results of its
+            dependencies, returns the subquery's result
+        """
+
+        async def run_one(subquery: str) -> tuple:
+            async with self._semaphore:
+                return subquery, await run_subquery(
+                    subquery, dag.dependency_results(subquery)
+                )
+
+        completed = []
+        pending = {asyncio.create_task(run_one(subquery)) for subquery in dag.ready()}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    subquery, result = task.result()
+                    dag.complete(subquery, result)
+                    completed.append(result)
+                pending |= {
+                    asyncio.create_task(run_one(subquery)) for subquery in dag.ready()
+                }
+        finally:
+            # A failed subquery fails the plan, don't leave the others running
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return completed
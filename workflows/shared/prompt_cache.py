@@ -0,0 +1,55 @@
+import functools
+from typing import List
+
+from llama_index.core.llms import LLM, ChatMessage, MessageRole
+from llama_index.core.utils import get_tokenizer
+
+from workflows.shared.llm_scheduler import unwrap_llm
+from workflows.shared.metrics import record_prefix_tokens
+
+# Anthropic only caches prompts up to an explicit breakpoint, OpenAI and Gemini
+# cache the longest previously seen prefix on their own
+CACHE_CONTROL = {"type": "ephemeral"}
+MARKER_PROVIDERS = ("Anthropic",)
+
+
+def supports_cache_markers(llm: LLM) -> bool:
+    return type(unwrap_llm(llm)).__name__ in MARKER_PROVIDERS
+
+
+@functools.lru_cache(maxsize=256)
+def prefix_token_count(text: str) -> int:
+    # The same schema and instructions are tokenized on every call otherwise
+    return len(get_tokenizer()(text))
+
+
+def cacheable_messages(
+    llm: LLM, system: str, prefix: str, suffix: str
+) -> List[ChatMessage]:
+    """
+    Build chat messages with the parts of a prompt that are the same on every
+    call (system prompt, instructions, schema) ahead of the parts that change.
+
+    The prefix is marked as a cache breakpoint for providers that need one.
+    Other providers get the prefix and suffix as a single user message, they
+    cache the prefix implicitly and would reject unknown message keys.
+
+    :param system: System prompt
+    :param prefix: Start of the user message that is the same on every call,
+        may be empty
+    :param suffix: Rest of the user message
+    """
+    record_prefix_tokens(prefix_token_count(system + prefix))
+    if prefix and supports_cache_markers(llm):
+        user_messages = [
+            ChatMessage(
+                role=MessageRole.USER,
+                content=prefix,
+                additional_kwargs={"cache_control": CACHE_CONTROL},
+            ),
+            # Consecutive user messages are sent as blocks of one message
+            ChatMessage(role=MessageRole.USER, content=suffix),
+        ]
+    else:
+        user_messages = [ChatMessage(role=MessageRole.USER, content=prefix + suffix)]
+    return [ChatMessage(role=MessageRole.SYSTEM, content=system), *user_messages]
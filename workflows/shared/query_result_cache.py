@@ -0,0 +1,113 @@
+import copy
+import json
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def normalize_cypher(cypher: str) -> str:
+    # Only whitespace and a trailing semicolon are safe to normalize,
+    # string literals and identifiers are case sensitive
+    return re.sub(r"\s+", " ", cypher).strip().rstrip(";").strip()
+
+
+# Procedures may write, or read more than the statement shows
+CALL_CLAUSE = re.compile(r"(?:^|(?<=[\s)\]}]))CALL(?=[\s({])", re.IGNORECASE)
+
+
+def is_cacheable(cypher: str) -> bool:
+    # EXPLAIN only validates the statement, its plan isn't worth a cache slot
+    if re.match(r"\s*(EXPLAIN|PROFILE)\b", cypher, re.IGNORECASE):
+        return False
+    # Imported here, the validator imports normalize_cypher from this module
+    from workflows.shared.cypher_validator import strip_literals, write_clauses
+
+    # A cached write would turn the repeated statement into a silent no-op
+    stripped, _ = strip_literals(cypher)
+    return not write_clauses(stripped) and not CALL_CLAUSE.search(stripped)
+
+
+class QueryResultCache:
+    def __init__(self, max_bytes: int = DEFAULT_RESULT_CACHE_MAX_BYTES):
+        """
+        Bounded LRU cache of Cypher query results for a single database.
+
+        :param max_bytes: Approximate upper bound on the size of all cached results
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[
+            Tuple[str, str, Optional[int]], Tuple[List[Any], int]
+        ] = OrderedDict()
+
+    def get(
+        self,
+        query: str,
+        param_map: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+    ) -> Optional[List[Any]]:
+        key = self._key(query, param_map, limit)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # Callers get their own records so they can't modify the cached ones
+        return copy.deepcopy(entry[0])
+
+    def put(
+        self,
+        query: str,
+        param_map: Optional[Dict[str, Any]],
+        records: List[Any],
+        limit: Optional[int] = None,
+    ) -> None:
+        size = len(str(records))
+        if size > self.max_bytes:
+            return
+
+        key = self._key(query, param_map, limit)
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        # The caller goes on to use the records it passed in
+        self._entries[key] = (copy.deepcopy(records), size)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def invalidate(self) -> None:
+        """
+        Drop all cached results, e.g. after the underlying data has changed.
+        """
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _key(
+        self,
+        query: str,
+        param_map: Optional[Dict[str, Any]],
+        limit: Optional[int],
+    ) -> Tuple[str, str, Optional[int]]:
+        # A limited result is not a valid answer for a different limit
+        return (
+            normalize_cypher(query),
+            json.dumps(param_map or {}, sort_keys=True, default=str),
+            limit,
+        )
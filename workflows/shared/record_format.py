@@ -0,0 +1,97 @@
+import json
+from typing import Any, Dict, List, Sequence
+
+from llama_index.core.utils import get_tokenizer
+
+# Tokens of database output per prompt, shared between subqueries in the iterative planner
+DEFAULT_TOKEN_BUDGET = 2000
+# Long strings (plots, descriptions, embeddings) are cut so a single row can't fill the budget
+MAX_CELL_CHARS = 300
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list, tuple)):
+        text = json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+    else:
+        text = str(value)
+    if len(text) > MAX_CELL_CHARS:
+        text = text[:MAX_CELL_CHARS] + "…"
+    return text
+
+
+def _line(values: Sequence[str]) -> str:
+    # Pipe separated instead of CSV quoting, which doubles every quote in JSON values
+    return " | ".join(
+        value.replace("|", "\\|").replace("\n", " ") for value in values
+    )
+
+
+def _summarize_omitted(columns: List[str], rows: List[Dict[str, Any]]) -> str:
+    details = []
+    for column in columns:
+        values = [row.get(column) for row in rows if row.get(column) is not None]
+        numbers = [
+            v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)
+        ]
+        if values and len(numbers) == len(values):
+            details.append(f"{column} from {min(numbers)} to {max(numbers)}")
+        elif values:
+            distinct = len({_cell(v) for v in values})
+            details.append(f"{distinct} distinct {column} values")
+    summary = f"{len(rows)} more rows omitted"
+    return f"({summary}: {', '.join(details)})" if details else f"({summary})"
+
+
+def format_records(
+    records: Sequence[Any],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    truncated: bool = False,
+) -> str:
+    """
+    Serialize query results for a prompt as rows of pipe-separated values under a single header row.
+
+    Rows are added until the token budget is used up, the omitted rows are
+    summarized by count and per-column value ranges instead.
+
+    :param records: Records as returned by CypherExecutor.run, or an exception
+        in a one-element list when the query failed
+    :param token_budget: Maximum tokens of rows, the header is always included
+    :param truncated: Whether the database returned more records than were fetched
+    """
+    if len(records) == 1 and isinstance(records[0], Exception):
+        return f"Error: {records[0]}"
+    if not records:
+        return "No records returned."
+
+    rows = [
+        record if isinstance(record, dict) else {"value": record} for record in records
+    ]
+    # Union of keys in first-seen order, rows of a query usually share all of them
+    columns: Dict[str, None] = {}
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+    columns = list(columns)
+
+    tokenizer = get_tokenizer()
+    lines = [_line(columns)]
+    used = 0
+    included = 0
+    for row in rows:
+        line = _line([_cell(row.get(column)) for column in columns])
+        tokens = len(tokenizer(line))
+        # The first row is always kept so the output is never just a header
+        if included and used + tokens > token_budget:
+            break
+        lines.append(line)
+        used += tokens
+        included += 1
+
+    if included < len(rows):
+        lines.append(_summarize_omitted(columns, rows[included:]))
+    if truncated:
+        lines.append(
+            f"(The query returned more records, only the first {len(rows)} were fetched.)"
+        )
+    return "\n".join(lines)
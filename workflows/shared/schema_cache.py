@@ -0,0 +1,80 @@
+import hashlib
+import json
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+# Multilabeled nodes are removed from the schema shown to the LLM
+DEFAULT_EXCLUDED_TYPES = ["Actor", "Director"]
+
+
+def schema_version(schema: Dict[str, Any]) -> str:
+    return hashlib.sha256(
+        json.dumps(schema, sort_keys=True, default=str).encode()
+    ).hexdigest()[:12]
+
+
+class SchemaCache:
+    def __init__(
+        self,
+        graph_store,
+        exclude_types_sets: Iterable[List[str]] = ([], DEFAULT_EXCLUDED_TYPES),
+        snapshot: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Keep the rendered schema strings of a graph store so prompt construction
+        never has to touch the database.
+
+        :param graph_store: The Neo4jPropertyGraphStore whose schema is cached
+        :param exclude_types_sets: Exclusion sets to render up front
+        :param snapshot: Output of to_snapshot() to restore instead of rendering
+        """
+        self.graph_store = graph_store
+        self._exclude_types_sets = [frozenset(types) for types in exclude_types_sets]
+        self._schema_strs: Dict[FrozenSet[str], str] = {}
+        self.schema = {}
+        self.version = ""
+        if snapshot:
+            self.restore(snapshot)
+        else:
+            self.rebuild()
+
+    def rebuild(self) -> None:
+        """
+        Re-render all cached schema strings from the schema held by the graph store.
+        """
+        schema = self.graph_store.get_schema()
+        schema_strs = {
+            key: self.graph_store.get_schema_str(exclude_types=list(key))
+            for key in {*self._exclude_types_sets, *self._schema_strs}
+        }
+        # Swap in one assignment so readers never see a half-built cache
+        self._schema_strs = schema_strs
+        self.schema = schema
+        self.version = schema_version(schema)
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        return {
+            "schema": self.schema,
+            "schema_strs": [
+                [sorted(key), schema_str] for key, schema_str in self._schema_strs.items()
+            ],
+        }
+
+    def restore(self, snapshot: Dict[str, Any]) -> None:
+        """
+        Use the schema and schema strings of a snapshot, the graph store is
+        expected to hold the same schema.
+        """
+        self._schema_strs = {
+            frozenset(key): schema_str for key, schema_str in snapshot["schema_strs"]
+        }
+        self.schema = snapshot["schema"]
+        self.version = schema_version(self.schema)
+
+    def get_schema_str(self, exclude_types: List[str] = []) -> str:
+        key = frozenset(exclude_types)
+        schema_str = self._schema_strs.get(key)
+        if schema_str is None:
+            # Rendering only uses the in-memory schema, no database round-trip
+            schema_str = self.graph_store.get_schema_str(exclude_types=exclude_types)
+            self._schema_strs = {**self._schema_strs, key: schema_str}
+        return schema_str
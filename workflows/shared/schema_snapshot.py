@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Labels, relationship types and property keys come from the token store and
+# are cheap to list, unlike the apoc.meta introspection behind the schema
+STRUCTURE_QUERY = """CALL db.labels() YIELD label
+WITH collect(label) AS labels
+CALL db.relationshipTypes() YIELD relationshipType
+WITH labels, collect(relationshipType) AS types
+CALL db.propertyKeys() YIELD propertyKey
+RETURN labels, types, collect(propertyKey) AS keys"""
+
+
+def structure_fingerprint(graph_store) -> str:
+    """
+    Hash of the labels, relationship types and property keys of the database.
+
+    Changes with the graph model but not with the data, so a snapshot whose
+    fingerprint still matches doesn't need a full introspection.
+    """
+    row = graph_store.structured_query(STRUCTURE_QUERY)[0]
+    structure = {key: sorted(row[key]) for key in ("labels", "types", "keys")}
+    return hashlib.sha256(json.dumps(structure).encode()).hexdigest()[:12]
+
+
+class SchemaSnapshotStore:
+    def __init__(self, directory: str):
+        """
+        Persist the introspected schema of each database as a JSON file, so a
+        restarted app can serve without introspecting the databases first.
+
+        :param directory: Directory the snapshot files are written to
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, uri: str, username: str, database: Optional[str]) -> Path:
+        key = json.dumps([uri, username, database])
+        return self.directory / f"{hashlib.sha256(key.encode()).hexdigest()[:16]}.json"
+
+    def load(
+        self, uri: str, username: str, database: Optional[str]
+    ) -> Optional[Dict[str, Any]]:
+        path = self.path(uri, username, database)
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text())
+        except (OSError, json.JSONDecodeError) as ex:
+            print(f"Ignoring unreadable schema snapshot {path}: {ex}")
+            return None
+
+    def save(
+        self,
+        uri: str,
+        username: str,
+        database: Optional[str],
+        fingerprint: str,
+        schema_cache,
+        corrector_schema: List[Any],
+    ) -> None:
+        snapshot = {
+            "fingerprint": fingerprint,
+            "created": time.time(),
+            **schema_cache.to_snapshot(),
+            "corrector_schema": [list(el) for el in corrector_schema],
+        }
+        # Write and rename, replicas sharing the directory never read half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f, default=str)
+        os.replace(tmp_path, self.path(uri, username, database))
@@ -0,0 +1,85 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from llama_index.core.llms import LLM
+
+
+class SpeculativeCypherGenerator:
+    def __init__(
+        self,
+        llm_names: Sequence[str] = (),
+        get_llm: Optional[Callable[[str], Optional[LLM]]] = None,
+    ):
+        """
+        Generate Cypher with several LLMs at once and keep the first statement
+        that passes validation, instead of correcting one candidate at a time.
+
+        :param llm_names: LLMs that generate alongside the workflow's LLM, none
+            disables speculation
+        :param get_llm: Looks up an LLM by name, e.g. ResourceManager.get_model_by_name
+        """
+        self.llm_names = list(llm_names)
+        self.get_llm = get_llm
+        self._llms: Optional[List[LLM]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.llm_names)
+
+    async def candidate_llms(self, llm: LLM) -> List[LLM]:
+        if self._llms is None:
+            # Clients are created on first use and some check the model over the network
+            self._llms = await asyncio.to_thread(
+                lambda: [self.get_llm(name) for name in self.llm_names]
+            )
+        # At temperature 0 the same model would only repeat the statement
+        llms = {llm.model: llm}
+        for candidate in self._llms:
+            if candidate is not None:
+                llms.setdefault(candidate.model, candidate)
+        return list(llms.values())
+
+    async def generate_with_llm(
+        self,
+        llm: LLM,
+        generate: Callable[[LLM], Awaitable[str]],
+        validator,
+    ) -> Tuple[str, LLM]:
+        """
+        Run generate with the workflow's LLM and every speculative LLM concurrently.
+
+        Returns the first statement without validation errors and the LLM that
+        wrote it, and cancels the remaining candidates. When none is valid, the
+        workflow LLM's statement is returned so the usual correction takes over.
+        """
+        if not self.enabled:
+            return await generate(llm), llm
+
+        async def candidate(candidate_llm: LLM) -> tuple:
+            cypher = await generate(candidate_llm)
+            return cypher, await validator.validate(cypher), candidate_llm
+
+        llms = await self.candidate_llms(llm)
+        tasks = [asyncio.create_task(candidate(candidate_llm)) for candidate_llm in llms]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    cypher, errors, candidate_llm = await next_done
+                except Exception as ex:
+                    print(f"Speculative Cypher generation failed: {ex}")
+                    continue
+                if not errors:
+                    return cypher, candidate_llm
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Collect the cancelled candidates, so their errors and LLM calls end here
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        # All candidates finished, the workflow LLM's error is raised if it failed
+        if tasks[0].exception() is None:
+            return tasks[0].result()[0], llms[0]
+        for candidate_llm, task in zip(llms[1:], tasks[1:]):
+            if task.exception() is None:
+                return task.result()[0], candidate_llm
+        raise tasks[0].exception()
@@ -4,3 +4,7 @@ from llama_index.core.workflow import Event
 class SseEvent(Event):
     label: str
     message: str
+
+
+class StepMetricsEvent(SseEvent):
+    metrics: dict
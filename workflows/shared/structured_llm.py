@@ -0,0 +1,30 @@
+from collections import OrderedDict
+from typing import Tuple, Type
+
+from llama_index.core.llms import LLM
+from llama_index.core.llms.structured_llm import StructuredLLM
+from pydantic import BaseModel
+
+# Enough for every (LLM, output class) pair of the configured LLMs, per-run
+# wrappers like the benchmark's rate limited LLMs are evicted
+STRUCTURED_LLM_CACHE_SIZE = 256
+
+# The LLM is kept next to its wrapper, so its id can't be reused by another LLM
+_structured_llms: "OrderedDict[Tuple[int, Type[BaseModel]], Tuple[LLM, StructuredLLM]]" = (
+    OrderedDict()
+)
+
+
+def structured_llm(llm: LLM, output_cls: Type[BaseModel]) -> StructuredLLM:
+    """
+    Return the structured output wrapper of an LLM for an output class, built
+    on first use and shared by all later calls instead of once per step call.
+    """
+    key = (id(llm), output_cls)
+    if key in _structured_llms:
+        _structured_llms.move_to_end(key)
+    else:
+        _structured_llms[key] = (llm, llm.as_structured_llm(output_cls))
+        if len(_structured_llms) > STRUCTURED_LLM_CACHE_SIZE:
+            _structured_llms.popitem(last=False)
+    return _structured_llms[key][1]
@@ -5,17 +5,25 @@ from workflows.steps.iterative_planner.final_answer import (
 from workflows.steps.iterative_planner.generate_cypher import generate_cypher_step
 from workflows.steps.iterative_planner.guardrails import guardrails_step
 from workflows.steps.iterative_planner.information_check import (
+    format_subqueries_for_prompt,
     information_check_step,
 )
-from workflows.steps.iterative_planner.initial_plan import initial_plan_step
+from workflows.steps.iterative_planner.initial_plan import (
+    PlannedSubquery,
+    format_plan,
+    initial_plan_step,
+)
 from workflows.steps.iterative_planner.validate_cypher import validate_cypher_step
 
 __all__ = [
     "guardrails_step",
     "initial_plan_step",
+    "PlannedSubquery",
+    "format_plan",
     "generate_cypher_step",
     "validate_cypher_step",
     "correct_cypher_step",
     "information_check_step",
+    "format_subqueries_for_prompt",
     "get_final_answer_prompt",
 ]
@@ -20,9 +20,13 @@ If clarification or additional information is needed, explain why and specify wh
 """
 
 
-def get_final_answer_prompt():
-    final_answer_msgs = [
+FINAL_ANSWER_PROMPT = ChatPromptTemplate.from_messages(
+    [
         ("system", FINAL_ANSWER_SYSTEM_TEMPLATE),
         ("user", FINAL_ANSWER_USER_TEMPLATE),
     ]
-    return ChatPromptTemplate.from_messages(final_answer_msgs)
+)
+
+
+def get_final_answer_prompt():
+    return FINAL_ANSWER_PROMPT
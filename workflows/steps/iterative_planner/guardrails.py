@@ -3,6 +3,8 @@ from typing import Literal
 from llama_index.core import ChatPromptTemplate
 from pydantic import BaseModel, Field
 
+from workflows.shared.structured_llm import structured_llm
+
 
 class Guardrail(BaseModel):
     """Guardrail"""
@@ -18,17 +20,17 @@ To make this decision, assess the content of the question and determine if it re
 or related topics. Provide only the specified output: "movie" or "end"."""
 
 
-async def guardrails_step(llm, question):
-    # Refine Prompt
-    chat_refine_msgs = [
+GUARDRAILS_PROMPT = ChatPromptTemplate.from_messages(
+    [
         ("system", GUARDRAILS_SYSTEM_PROMPT_TEMPLATE),
         ("user", "The question is: {question}"),
     ]
+)
 
-    guardrails_template = ChatPromptTemplate.from_messages(chat_refine_msgs)
 
-    guardrails_output = await llm.as_structured_llm(Guardrail).acomplete(
-        guardrails_template.format(question=question)
+async def guardrails_step(llm, question):
+    guardrails_output = await structured_llm(llm, Guardrail).achat(
+        GUARDRAILS_PROMPT.format_messages(question=question)
     )
     guardrails_output = guardrails_output.raw.decision
 
@@ -1,11 +1,16 @@
 from typing import List, Optional
 
-from llama_index.core import ChatPromptTemplate
 from pydantic import BaseModel, Field
 
+from workflows.shared.prompt_cache import cacheable_messages
+from workflows.shared.record_format import DEFAULT_TOKEN_BUDGET, format_records
+from workflows.shared.structured_llm import structured_llm
+from workflows.steps.iterative_planner.initial_plan import PlannedSubquery
+
+# Nothing request specific in the system prompt, so it stays a cacheable prefix
 INFORMATION_CHECK_SYSTEM_TEMPLATE = """You are an expert assistant that evaluates whether a set of subqueries, their results, any existing condensed information, and the current query plan provide enough details to answer a given question. Your task is to:
 
-1. Analyze if the available information is sufficient to answer the original question: "{original_question}".
+1. Analyze if the available information is sufficient to answer the original question.
 2. Review the remaining steps in the query plan (if any) to determine if they:
    - Should be retained as is.
    - Need modification to address gaps.
@@ -44,14 +49,14 @@ INFORMATION_CHECK_SYSTEM_TEMPLATE = """You are an expert assistant that evaluate
    - If information is insufficient but fetchable:
      - Suggest additional subqueries to retrieve the missing details.
      - Ensure new subqueries are designed specifically to fill identified gaps.
-     - Organize all subqueries into parallel-executable groups wherever possible.
-     - Maintain sequential steps only when strict data dependencies exist.
+     - List for each subquery the positions (0-based) of the earlier subqueries whose results it needs, all others run in parallel.
+     - Add dependencies only when strict data dependencies exist.
    - If critical gaps exist that cannot be resolved due to failed subqueries, do not modify the query plan and clearly state why the task cannot be completed.
 
 ### Key Guidelines:
 - **Focus Only on Information Retrieval**: Limit query plans to fetching data and avoid reasoning/analysis tasks.
-- **Optimize for Parallel Execution**: Group queries into parallelizable blocks to reduce execution time.
-- **Maintain Sequential Order Only When Necessary**: Use sequential steps only when results of one query depend on another.
+- **Optimize for Parallel Execution**: Leave dependencies out wherever queries can run independently to reduce execution time.
+- **Declare Dependencies Only When Necessary**: Only make a query depend on another when it needs that query's results.
 - **Centralize Knowledge**:
    - Use the dynamic notebook to consolidate all available information.
    - Ensure it remains the authoritative source for answering the question and guiding further steps.
@@ -78,32 +83,35 @@ class IFOutput(BaseModel):
     dynamic_notebook: str = Field(
         description="A continuously updated and refined summary integrating subquery results and condensed information. Serves as the central knowledge base to address the original question and guide further subqueries if necessary."
     )
-    modified_plan: Optional[List[List[str]]] = Field(
-        description="Modified version of the remaining plan steps. Each group contains queries that can be executed in parallel. Null if no remaining plan exists, all gaps have been addressed, or the task is unsolvable due to missing critical information."
+    modified_plan: Optional[List[PlannedSubquery]] = Field(
+        description="Modified version of the remaining plan steps. Each query lists the positions (0-based) of the earlier queries of this plan whose results it needs, queries without dependencies are executed in parallel. Null if no remaining plan exists, all gaps have been addressed, or the task is unsolvable due to missing critical information."
     )
 
 
-def format_subqueries_for_prompt(information_checks: list) -> str:
+def format_subqueries_for_prompt(
+    information_checks: list, token_budget: int = DEFAULT_TOKEN_BUDGET
+) -> str:
     """
     Converts a list of InformationCheck objects into a string that can be added to a prompt.
 
     Args:
         information_checks (List[InformationCheck]): List of information checks to process.
+        token_budget (int): Tokens of database output, split evenly between the subqueries.
 
     Returns:
         str: A formatted string representing subqueries and their results.
     """
     subqueries_and_results = []
+    subquery_budget = token_budget // max(1, len(information_checks))
 
     for check in information_checks:
-        # Extract the first result if available, otherwise use "No result available."
-        result = (
-            check.database_output[0]
-            if check.database_output
-            else "No result available."
+        result = format_records(
+            check.database_output,
+            token_budget=subquery_budget,
+            truncated=check.truncated,
         )
         subqueries_and_results.append(
-            f"- Subquery: {check.subquery}\n  Result: {result}"
+            f"- Subquery: {check.subquery}\n  Result:\n{result}"
         )
 
     return "\n".join(subqueries_and_results)
@@ -112,21 +120,19 @@ def format_subqueries_for_prompt(information_checks: list) -> str:
 async def information_check_step(
     llm, subquery_events, original_question, dynamic_notebook, plan
 ):
-    information_check_msgs = [
-        ("system", INFORMATION_CHECK_SYSTEM_TEMPLATE),
-        ("user", INFORMATION_CHECK_USER_TEMPLATE),
-    ]
-
-    information_check_prompt = ChatPromptTemplate.from_messages(information_check_msgs)
-
     subqueries = format_subqueries_for_prompt(subquery_events)
 
-    llm_output = await llm.as_structured_llm(IFOutput).acomplete(
-        information_check_prompt.format(
-            subqueries=subqueries,
-            original_question=original_question,
-            dynamic_notebook=dynamic_notebook,
-            plan=plan,
+    llm_output = await structured_llm(llm, IFOutput).achat(
+        cacheable_messages(
+            llm,
+            INFORMATION_CHECK_SYSTEM_TEMPLATE,
+            "",
+            INFORMATION_CHECK_USER_TEMPLATE.format(
+                subqueries=subqueries,
+                question=original_question,
+                dynamic_notebook=dynamic_notebook,
+                plan=plan,
+            ),
         )
     )
     llm_output = llm_output.raw
@@ -1,17 +1,34 @@
 from typing import List
 
-from llama_index.core import ChatPromptTemplate
 from pydantic import BaseModel, Field
 
+from workflows.shared.prompt_cache import cacheable_messages
+from workflows.shared.structured_llm import structured_llm
+
+
+class PlannedSubquery(BaseModel):
+    """A retrieval query of the plan and the earlier queries whose results it needs."""
+
+    query: str = Field(
+        description="A specific information retrieval request, no reasoning or comparison"
+    )
+    depends_on: List[int] = Field(
+        default_factory=list,
+        description=(
+            "Positions (0-based) in the plan of the earlier queries whose results this "
+            "query needs. Empty when the query can be executed right away."
+        ),
+    )
+
 
 class SubqueriesOutput(BaseModel):
     """Defines the output format for transforming a question into parallel-optimized retrieval steps."""
 
-    plan: List[List[str]] = Field(
+    plan: List[PlannedSubquery] = Field(
         description=(
-            """A list of query groups where:
-        - Each group (inner list) contains queries that can be executed in parallel
-        - Groups are ordered by dependency (earlier groups must be executed before later ones)
+            """A list of queries where:
+        - Queries without dependencies are executed in parallel right away
+        - Each query lists only the earlier queries whose results it needs, and starts as soon as those are done
         - Each query must be a specific information retrieval request
         - Split into multiple steps only if intermediate results return ≤25 values
         - No reasoning or comparison tasks, only data fetching queries"""
@@ -22,41 +39,45 @@ class SubqueriesOutput(BaseModel):
 SUBQUERIES_SYSTEM_TEMPLATE = """You are a query planning optimizer. Your task is to break down complex questions into efficient, parallel-optimized retrieval steps. Focus ONLY on information retrieval queries, not analysis or reasoning steps.
 
 Key Requirements:
-- Group queries that can be executed in parallel into the same list
-- Order groups based on data dependencies
+- List every query with the positions (0-based) of the earlier queries whose results it needs in `depends_on`
+- Leave `depends_on` empty for queries that can be executed right away, they run in parallel
+- Only add a dependency when the query can't be written without the other query's results
 - Include ONLY specific information retrieval queries
 - Split into multiple steps ONLY if intermediate query results return ≤25 distinct values
 - Exclude reasoning tasks, comparisons, or analysis steps
 - Prioritize queries that can be executed first and in parallel
 
-For simple, directly answerable questions, return a single query in a single group.
+For simple, directly answerable questions, return a single query without dependencies.
 
 Example 1:
 User: "What was the impact of the 2008 financial crisis on Bank of America's stock price and employee count?"
 Assistant: [
-    # Group 1 - Single group since we're only looking at one company's metrics
-    [
-        "What was Bank of America's stock price history and employee count from 2007 to 2009?"
-    ]
+    # Single query since we're only looking at one company's metrics
+    {"query": "What was Bank of America's stock price history and employee count from 2007 to 2009?", "depends_on": []}
 ]
 
 Example 2:
 User: "Compare the performance of Tesla's Model 3 with BMW's competing models in terms of range and acceleration."
 Assistant: [
-    # Group 1 - Basic specs can be fetched in parallel, BMW has <25 competing models
-    [
-        "What is the Tesla Model 3's EPA range and 0-60 mph acceleration time?",
-        "What are the EPA ranges and 0-60 mph acceleration times of BMW models competing with Tesla Model 3?"
-    ]
+    # Basic specs can be fetched in parallel, BMW has <25 competing models
+    {"query": "What is the Tesla Model 3's EPA range and 0-60 mph acceleration time?", "depends_on": []},
+    {"query": "What are the EPA ranges and 0-60 mph acceleration times of BMW models competing with Tesla Model 3?", "depends_on": []}
 ]
 
 Example 3:
 User: "List the stock performance of all S&P 500 companies in 2022."
 Assistant: [
-    # Group 1 - Single query since result set would be >25 values
-    [
-        "What was the stock performance of all S&P 500 companies in 2022?"
-    ]
+    # Single query since result set would be >25 values
+    {"query": "What was the stock performance of all S&P 500 companies in 2022?", "depends_on": []}
+]
+
+Example 4:
+User: "Which movies did the director of Inception make in the 1990s, and what is the top rated movie of 2010?"
+Assistant: [
+    # The 1990s movies need the director, the top rated movie doesn't wait for either
+    {"query": "Who directed Inception?", "depends_on": []},
+    {"query": "Which movies did this director make between 1990 and 1999?", "depends_on": [0]},
+    {"query": "What is the top rated movie released in 2010?", "depends_on": []}
 ]
 
 Remember:
@@ -69,16 +90,23 @@ Remember:
 - Prioritize independent queries first"""
 
 
-async def initial_plan_step(llm, question):
-    query_decompose_msgs = [
-        ("system", SUBQUERIES_SYSTEM_TEMPLATE),
-        ("user", "{question}"),
-    ]
+def format_plan(plan: List[PlannedSubquery]) -> str:
+    # One line per subquery, with the positions of the subqueries it waits for
+    return "".join(
+        f"\n{position}. {subquery.query}"
+        + (
+            f" (after {', '.join(str(dep) for dep in subquery.depends_on)})"
+            if subquery.depends_on
+            else ""
+        )
+        for position, subquery in enumerate(plan)
+    )
 
-    subquery_template = ChatPromptTemplate.from_messages(query_decompose_msgs)
 
-    queries_output = await llm.as_structured_llm(SubqueriesOutput).acomplete(
-        subquery_template.format(question=question)
+async def initial_plan_step(llm, question):
+    # The planning instructions are the cacheable prefix, only the question changes
+    queries_output = await structured_llm(llm, SubqueriesOutput).achat(
+        cacheable_messages(llm, SUBQUERIES_SYSTEM_TEMPLATE, "", question)
     )
 
     return {
@@ -1,7 +1,6 @@
 from typing import List, Optional
 
 from llama_index.core import ChatPromptTemplate
-from neo4j.exceptions import CypherSyntaxError
 from pydantic import BaseModel, Field
 
 VALIDATE_CYPHER_SYSTEM_TEMPLATE = """You are a specialized parser focused on analyzing Cypher query statements to extract node property filters. Your task is to identify and extract properties used in WHERE clauses and pattern matching conditions, but only when they contain explicit literal values.
@@ -104,6 +103,7 @@ class ValidateCypherOutput(BaseModel):
 async def validate_cypher_step(
     llm,
     graph_store,
+    cypher_validator,
     question,
     cypher,
     cypher_query_corrector,
@@ -114,11 +114,9 @@ async def validate_cypher_step(
     errors = []
     mapping_errors = []
 
-    # Check for syntax errors
-    try:
-        graph_store.structured_query(f"EXPLAIN {cypher}")
-    except CypherSyntaxError as e:
-        errors.append(e.message)
+    # Check for syntax and schema errors, EXPLAIN only runs if the local check passes
+    validation_errors, warnings = await cypher_validator.check(cypher)
+    errors.extend(validation_errors)
 
     # Experimental feature for correcting relationship directions
     corrected_cypher = cypher_query_corrector(cypher)
@@ -179,6 +177,7 @@ async def validate_cypher_step(
         "next_action": next_action,
         "cypher_statement": corrected_cypher,
         "cypher_errors": errors,
+        "cypher_warnings": warnings,
         "mapping_errors": mapping_errors,
         "steps": ["validate_cypher"],
     }
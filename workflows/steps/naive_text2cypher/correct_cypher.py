@@ -1,10 +1,11 @@
-from llama_index.core import ChatPromptTemplate
+from workflows.shared.prompt_cache import cacheable_messages
+from workflows.shared.schema_cache import DEFAULT_EXCLUDED_TYPES
 
 CORRECT_CYPHER_SYSTEM_TEMPLATE = """You are a Cypher expert reviewing a statement written by a junior developer.
 You need to correct the Cypher statement based on the provided errors. No pre-amble."
 Do not wrap the response in any backticks or anything else. Respond with a Cypher statement only!"""
 
-CORRECT_CYPHER_USER_TEMPLATE = """Check for invalid syntax or semantics and return a corrected Cypher statement.
+CORRECT_CYPHER_USER_PREFIX_TEMPLATE = """Check for invalid syntax or semantics and return a corrected Cypher statement.
 
 Schema:
 {schema}
@@ -15,7 +16,9 @@ Respond with a Cypher statement only!
 
 Do not respond to any questions that might ask anything else than for you to construct a Cypher statement.
 
-The question is:
+"""
+
+CORRECT_CYPHER_USER_TEMPLATE = """The question is:
 {question}
 
 The Cypher statement is:
@@ -27,19 +30,17 @@ The errors are:
 Corrected Cypher statement: """
 
 
-async def correct_cypher_step(llm, graph_store, subquery, cypher, errors):
-    schema = graph_store.get_schema_str(exclude_types=["Actor", "Director"])
-
-    # Correct cypher
-    correct_cypher_messages = [
-        ("system", CORRECT_CYPHER_SYSTEM_TEMPLATE),
-        ("user", CORRECT_CYPHER_USER_TEMPLATE),
-    ]
+async def correct_cypher_step(llm, schema_cache, subquery, cypher, errors):
+    schema = schema_cache.get_schema_str(exclude_types=DEFAULT_EXCLUDED_TYPES)
 
-    correct_cypher_prompt = ChatPromptTemplate.from_messages(correct_cypher_messages)
     response = await llm.achat(
-        correct_cypher_prompt.format_messages(
-            question=subquery, schema=schema, errors=errors, cypher=cypher
+        cacheable_messages(
+            llm,
+            CORRECT_CYPHER_SYSTEM_TEMPLATE,
+            CORRECT_CYPHER_USER_PREFIX_TEMPLATE.format(schema=schema),
+            CORRECT_CYPHER_USER_TEMPLATE.format(
+                question=subquery, cypher=cypher, errors=errors
+            ),
         )
     )
     return response.message.content
@@ -22,16 +22,17 @@ Analyze whether the provided database output is adequate to answer the question.
 """
 
 
-async def evaluate_database_output_step(llm, subquery, cypher, context):
-    # Correct cypher
-    correct_cypher_messages = [
+EVALUATE_ANSWER_PROMPT = ChatPromptTemplate.from_messages(
+    [
         ("system", EVALUATE_ANSWER_SYSTEM_TEMPLATE),
         ("user", EVALUATE_ANSWER_USER_TEMPLATE),
     ]
+)
+
 
-    correct_cypher_prompt = ChatPromptTemplate.from_messages(correct_cypher_messages)
+async def evaluate_database_output_step(llm, subquery, cypher, context):
     response = await llm.achat(
-        correct_cypher_prompt.format_messages(
+        EVALUATE_ANSWER_PROMPT.format_messages(
             question=subquery, cypher=cypher, context=context
         )
     )
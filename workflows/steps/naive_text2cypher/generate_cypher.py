@@ -1,14 +1,19 @@
-from llama_index.core import ChatPromptTemplate
+from workflows.shared.prompt_cache import cacheable_messages
+from workflows.shared.schema_cache import DEFAULT_EXCLUDED_TYPES
 
 GENERATE_SYSTEM_TEMPLATE = """Given an input question, convert it to a Cypher query. No pre-amble.
 Do not wrap the response in any backticks or anything else. Respond with a Cypher statement only!"""
 
-GENERATE_USER_TEMPLATE = """You are a Neo4j expert. Given an input question, create a syntactically correct Cypher query to run.
+# The schema is the same on every call and goes into the cacheable prefix, the
+# fewshot examples are retrieved per question and go after it
+GENERATE_USER_PREFIX_TEMPLATE = """You are a Neo4j expert. Given an input question, create a syntactically correct Cypher query to run.
 Do not wrap the response in any backticks or anything else. Respond with a Cypher statement only!
 Here is the schema information
 {schema}
 
-Below are a number of examples of questions and their corresponding Cypher queries.
+"""
+
+GENERATE_USER_TEMPLATE = """Below are a number of examples of questions and their corresponding Cypher queries.
 
 {fewshot_examples}
 
@@ -16,18 +21,17 @@ User input: {question}
 Cypher query:"""
 
 
-async def generate_cypher_step(llm, graph_store, subquery, fewshot_examples):
-    # Remove multilabeled nodes
-    schema = graph_store.get_schema_str(exclude_types=["Actor", "Director"])
-    generate_cypher_msgs = [
-        ("system", GENERATE_SYSTEM_TEMPLATE),
-        ("user", GENERATE_USER_TEMPLATE),
-    ]
-    text2cypher_prompt = ChatPromptTemplate.from_messages(generate_cypher_msgs)
+async def generate_cypher_step(llm, schema_cache, subquery, fewshot_examples):
+    schema = schema_cache.get_schema_str(exclude_types=DEFAULT_EXCLUDED_TYPES)
 
     response = await llm.achat(
-        text2cypher_prompt.format_messages(
-            question=subquery, schema=schema, fewshot_examples=fewshot_examples
+        cacheable_messages(
+            llm,
+            GENERATE_SYSTEM_TEMPLATE,
+            GENERATE_USER_PREFIX_TEMPLATE.format(schema=schema),
+            GENERATE_USER_TEMPLATE.format(
+                question=subquery, fewshot_examples=fewshot_examples
+            ),
         )
     )
 
@@ -29,10 +29,13 @@ If clarification or additional information is needed, explain why and specify wh
 """
 
 
-def get_naive_final_answer_prompt():
-    final_answer_msgs = [
+NAIVE_FINAL_ANSWER_PROMPT = ChatPromptTemplate.from_messages(
+    [
         ("system", FINAL_ANSWER_SYSTEM_TEMPLATE),
         ("user", FINAL_ANSWER_USER_TEMPLATE),
     ]
+)
+
 
-    return ChatPromptTemplate.from_messages(final_answer_msgs)
+def get_naive_final_answer_prompt():
+    return NAIVE_FINAL_ANSWER_PROMPT
@@ -9,8 +9,9 @@ from llama_index.core.workflow import (
     step,
 )
 
-from workflows.shared.local_fewshot_manager import LocalFewshotManager
-from workflows.shared.neo4j_fewshot_manager import Neo4jFewshotManager
+from workflows.shared.cypher_executor import DEFAULT_RECORD_LIMIT
+from workflows.shared.metrics import instrument_step, record_retry
+from workflows.shared.record_format import format_records
 from workflows.shared.sse_event import SseEvent
 from workflows.shared.utils import check_ok
 from workflows.steps.naive_text2cypher import (
@@ -50,42 +51,71 @@ class NaiveText2CypherRetryCheckFlow(Workflow):
 
     def __init__(self, llm, db, embed_model, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        print(f"WORKFLOW INITIALIZING: {llm}, {db}, {embed_model}")
         self.llm = llm
         self.graph_store = db["graph_store"]
+        self.executor = db["executor"]
+        self.schema_cache = db["schema_cache"]
+        self.cypher_cache = db["cypher_cache"]
+        self.cypher_validator = db["cypher_validator"]
+        self.speculative_generator = db["speculative_generator"]
         self.embed_model = embed_model
         self.db_name = db["name"]
-        
-        print(f"WORKFLOW INITIALIZED: {self.llm}, {self.graph_store}, {self.embed_model}, {self.db_name}")
 
         # Fewshot graph store allows for self learning loop by storing new examples
-        self.fewshot_manager = Neo4jFewshotManager()
+        self.fewshot_manager = db["neo4j_fewshot_manager"]
         if self.fewshot_manager.graph_store:
-            self.fewshot_retriever = self.fewshot_manager.retrieve_fewshots
+            self.fewshot_retriever = self.fewshot_manager.aretrieve_fewshots
         else:
-            self.fewshot_retriever = LocalFewshotManager().retrieve_fewshots
+            self.fewshot_retriever = db["local_fewshot_manager"].aretrieve_fewshots
 
     @step
+    @instrument_step
     async def generate_cypher(self, ctx: Context, ev: StartEvent) -> ExecuteCypherEvent:
         # Init global vars
         await ctx.set("retries", 0)
 
         question = ev.input
 
-        fewshot_examples = self.fewshot_retriever(
-            question, self.db_name, self.embed_model
-        )
+        generated_by = self.llm
+
+        # Fewshot retrieval is only needed on a cache miss
+        async def generate():
+            nonlocal generated_by
+            fewshot_examples = await self.fewshot_retriever(
+                question, self.db_name, self.embed_model
+            )
 
-        cypher_query = await generate_cypher_step(
-            llm=self.llm,
-            graph_store=self.graph_store,
-            subquery=question,
-            fewshot_examples=fewshot_examples,
+            # With speculation enabled, the first valid statement of several LLMs wins
+            cypher, generated_by = await self.speculative_generator.generate_with_llm(
+                self.llm,
+                lambda llm: generate_cypher_step(
+                    llm=llm,
+                    schema_cache=self.schema_cache,
+                    subquery=question,
+                    fewshot_examples=fewshot_examples,
+                ),
+                self.cypher_validator,
+            )
+            return cypher
+
+        cypher_query, cache_entry = await self.cypher_cache.get_or_generate(
+            database=self.db_name,
+            schema_version=self.schema_cache.version,
+            llm_name=self.llm.model,
+            question=question,
+            generate=generate,
+            embed_model=self.embed_model,
         )
+        # Entries are keyed by the workflow's LLM, other LLMs' statements stay out
+        if generated_by.model != self.llm.model:
+            cache_entry = None
+        # Stored once the statement, or its correction, passed the evaluation
+        await ctx.set("cache_entry", cache_entry)
         # Return for the next step
         return ExecuteCypherEvent(question=question, cypher=cypher_query)
 
     @step
+    @instrument_step
     async def execute_query(
         self, ctx: Context, ev: ExecuteCypherEvent
     ) -> EvaluateEvent | CorrectCypherEvent:
@@ -96,10 +126,12 @@ class NaiveText2CypherRetryCheckFlow(Workflow):
             SseEvent(message=f"Executing Cypher: {ev.cypher}", label="Cypher execution")
         )
         try:
-            # Hard limit to 100 records
-            database_output = str(self.graph_store.structured_query(ev.cypher)[:100])
+            # Only the first records are fetched, the rest is discarded by the server
+            records = await self.executor.run(ev.cypher, limit=DEFAULT_RECORD_LIMIT)
+            database_output = format_records(records, truncated=records.truncated)
         except Exception as e:
             database_output = str(e)
+            await self.cypher_cache.invalidate(await ctx.get("cache_entry"))
             ctx.write_event_to_stream(
                 SseEvent(
                     message=f"Cypher Execution error: {database_output}",
@@ -109,6 +141,7 @@ class NaiveText2CypherRetryCheckFlow(Workflow):
             # Retry
             if retries < self.max_retries:
                 await ctx.set("retries", retries + 1)
+                record_retry()
                 return CorrectCypherEvent(
                     question=ev.question, cypher=ev.cypher, error=database_output
                 )
@@ -122,6 +155,7 @@ class NaiveText2CypherRetryCheckFlow(Workflow):
         )
 
     @step
+    @instrument_step
     async def evaluate_context(
         self, ctx: Context, ev: EvaluateEvent
     ) -> SummarizeEvent | CorrectCypherEvent:
@@ -130,8 +164,14 @@ class NaiveText2CypherRetryCheckFlow(Workflow):
         evaluation = await evaluate_database_output_step(
             self.llm, ev.question, ev.cypher, ev.context
         )
+        cache_entry = await ctx.get("cache_entry")
+        if check_ok(evaluation):
+            await self.cypher_cache.put(cache_entry, ev.cypher)
+        else:
+            await self.cypher_cache.invalidate(cache_entry)
         if retries < self.max_retries and not evaluation == "Ok":
             await ctx.set("retries", retries + 1)
+            record_retry()
             return CorrectCypherEvent(
                 question=ev.question, cypher=ev.cypher, error=evaluation
             )
@@ -143,6 +183,7 @@ class NaiveText2CypherRetryCheckFlow(Workflow):
         )
 
     @step
+    @instrument_step
     async def correct_cypher_step(
         self, ctx: Context, ev: CorrectCypherEvent
     ) -> ExecuteCypherEvent:
@@ -152,19 +193,28 @@ class NaiveText2CypherRetryCheckFlow(Workflow):
                 label="Cypher correction",
             )
         )
-        results = await correct_cypher_step(
+        results, corrected_by = await self.speculative_generator.generate_with_llm(
             self.llm,
-            self.graph_store,
-            ev.question,
-            ev.cypher,
-            ev.error,
+            lambda llm: correct_cypher_step(
+                llm,
+                self.schema_cache,
+                ev.question,
+                ev.cypher,
+                ev.error,
+            ),
+            self.cypher_validator,
         )
+        if corrected_by.model != self.llm.model:
+            # Not the workflow LLM's statement, so it isn't cached under its name
+            await ctx.set("cache_entry", None)
         return ExecuteCypherEvent(question=ev.question, cypher=results)
 
     @step
+    @instrument_step
     async def summarize_answer(self, ctx: Context, ev: SummarizeEvent) -> StopEvent:
         retries = await ctx.get("retries")
         
+        # Learned examples are queued and written in the background
         if retries > 0:
             # If retry was successful:
             if check_ok(ev.evaluation):